@@ -0,0 +1,172 @@
+import logging
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .llm import CHAT_SYSTEM_PROMPT
+from .purge import chat_history_floor
+
+logger = logging.getLogger('api')
+
+# Words and punctuation marks; words longer than six characters are counted as
+# several tokens since BPE vocabularies split them
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+# Fixed cost OpenAI charges per message (role and separators) and per reply priming
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+TRUNCATION_MARKER = " ...[truncated]"
+SUMMARY_SNIPPET_TOKENS = 20
+
+
+def _piece_tokens(piece):
+    return 1 + (len(piece) - 1) // 6
+
+
+def count_tokens(text):
+    """
+    Estimate how many tokens a model would see for text.
+
+    A local approximation of the GPT tokenizers (one token per common word or
+    punctuation mark, more for long words), close enough for budgeting
+    without shipping a tokenizer.
+    """
+    return sum(_piece_tokens(piece) for piece in _TOKEN_PIECES.findall(text or ''))
+
+
+def truncate_to_tokens(text, limit):
+    """Cut text after `limit` estimated tokens, marking the cut"""
+    total = 0
+    for match in _TOKEN_PIECES.finditer(text or ''):
+        total += _piece_tokens(match.group())
+        if total > limit:
+            return text[:match.start()].rstrip() + TRUNCATION_MARKER
+    return text
+
+
+def message_tokens(message):
+    return count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _summary_cache_key(user_id):
+    return f'chat-summary:{user_id}'
+
+
+def clear_conversation_summary(user_id):
+    cache.delete(_summary_cache_key(user_id))
+
+
+def _summary_line(role, content):
+    snippet = truncate_to_tokens(' '.join(content.split()), SUMMARY_SNIPPET_TOKENS)
+    return f"{role}: {snippet}"
+
+
+def _trim_summary(lines):
+    """Keep the newest summary lines that fit in CHAT_SUMMARY_TOKEN_LIMIT"""
+    kept = []
+    total = 0
+    for line in reversed(lines):
+        total += count_tokens(line)
+        if total > settings.CHAT_SUMMARY_TOKEN_LIMIT:
+            break
+        kept.append(line)
+    return list(reversed(kept))
+
+
+def _rolling_summary(user, before_id):
+    """
+    Return summary lines for the user's messages older than `before_id`.
+
+    The summary is cached per user together with the id of the newest message
+    folded into it, so each call only reads the messages that scrolled out of
+    the history window since the previous call.
+    """
+    from .models import ChatMessage
+
+    key = _summary_cache_key(user.id)
+    floor = chat_history_floor(user)
+    cached = cache.get(key)
+    if cached is None or cached['upto_id'] < floor:
+        # Nothing cached, or cached by a process that missed a clear_history
+        cached = {'upto_id': floor, 'lines': []}
+    if cached['upto_id'] >= before_id - 1:
+        return cached['lines']
+
+    new_rows = list(
+        ChatMessage.objects.filter(
+            user=user,
+            id__gt=cached['upto_id'],
+            id__lt=before_id
+        ).order_by('-id').values_list('id', 'role', 'content')[:settings.CHAT_SUMMARY_SOURCE_MESSAGES]
+    )
+    lines = _trim_summary(
+        cached['lines'] + [_summary_line(role, content) for _, role, content in reversed(new_rows)]
+    )
+    # Everything below before_id is now accounted for, including rows past the read limit
+    cache.set(key, {'upto_id': before_id - 1, 'lines': lines}, settings.CHAT_SUMMARY_CACHE_SECONDS)
+    return lines
+
+
+def build_chat_context(user, user_message):
+    """
+    Build the completion prompt for a chat message within the token budget.
+
+    The prompt holds the system prompt, a short summary of older turns, as
+    many recent turns as fit in CHAT_CONTEXT_TOKEN_BUDGET (newest first), and
+    the new message. Every message is capped at CHAT_MESSAGE_TOKEN_LIMIT so a
+    long paste cannot crowd out the rest. The new message must already be
+    saved; it is the newest row and is not repeated from history.
+
+    Returns:
+        tuple: (messages list for the completion call, estimated prompt tokens)
+    """
+    from .models import ChatMessage
+
+    limit = settings.CHAT_MESSAGE_TOKEN_LIMIT
+    system = {"role": "system", "content": CHAT_SYSTEM_PROMPT}
+    current = {"role": "user", "content": truncate_to_tokens(user_message, limit)}
+    used = REPLY_PRIMING_TOKENS + message_tokens(system) + message_tokens(current)
+
+    recent = list(
+        ChatMessage.objects.filter(user=user, id__gt=chat_history_floor(user)).order_by('-id').values_list(
+            'id', 'role', 'content'
+        )[:settings.CHAT_HISTORY_MESSAGES + 1]
+    )[1:]  # Skip the most recent one (current user message)
+
+    history = []
+    dropped = []
+    for index, (_, role, content) in enumerate(recent):
+        message = {"role": role, "content": truncate_to_tokens(content, limit)}
+        cost = message_tokens(message)
+        if used + cost > settings.CHAT_CONTEXT_TOKEN_BUDGET:
+            dropped = recent[index:]
+            break
+        history.append(message)
+        used += cost
+
+    summary_lines = []
+    if len(recent) == settings.CHAT_HISTORY_MESSAGES:
+        # There may be older messages outside the window
+        summary_lines = _rolling_summary(user, recent[-1][0])
+    summary_lines = _trim_summary(
+        summary_lines + [_summary_line(role, content) for _, role, content in reversed(dropped)]
+    )
+
+    messages = [system]
+    if summary_lines:
+        summary = {
+            "role": "system",
+            "content": "Summary of earlier messages:\n" + "\n".join(summary_lines)
+        }
+        cost = message_tokens(summary)
+        if used + cost <= settings.CHAT_CONTEXT_TOKEN_BUDGET:
+            messages.append(summary)
+            used += cost
+    messages.extend(reversed(history))
+    messages.append(current)
+
+    logger.info(
+        f"Chat context for user {user.id}: {len(history)} recent messages, "
+        f"{len(summary_lines)} summary lines, ~{used} prompt tokens"
+    )
+    return messages, used
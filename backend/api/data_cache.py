@@ -0,0 +1,312 @@
+import hashlib
+import json
+import secrets
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .timeseries import request_timezone
+
+_state = threading.local()
+
+
+def new_data_version():
+    """A data version: the time it was created plus a random token"""
+    return f'{time.time():.6f}-{secrets.token_hex(6)}'
+
+
+def data_version_timestamp(version):
+    """Return when a data version was created, as a Unix timestamp"""
+    return float(version.split('-', 1)[0])
+
+
+class UserDataCache:
+    """
+    Cache of read-endpoint payloads, invalidated per user by a data version.
+
+    Every write to a user's expenses, incomes, categories or subcategories
+    replaces the user's version with a new one (see api.signals).
+    Payloads are stored under keys that include the version current when
+    they were built, so a write makes all of the user's older entries
+    unreachable at once; they are then evicted by the cache's own culling or
+    expiry. Versions carry a random token rather than a counter, so two
+    concurrent bumps can never collapse into one, and a version lost to
+    eviction is replaced by one no stored payload was built with.
+
+    Hit, miss and invalidation counters are kept per process and per namespace.
+    `shared` tells whether other processes see the same versions, i.e. the
+    backend is not per-process memory.
+    """
+
+    def __init__(self, alias, ttl, shared=True):
+        self.alias = alias
+        self.ttl = ttl
+        self.shared = shared
+        self.hits = Counter()
+        self.misses = Counter()
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _version_key(user_id):
+        return f'data-version:{user_id}'
+
+    def version(self, user_id):
+        """Return the user's current data version, creating one if there is none"""
+        key = self._version_key(user_id)
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, new_data_version(), None)
+            version = self.cache.get(key)
+        return version
+
+    def bump(self, user_id):
+        """Give the user a new data version, invalidating every cached payload of theirs"""
+        self.cache.set(self._version_key(user_id), new_data_version(), None)
+        with self._lock:
+            self.invalidations += 1
+
+    def make_key(self, user_id, namespace, *parts):
+        """
+        Args:
+            user_id: Owner of the data the payload is built from
+            namespace: Endpoint the payload belongs to, e.g. 'expense-summary'
+            *parts: Anything else the payload depends on (query string, date, ...)
+        """
+        payload = json.dumps([str(part) for part in parts])
+        digest = hashlib.sha256(payload.encode()).hexdigest()[:32]
+        return f'data:{namespace}:{user_id}:{self.version(user_id)}:{digest}'
+
+    def get(self, namespace, key):
+        value = self.cache.get(key)
+        with self._lock:
+            if value is None:
+                self.misses[namespace] += 1
+            else:
+                self.hits[namespace] += 1
+        return value
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.ttl)
+
+    def stats(self):
+        with self._lock:
+            namespaces = {}
+            for namespace in sorted(set(self.hits) | set(self.misses)):
+                hits, misses = self.hits[namespace], self.misses[namespace]
+                namespaces[namespace] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+                }
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                'backend': settings.DATA_CACHE_BACKEND,
+                'ttl': self.ttl,
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+                'invalidations': self.invalidations,
+                'namespaces': namespaces,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+            self.invalidations = 0
+
+
+_data_cache = None
+_data_cache_lock = threading.Lock()
+
+
+def get_data_cache():
+    """
+    Return the process-wide payload cache, or None when DATA_CACHE_BACKEND is
+    empty (caching disabled) or not a backend this module knows.
+    """
+    global _data_cache
+    if settings.DATA_CACHE_BACKEND not in ('file', 'locmem'):
+        return None
+    if _data_cache is None:
+        with _data_cache_lock:
+            if _data_cache is None:
+                _data_cache = UserDataCache(
+                    settings.DATA_CACHE_ALIAS, settings.DATA_CACHE_TTL, shared=settings.DATA_CACHE_BACKEND != 'locmem'
+                )
+    return _data_cache
+
+
+def bump_data_version(user_id):
+    """
+    Invalidate a user's cached payloads after a write.
+
+    The version is bumped right away, so later reads in the same transaction
+    see the write, and again on commit, so a payload another request cached
+    from the pre-commit state in between is not served afterwards.
+    """
+    data_cache = get_data_cache()
+    if data_cache is None or user_id is None:
+        return
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending.add(user_id)
+        return
+    data_cache.bump(user_id)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: data_cache.bump(user_id))
+
+
+@contextmanager
+def deferred_data_version_bumps():
+    """
+    Collect data version bumps for the duration of the block and bump each
+    user once at the end.
+
+    Every saved or deleted row bumps its owner's version, and each bump is a
+    cache write (a file write with the 'file' backend), so cascades, bulk
+    deletes and purge batches would otherwise pay one per row. Users are
+    bumped even when the block fails: part of it may have been written.
+    """
+    if getattr(_state, 'pending', None) is not None:
+        # Nested block: the outermost one will flush
+        yield
+        return
+
+    _state.pending = set()
+    try:
+        yield
+    finally:
+        pending = _state.pending
+        _state.pending = None
+        for user_id in pending:
+            bump_data_version(user_id)
+
+
+class UserDataCacheMixin:
+    """
+    Lets viewset actions serve their payload from the user data cache.
+
+    Only 200 responses are stored. The key covers the full request URL
+    (query string and host included, since paginated payloads carry absolute
+    links), plus whatever extra parts the action passes in.
+    """
+
+    def cached_response(self, request, namespace, respond, *parts):
+        """
+        Args:
+            request: The current request; its user owns the cached payload
+            namespace: Name of the cached endpoint, used in keys and stats
+            respond: Callable building the Response on a miss
+            *parts: Anything else the payload depends on besides the URL
+
+        Returns:
+            Response: The cached payload, or the response of respond()
+        """
+        data_cache = get_data_cache()
+        if data_cache is None:
+            return respond()
+        key = data_cache.make_key(request.user.pk, namespace, request.build_absolute_uri(), *parts)
+        data = data_cache.get(namespace, key)
+        if data is not None:
+            return Response(data)
+        response = respond()
+        if response.status_code == status.HTTP_200_OK:
+            data_cache.set(key, response.data)
+        return response
+
+
+class NotModified(APIException):
+    """Raised by ConditionalGetMixin to short-circuit a request with a 304"""
+    status_code = status.HTTP_304_NOT_MODIFIED
+
+
+class ConditionalGetMixin:
+    """
+    ETag and Last-Modified support for the read actions of a viewset.
+
+    The validators are derived from the user's data version (see
+    UserDataCache), so checking them costs one cache lookup and no queries.
+    They are only sent when that version is kept in a store every worker
+    shares: with a per-process version, a write handled by another worker
+    would go unnoticed and a stale copy would be confirmed with a 304.
+    A matching If-None-Match (or, without one, If-Modified-Since) gets a 304
+    before the action runs, so nothing is queried or serialized. Only actions
+    listed in `conditional_actions` whose payload depends on nothing but the
+    user's versioned data (expenses, incomes, categories, subcategories and
+    the user row) may be listed.
+    """
+    conditional_actions = ('list', 'retrieve')
+
+    def conditional_validators(self, request):
+        """Return (etag, data version timestamp) for the request, or None when it is not cacheable"""
+        if request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions:
+            return None
+        data_cache = get_data_cache()
+        if data_cache is None or not data_cache.shared or not request.user.is_authenticated:
+            return None
+        version = data_cache.version(request.user.pk)
+        # The body also depends on the URL (query string included) and the negotiated
+        # renderer, and summaries on today's date in the timezone they are asked for
+        zone = request_timezone(request)
+        today = timezone.localdate(timezone=zone)
+        payload = '|'.join([
+            version, request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), today.isoformat()
+        ])
+        etag = quote_etag(hashlib.sha256(payload.encode()).hexdigest()[:32])
+        midnight = datetime.combine(today, datetime.min.time(), tzinfo=zone)
+        return etag, max(data_version_timestamp(version), midnight.timestamp())
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.validators = self.conditional_validators(request)
+        if self.validators is not None:
+            etag, last_modified = self.validators
+            if get_conditional_response(request._request, etag=etag, last_modified=int(last_modified)) is not None:
+                raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        validators = getattr(self, 'validators', None)
+        if validators is not None and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            etag, last_modified = validators
+            response['ETag'] = etag
+            # HTTP dates have one-second resolution: a date sent in the same second as the
+            # version was created could also cover a write later in that second
+            if time.time() - last_modified >= 1:
+                response['Last-Modified'] = http_date(int(last_modified))
+            if not response.has_header('Cache-Control'):
+                # Revalidate every time rather than trusting heuristic freshness
+                patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+@receiver(setting_changed)
+def _reset_data_cache(setting, **kwargs):
+    global _data_cache
+    if setting.startswith('DATA_CACHE_') or setting == 'CACHES':
+        _data_cache = None
@@ -0,0 +1,394 @@
+import csv
+import hashlib
+import io
+import logging
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .jobs import JobQueue
+from .rollups import refresh_expense_rollups, rollup_refresh_disabled, rollup_key
+
+logger = logging.getLogger('api')
+
+# Header spellings recognised for each expense field, compared case-insensitively
+COLUMN_ALIASES = {
+    'note': ('note', 'expense_note', 'description', 'memo', 'details', 'payee', 'merchant', 'name'),
+    'amount': ('amount', 'expense_amount', 'debit', 'value', 'total'),
+    'datetime': ('datetime', 'transaction_datetime', 'date', 'transaction date', 'posted date', 'posting date'),
+    # Not 'type': bank exports use it for Debit/Credit
+    'category': ('category',),
+}
+REQUIRED_COLUMNS = ('note', 'amount', 'datetime')
+# How spending is signed in the amount column: 'positive' (debit columns, most budgeting
+# exports) or 'negative' (signed bank ledgers). Rows of the other sign are credits
+# (refunds, deposits, payments in) and are skipped.
+AMOUNT_SIGNS = ('positive', 'negative')
+# Tried in order when the import has no date_format
+DATE_FORMATS = ('%m/%d/%Y', '%m/%d/%y', '%d %b %Y', '%d-%b-%Y', '%b %d, %Y')
+MAX_AMOUNT = Decimal('99999999.99')  # Expense.expense_amount has 10 digits, 2 decimal places
+MAX_REPORTED_ERRORS = 50
+# Statements repeat the same few dates, so parsed dates are memoized up to this many
+DATE_CACHE_SIZE = 10000
+
+import_queue = JobQueue(
+    'expense-import',
+    max_workers=settings.EXPENSE_IMPORT_WORKERS,
+    # Rows already written carry their fingerprint, so a retry skips them
+    max_retries=1,
+    retry_delay=5
+)
+
+
+class CSVImportError(Exception):
+    """Raised when a file cannot be imported at all (as opposed to a bad row)"""
+
+
+def normalize_note(note):
+    return ' '.join(note.lower().split())
+
+
+def expense_fingerprint(transaction_datetime, amount, note, occurrence):
+    """
+    Identify a statement row for duplicate detection.
+
+    `occurrence` counts identical (datetime, amount, note) rows earlier in the
+    same file, so two genuine identical purchases in one statement are both
+    imported while importing the statement again imports neither.
+    """
+    payload = f"{transaction_datetime.isoformat()}|{amount}|{normalize_note(note)}|{occurrence}"
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def parse_amount(value):
+    """
+    Parse a statement amount such as "1,234.50", "$12", "-8.00" or "(8.00)",
+    keeping its sign; parentheses mean negative.
+    """
+    text = (value or '').strip().replace(',', '').replace('$', '').replace(' ', '')
+    if text.startswith('(') and text.endswith(')'):
+        text = '-' + text[1:-1]
+    try:
+        amount = Decimal(text).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"invalid amount {value!r}")
+    if amount == 0 or abs(amount) > MAX_AMOUNT:
+        raise ValueError(f"amount {value!r} out of range")
+    return amount
+
+
+def parse_transaction_datetime(value, date_format=None):
+    text = (value or '').strip()
+    parsed = None
+    if date_format:
+        try:
+            parsed = datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+    else:
+        try:
+            parsed = parse_datetime(text)
+            if parsed is None:
+                day = parse_date(text)
+                parsed = datetime(day.year, day.month, day.day) if day else None
+        except ValueError:
+            parsed = None
+        for candidate in DATE_FORMATS:
+            if parsed is not None:
+                break
+            try:
+                parsed = datetime.strptime(text, candidate)
+            except ValueError:
+                continue
+    if parsed is None:
+        raise ValueError(f"invalid date {value!r}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class ExpenseCSVImporter:
+    """
+    Import a statement CSV as expenses for one user.
+
+    The file is read one row at a time, and rows are written in
+    bulk_create batches, so memory does not grow with the file size. Expense
+    rollups for the touched days are refreshed once at the end rather than
+    per batch, since statements are not always in date order.
+    Categories are looked up in an in-memory index of the user's categories,
+    and a missing one is created the first time it appears. Duplicates are
+    skipped by fingerprint: this covers rows imported from an earlier upload
+    and identical rows repeated within the file (see expense_fingerprint).
+    """
+
+    def __init__(self, user, columns=None, date_format=None, amount_sign='positive', batch_size=None,
+                 on_progress=None):
+        """
+        Args:
+            user: Owner of the imported expenses
+            columns: Optional {field: header} overrides, fields being note,
+                amount, datetime and category
+            date_format: Optional strptime format for the date column
+            amount_sign: Sign of spending in the amount column (see AMOUNT_SIGNS)
+            batch_size: Rows per bulk_create (default: settings.EXPENSE_IMPORT_BATCH_SIZE)
+            on_progress: Optional callable receiving the stats dict after every batch
+        """
+        self.user = user
+        self.columns = columns or {}
+        self.date_format = date_format or None
+        if amount_sign not in AMOUNT_SIGNS:
+            raise CSVImportError(f"amount_sign must be one of {', '.join(AMOUNT_SIGNS)}")
+        self.amount_sign = amount_sign
+        self.batch_size = batch_size or settings.EXPENSE_IMPORT_BATCH_SIZE
+        self.on_progress = on_progress
+        self.touched_days = set()
+        self.parsed_dates = {}
+        self.stats = {
+            'rows_read': 0,
+            'imported': 0,
+            'duplicates': 0,
+            'credits': 0,
+            'failed_rows': 0,
+            'categories_created': 0,
+            'errors': [],
+        }
+
+    def resolve_columns(self, header):
+        """Map each expense field to its column name in the header"""
+        by_lower = {name.strip().lower(): name for name in header if name}
+        resolved = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            wanted = self.columns.get(field)
+            if wanted:
+                if wanted.strip().lower() not in by_lower:
+                    raise CSVImportError(f"Column {wanted!r} for {field} is not in the file")
+                resolved[field] = by_lower[wanted.strip().lower()]
+                continue
+            for alias in aliases:
+                if alias in by_lower:
+                    resolved[field] = by_lower[alias]
+                    break
+        missing = [field for field in REQUIRED_COLUMNS if field not in resolved]
+        if missing:
+            raise CSVImportError(f"Could not find a column for {', '.join(missing)}; columns are {header}")
+        return resolved
+
+    def load_category_index(self):
+        from .models import Category
+
+        index = {}
+        for category_id, name in Category.objects.filter(user=self.user).values_list('id', 'name'):
+            # Exact names win over case-insensitive matches
+            index[name] = category_id
+            index.setdefault(name.lower(), category_id)
+        return index
+
+    def category_id(self, name, index):
+        from .models import Category
+
+        name = ' '.join((name or '').split())[:100]
+        if not name:
+            return None
+        category_id = index.get(name) or index.get(name.lower())
+        if category_id is None:
+            category, created = Category.objects.get_or_create(user=self.user, name=name)
+            category_id = index[name] = category.id
+            index.setdefault(name.lower(), category_id)
+            self.stats['categories_created'] += created
+        return category_id
+
+    def load_fingerprints(self):
+        from .models import Expense
+
+        return set(
+            Expense.objects.filter(user=self.user, import_fingerprint__isnull=False).values_list(
+                'import_fingerprint', flat=True
+            ).iterator(chunk_size=5000)
+        )
+
+    def parse_datetime(self, value):
+        parsed = self.parsed_dates.get(value)
+        if parsed is None:
+            parsed = parse_transaction_datetime(value, self.date_format)
+            if len(self.parsed_dates) >= DATE_CACHE_SIZE:
+                self.parsed_dates.clear()
+            self.parsed_dates[value] = parsed
+        return parsed
+
+    def record_error(self, line, message):
+        self.stats['failed_rows'] += 1
+        if len(self.stats['errors']) < MAX_REPORTED_ERRORS:
+            self.stats['errors'].append({'line': line, 'error': message})
+
+    def flush(self, batch):
+        from .models import Expense
+
+        if batch:
+            with transaction.atomic():
+                Expense.objects.bulk_create(batch)
+            self.touched_days.update(rollup_key(self.user.id, expense.transaction_datetime) for expense in batch)
+            self.stats['imported'] += len(batch)
+            batch.clear()
+        if self.on_progress is not None:
+            self.on_progress(self.stats)
+
+    def run(self, stream):
+        """
+        Import every row of a text stream.
+
+        Returns:
+            dict: rows_read, imported, duplicates, credits, failed_rows,
+                categories_created, errors (first MAX_REPORTED_ERRORS) and seconds
+
+        Raises:
+            CSVImportError: For a file without a usable header, or one the csv
+                module cannot read on (e.g. an oversized field); the batches
+                before the bad line stay imported
+        """
+        started = time.monotonic()
+        reader = csv.DictReader(stream)
+        try:
+            if not reader.fieldnames:
+                raise CSVImportError("The file is empty")
+            columns = self.resolve_columns(reader.fieldnames)
+            with rollup_refresh_disabled():
+                self.import_rows(reader, columns)
+        except csv.Error as e:
+            # line_num only counts the lines parsed before the failing one
+            raise CSVImportError(f"Malformed CSV at line {reader.line_num + 1}: {e}")
+        finally:
+            # Also after a failure, so the batches already written are counted
+            refresh_expense_rollups(self.touched_days)
+        self.stats['seconds'] = round(time.monotonic() - started, 3)
+        return self.stats
+
+    def import_rows(self, reader, columns):
+        from .models import Expense
+
+        categories = self.load_category_index()
+        seen = self.load_fingerprints()
+        occurrences = {}
+        batch = []
+        for row in reader:
+            self.stats['rows_read'] += 1
+            line = reader.line_num
+            try:
+                note = (row.get(columns['note']) or '').strip()
+                if not note:
+                    raise ValueError("empty note")
+                amount = parse_amount(row.get(columns['amount']))
+                transaction_datetime = self.parse_datetime(row.get(columns['datetime']))
+            except ValueError as e:
+                self.record_error(line, str(e))
+                continue
+            if self.amount_sign == 'negative':
+                amount = -amount
+            if amount < 0:
+                # A refund, deposit or payment in, not spending
+                self.stats['credits'] += 1
+                continue
+
+            identity = (transaction_datetime, amount, normalize_note(note))
+            occurrence = occurrences.get(identity, 0)
+            occurrences[identity] = occurrence + 1
+            fingerprint = expense_fingerprint(transaction_datetime, amount, note, occurrence)
+            if fingerprint in seen:
+                self.stats['duplicates'] += 1
+                continue
+            seen.add(fingerprint)
+
+            batch.append(Expense(
+                user=self.user,
+                expense_note=note,
+                expense_amount=amount,
+                transaction_datetime=transaction_datetime,
+                category_id=self.category_id(row.get(columns['category']), categories) if 'category' in columns else None,
+                import_fingerprint=fingerprint
+            ))
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+        self.flush(batch)
+
+
+def open_text(file):
+    """Wrap an uploaded or stored binary file for line-by-line CSV reading"""
+    # Django File objects proxy the real file; TextIOWrapper needs the real one
+    return io.TextIOWrapper(getattr(file, 'file', file), encoding='utf-8-sig', errors='replace', newline='')
+
+
+def run_expense_import(import_id):
+    """Run a queued ExpenseImport, saving its counters after every batch"""
+    from .models import ExpenseImport
+
+    expense_import = ExpenseImport.objects.select_related('user').filter(
+        pk=import_id, status__in=[ExpenseImport.STATUS_PENDING, ExpenseImport.STATUS_FAILED]
+    ).first()
+    if expense_import is None or not expense_import.file:
+        return
+    expense_import.status = ExpenseImport.STATUS_RUNNING
+    expense_import.save(update_fields=['status', 'updated_at'])
+
+    def save_progress(stats):
+        for field in ('rows_read', 'imported', 'duplicates', 'credits', 'failed_rows', 'categories_created', 'errors'):
+            setattr(expense_import, field, stats[field])
+        expense_import.save(update_fields=[
+            'rows_read', 'imported', 'duplicates', 'credits', 'failed_rows', 'categories_created', 'errors',
+            'updated_at'
+        ])
+
+    importer = ExpenseCSVImporter(
+        expense_import.user,
+        columns=expense_import.columns,
+        date_format=expense_import.date_format,
+        amount_sign=expense_import.amount_sign,
+        on_progress=save_progress
+    )
+    try:
+        with expense_import.file.open('rb') as stored:
+            stats = importer.run(open_text(stored))
+    except CSVImportError as e:
+        expense_import.status = ExpenseImport.STATUS_FAILED
+        expense_import.errors = [{'line': None, 'error': str(e)}]
+        expense_import.save(update_fields=['status', 'errors', 'updated_at'])
+        expense_import.file.delete(save=False)
+        return
+    except Exception:
+        ExpenseImport.objects.filter(pk=import_id).update(status=ExpenseImport.STATUS_FAILED)
+        raise
+
+    expense_import.status = ExpenseImport.STATUS_DONE
+    expense_import.finished_at = timezone.now()
+    expense_import.save(update_fields=['status', 'finished_at', 'updated_at'])
+    expense_import.file.delete(save=False)
+    logger.info(
+        f"Expense import {import_id} done: {stats['imported']} imported, {stats['duplicates']} duplicates, "
+        f"{stats['failed_rows']} failed of {stats['rows_read']} rows in {stats['seconds']}s"
+    )
+
+
+def start_expense_import(user, upload, columns=None, date_format='', amount_sign='positive'):
+    """
+    Store an uploaded CSV and queue its import.
+
+    Returns:
+        ExpenseImport: The queued import
+    """
+    from .models import ExpenseImport
+
+    with transaction.atomic():
+        expense_import = ExpenseImport(
+            user=user,
+            file_name=upload.name[:255],
+            columns=columns or {},
+            date_format=date_format or '',
+            amount_sign=amount_sign
+        )
+        expense_import.file.save(upload.name, upload, save=False)
+        expense_import.save()
+        import_queue.submit(run_expense_import, expense_import.id)
+    return expense_import
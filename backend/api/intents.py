@@ -0,0 +1,220 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+# Keywords for the categories the chat system prompt suggests. A message that
+# hits keywords of two categories is ambiguous and left to the model.
+CATEGORY_KEYWORDS = {
+    'food': (
+        'food', 'lunch', 'dinner', 'breakfast', 'brunch', 'groceries', 'grocery', 'coffee',
+        'restaurant', 'restaurants', 'snack', 'snacks', 'pizza', 'burger', 'burgers', 'meal',
+        'meals', 'takeout', 'sushi', 'drinks', 'eating out',
+    ),
+    'transportation': (
+        'transportation', 'transport', 'uber', 'lyft', 'taxi', 'cab', 'gas', 'fuel', 'petrol',
+        'bus', 'train', 'metro', 'subway', 'parking', 'tolls',
+    ),
+    'entertainment': (
+        'entertainment', 'movie', 'movies', 'cinema', 'concert', 'concerts', 'netflix', 'spotify',
+        'games', 'game', 'tickets',
+    ),
+    'shopping': (
+        'shopping', 'clothes', 'clothing', 'shoes', 'amazon', 'electronics',
+    ),
+    'utilities': (
+        'utilities', 'utility', 'electricity', 'electric bill', 'water bill', 'internet',
+        'phone bill', 'gas bill',
+    ),
+    'housing': (
+        'housing', 'rent', 'mortgage',
+    ),
+    'healthcare': (
+        'healthcare', 'health', 'doctor', 'dentist', 'pharmacy', 'medicine', 'medication',
+        'hospital', 'prescription',
+    ),
+    'travel': (
+        'travel', 'flight', 'flights', 'hotel', 'hotels', 'airbnb', 'vacation', 'trip',
+    ),
+}
+
+# Spellings of the time periods the chat templates allow
+TIME_PERIODS = (
+    ('today', ('today',)),
+    ('yesterday', ('yesterday',)),
+    ('last week', ('last week', 'past week', 'the last 7 days', 'past 7 days')),
+    ('this month', ('this month',)),
+    ('last month', ('last month', 'previous month')),
+    ('this year', ('this year',)),
+)
+
+_AMOUNT = re.compile(
+    r'(?<![\w.])\$?\s?(\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d+(?:\.\d{1,2})?)\s?(?:dollars|bucks|usd)?(?![\w.%:/])',
+    re.IGNORECASE
+)
+_RECORD_VERB = re.compile(r'\b(spent|paid|bought|purchased)\b', re.IGNORECASE)
+_QUERY_START = re.compile(
+    r'^\s*(how much|what did i spend|what have i spent|what was my|what is my|what\'s my|show me|show my|total)\b',
+    re.IGNORECASE
+)
+_NEGATION = re.compile(r"\b(not|didn't|didnt|never|don't|dont|won't|cancel|undo|delete|remove|refund)\b", re.IGNORECASE)
+# Words a spending query can contain besides its category and time period
+_FILLER = {'on', 'for', 'in', 'at', 'my', 'i', 'did', 'do', 'spend', 'spent', 'much', 'how',
+           'the', 'a', 'total', 'altogether', 'overall', 'everything', 'all', 'stuff',
+           'things', 'money', 'what', 'have', 'was', 'is', 'me', 'show', 'spending', 'expenses'}
+
+# Replies in the fixed formats of the system prompt. They carry no facts from
+# the database ([amount] is filled in afterwards), but their category, amount
+# and period may come from the conversation ("same again", "and last month?"),
+# so see is_context_free_reply before reusing one for another conversation.
+_TEMPLATE_REPLY = re.compile(
+    r"^(I've recorded your (?P<record_category>[\w &'-]+) expense of \$(?P<amount>[\d.,]+)[.!]?"
+    r"|Based on your records, you spent \$\[amount\]( on (?P<query_category>[\w &'-]+))? "
+    r"(?P<period>today|yesterday|last week|this month|last month|this year)\.?)$"
+)
+
+_KEYWORD_PATTERNS = [
+    (category, re.compile(r'\b(' + '|'.join(re.escape(word) for word in words) + r')\b', re.IGNORECASE))
+    for category, words in CATEGORY_KEYWORDS.items()
+]
+_PERIOD_PATTERNS = [
+    (period, re.compile(r'\b(' + '|'.join(re.escape(word) for word in spellings) + r')\b', re.IGNORECASE))
+    for period, spellings in TIME_PERIODS
+]
+
+
+def _match_categories(text):
+    return {category for category, pattern in _KEYWORD_PATTERNS if pattern.search(text)}
+
+
+def _match_periods(text):
+    return [period for period, pattern in _PERIOD_PATTERNS if pattern.search(text)]
+
+
+def _strip_known_words(text):
+    """Return the words of text that are not fillers, periods or category keywords"""
+    for _, pattern in _PERIOD_PATTERNS + _KEYWORD_PATTERNS:
+        text = pattern.sub(' ', text)
+    words = re.findall(r"[a-z']+", text.lower())
+    return [word for word in words if word not in _FILLER]
+
+
+def _parse_record(text):
+    amounts = _AMOUNT.findall(text)
+    if len(amounts) != 1 or not _RECORD_VERB.search(text):
+        return None
+    try:
+        amount = Decimal(amounts[0].replace(',', ''))
+    except InvalidOperation:
+        return None
+    categories = _match_categories(text)
+    if amount <= 0 or len(categories) != 1:
+        return None
+
+    category = categories.pop()
+    return {
+        'intent': 'record_expense',
+        'category': category,
+        'amount': amount,
+        'time_period': None,
+        'reply': f"I've recorded your {category} expense of ${amount:.2f}.",
+    }
+
+
+def _parse_query(text):
+    if not (_QUERY_START.search(text) or ('spend' in text.lower() and text.rstrip().endswith('?'))):
+        return None
+    periods = _match_periods(text)
+    without_periods = text
+    for _, pattern in _PERIOD_PATTERNS:
+        without_periods = pattern.sub(' ', without_periods)
+    if _AMOUNT.search(without_periods):
+        return None
+    if len(periods) != 1:
+        return None
+    period = periods[0]
+
+    categories = _match_categories(text)
+    if len(categories) > 1:
+        return None
+    if categories:
+        category = categories.pop()
+    elif _strip_known_words(text):
+        # Something is being asked about that we have no keyword for
+        return None
+    else:
+        category = None
+
+    if category:
+        reply = f"Based on your records, you spent $[amount] on {category} {period}."
+    else:
+        reply = f"Based on your records, you spent $[amount] {period}."
+    return {
+        'intent': 'query_expenses',
+        'category': category,
+        'amount': None,
+        'time_period': period,
+        'reply': reply,
+    }
+
+
+def parse_chat_intent(message):
+    """
+    Recognise the chat intents the system prompt defines without calling the LLM.
+
+    Only confident matches are returned: exactly one amount and one category
+    for a recorded expense, exactly one supported time period (and at most
+    one category, with no unrecognised topic) for a spending query. Anything
+    else, including negations, returns None so the caller falls back to the
+    model.
+
+    Args:
+        message: The user's chat message
+
+    Returns:
+        dict: intent, category, amount, time_period and the templated reply the
+            model would have produced, or None when unsure
+    """
+    text = ' '.join((message or '').split())
+    if not text or len(text) > 200 or _NEGATION.search(text):
+        return None
+    return _parse_query(text) or _parse_record(text)
+
+
+def _mentions_category(text, category):
+    category = category.lower()
+    return category in _match_categories(text) or bool(re.search(rf'\b{re.escape(category)}\b', text, re.IGNORECASE))
+
+
+def is_context_free_reply(message, reply):
+    """
+    Return True if a templated reply follows from the message alone.
+
+    Every fact of the reply must be stated in the message: the amount and
+    category of a recorded expense, the period and category of a spending
+    query. A reply whose category or amount the model took from earlier turns
+    ("same again", "what about last month?") is not, so it must not be
+    replayed to another conversation, or another user.
+
+    Args:
+        message: The user's chat message
+        reply: The model's reply to it
+    """
+    match = _TEMPLATE_REPLY.match((reply or '').strip())
+    text = ' '.join((message or '').split())
+    if match is None or not text:
+        return False
+
+    if match['amount'] is not None:
+        try:
+            amount = Decimal(match['amount'].replace(',', '').rstrip('.'))
+            stated = {Decimal(value.replace(',', '')) for value in _AMOUNT.findall(text)}
+        except InvalidOperation:
+            return False
+        return stated == {amount} and _mentions_category(text, match['record_category'])
+
+    # A query names its period, and a category if it has one; without a category it
+    # must be a question on its own, not a follow-up to an earlier one
+    if _match_periods(text) != [match['period']]:
+        return False
+    if match['query_category'] is not None:
+        return _mentions_category(text, match['query_category'])
+    return bool(_QUERY_START.search(text)) and not _match_categories(text)
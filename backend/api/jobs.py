@@ -0,0 +1,102 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger('api')
+
+
+class JobQueue:
+    """
+    In-process background job queue.
+
+    Jobs run on a bounded thread pool, so at most `max_workers` of them are in
+    flight at once, and a failing job is retried with exponential backoff. A
+    job submitted inside a transaction only starts once that transaction
+    commits, so it always sees the rows the request wrote.
+
+    With settings.BACKGROUND_JOBS_EAGER set, jobs run inline (retries
+    included, without the backoff sleeps), which keeps tests deterministic.
+    Queued jobs live in memory: a restart drops whatever has not run yet, so
+    only use this for work whose loss is tolerable.
+    """
+
+    def __init__(self, name, max_workers, max_retries=3, retry_delay=1.0):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._executor = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f'{self.name}-job'
+                )
+            return self._executor
+
+    def submit(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the background once the current transaction commits"""
+        transaction.on_commit(lambda: self._enqueue(func, args, kwargs))
+
+    def _enqueue(self, func, args, kwargs):
+        if getattr(settings, 'BACKGROUND_JOBS_EAGER', False):
+            for attempt in range(self.max_retries + 1):
+                if self._attempt(func, args, kwargs, attempt):
+                    return
+            return
+
+        with self._lock:
+            self._pending += 1
+        self._get_executor().submit(self._run, func, args, kwargs, 0)
+
+    def _attempt(self, func, args, kwargs, attempt):
+        try:
+            func(*args, **kwargs)
+            return True
+        except Exception as e:
+            final = attempt >= self.max_retries
+            log = logger.error if final else logger.warning
+            log(f"{self.name} job {func.__name__} failed (attempt {attempt + 1}/{self.max_retries + 1}): {str(e)}")
+            return False
+
+    def _run(self, func, args, kwargs, attempt):
+        try:
+            succeeded = self._attempt(func, args, kwargs, attempt)
+        finally:
+            connections.close_all()
+
+        if not succeeded and attempt < self.max_retries:
+            # Wait on a timer rather than in the worker so the slot is free for other jobs
+            delay = self.retry_delay * (2 ** attempt)
+            timer = threading.Timer(delay, self._retry, args=(func, args, kwargs, attempt + 1))
+            timer.daemon = True
+            timer.start()
+            return
+        self._done()
+
+    def _retry(self, func, args, kwargs, attempt):
+        self._get_executor().submit(self._run, func, args, kwargs, attempt)
+
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Block until every submitted job (including pending retries) finished.
+
+        Returns:
+            bool: False if the timeout expired first
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import textwrap
+import threading
+import weakref
+
+import httpx
+import openai
+from django.conf import settings
+
+logger = logging.getLogger('api')
+
+CHAT_MODEL = "gpt-3.5-turbo-1106"
+
+# Dedented so the indentation is not paid for in prompt tokens on every turn
+CHAT_SYSTEM_PROMPT = textwrap.dedent("""
+            You are an AI assistant for a personal expense tracker app called Spendora.
+
+            === IMPORTANT: FOLLOW THESE FORMATS EXACTLY ===
+
+            For recording expenses:
+            When the user appears to be recording an expense (e.g., "I spent $20 on lunch"),
+            respond with EXACTLY this format: "I've recorded your [category] expense of $[amount]."
+            Example: "I've recorded your food expense of $20.00."
+            IMPORTANT: Do not include any special characters or periods inside the amount number.
+
+            For querying expenses:
+            1. When the user asks about spending in a specific category:
+               Respond with: "Based on your records, you spent $[amount] on [category] [time period]."
+               Example: "Based on your records, you spent $[amount] on food last week."
+
+            2. When the user asks about total spending without specifying a category:
+               Respond with: "Based on your records, you spent $[amount] [time period]."
+               Example: "Based on your records, you spent $[amount] today."
+
+            The system will replace [amount] with actual database values.
+
+            Only use the following time periods: today, yesterday, last week, this month, last month, this year.
+
+            For category names, use simple, clear categories like:
+            - Food
+            - Transportation
+            - Entertainment
+            - Shopping
+            - Utilities
+            - Housing
+            - Healthcare
+            - Travel
+
+            For general questions, be helpful, concise, and friendly.
+            """).strip()
+
+_lock = threading.Lock()
+_sync_clients = {}
+# Async HTTP connections belong to the event loop that opened them, so async
+# clients are kept per loop and dropped together with it
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _client_config():
+    return (
+        os.environ.get('OPENAI_API_KEY', ''),
+        settings.OPENAI_BASE_URL,
+    )
+
+
+def _http_limits():
+    return httpx.Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_CONNECTIONS,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_SECONDS,
+    )
+
+
+def _http_timeout():
+    return httpx.Timeout(settings.OPENAI_TIMEOUT, connect=5.0)
+
+
+def get_openai_client():
+    """
+    Return the process-wide OpenAI client, or None if no API key is configured.
+
+    The client owns one pooled httpx connection pool, so keep-alive
+    connections and TLS sessions are reused across requests and threads
+    instead of being set up again for every chat message.
+    """
+    api_key, base_url = config = _client_config()
+    if not api_key:
+        return None
+
+    client = _sync_clients.get(config)
+    if client is None:
+        with _lock:
+            client = _sync_clients.get(config)
+            if client is None:
+                logger.info(f"Creating pooled OpenAI client (base_url={base_url or 'default'})")
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=settings.OPENAI_MAX_RETRIES,
+                    http_client=httpx.Client(limits=_http_limits(), timeout=_http_timeout()),
+                )
+                _sync_clients[config] = client
+    return client
+
+
+def get_async_openai_client():
+    """
+    Return the AsyncOpenAI client for the running event loop, or None if no
+    API key is configured.
+
+    Under an ASGI server every request runs on the same loop, so this is
+    effectively one pooled client per worker process.
+    """
+    api_key, base_url = config = _client_config()
+    if not api_key:
+        return None
+
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(config)
+    if client is None:
+        client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+            http_client=httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout()),
+        )
+        clients[config] = client
+    return client
+
+
+def budgeted_client(client, timeout):
+    """
+    Return `client` bound to one call's time budget (see LLMGuard.acquire).
+
+    The SDK's own retries are turned off: each attempt would get the full
+    timeout, so a hung provider could hold the call for several budgets
+    before the guard's breaker saw a failure. Retrying is left to the caller
+    (the job queue, or the user).
+    """
+    return client.with_options(timeout=timeout, max_retries=0)
+
+
+def reset_openai_clients():
+    """Close and forget the pooled sync clients (used by tests and on config changes)"""
+    with _lock:
+        for client in _sync_clients.values():
+            client.close()
+        _sync_clients.clear()
+        _async_clients.clear()
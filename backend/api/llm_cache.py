@@ -0,0 +1,171 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+def normalize_prompt(text):
+    """Lower-case and collapse whitespace so trivially different phrasings share a key"""
+    return ' '.join((text or '').lower().split())
+
+
+class LocalLRUBackend:
+    """In-process store with per-entry expiry and least-recently-used eviction"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoCacheBackend:
+    """
+    Store entries in a configured Django cache, shared by every process using
+    it. Eviction follows that cache's own policy (e.g. Redis maxmemory-policy).
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+    def clear(self):
+        # A generic Django cache cannot list our keys, and clearing it would drop
+        # unrelated entries, so cached completions simply expire with their TTL
+        pass
+
+
+class CompletionCache:
+    """
+    Cache of model completions keyed on the model, the normalized prompt and
+    whatever context shapes the answer.
+
+    Hit and miss counters are kept per process.
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.backend is not None and self.ttl > 0
+
+    def make_key(self, namespace, model, prompt, *context):
+        """
+        Args:
+            namespace: What the completion is used for, e.g. 'chat' or 'note'
+            model: Model name the completion was requested from
+            prompt: The user text; normalized before hashing
+            *context: Anything else the answer depends on (system prompt, date, ...)
+        """
+        payload = json.dumps([model, normalize_prompt(prompt), [str(part) for part in context]])
+        return f'llm:{namespace}:{hashlib.sha256(payload.encode()).hexdigest()}'
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.enabled and value:
+            self.backend.set(key, value, self.ttl)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+        }
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def _build_completion_cache():
+    backend_name = settings.LLM_CACHE_BACKEND
+    if backend_name == 'local':
+        backend = LocalLRUBackend(settings.LLM_CACHE_MAX_ENTRIES)
+    elif backend_name == 'django':
+        backend = DjangoCacheBackend(settings.LLM_CACHE_ALIAS)
+    elif not backend_name:
+        backend = None
+    else:
+        raise ValueError(f"Unknown LLM_CACHE_BACKEND {backend_name!r}; use 'local', 'django' or None")
+    return CompletionCache(backend, settings.LLM_CACHE_TTL)
+
+
+def get_completion_cache():
+    """Return the process-wide completion cache configured by the LLM_CACHE_* settings"""
+    global _completion_cache
+    if _completion_cache is None:
+        with _completion_cache_lock:
+            if _completion_cache is None:
+                _completion_cache = _build_completion_cache()
+    return _completion_cache
+
+
+@receiver(setting_changed)
+def _reset_completion_cache(setting, **kwargs):
+    global _completion_cache
+    if setting.startswith('LLM_CACHE_'):
+        _completion_cache = None
@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger('api')
+
+
+class LLMUnavailable(Exception):
+    """
+    Raised instead of calling the model when the guard refuses the call.
+
+    `reason` is one of 'circuit_open', 'busy' (no global slot freed up within
+    the queue timeout) or 'user_limit' (the user already has the maximum
+    number of calls in flight).
+    """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    are refused for `recovery_seconds`. Then a single trial call is let
+    through (half-open): success closes the circuit, failure opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, recovery_seconds):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_seconds:
+                    return False
+                self._state = self.HALF_OPEN
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def cancel_trial(self):
+        """Give back a half-open trial that was granted but never used"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("LLM circuit closed")
+            self._state = self.CLOSED
+            self._trial_in_flight = False
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning(
+                        f"LLM circuit opened after {self.consecutive_failures} consecutive failures"
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class LLMGuard:
+    """
+    Admission control for model calls.
+
+    Caps concurrent calls globally and per user, gives every call a total
+    time budget (queue wait included) to use as its client timeout, and feeds
+    call outcomes into a circuit breaker. Callers that are refused get
+    LLMUnavailable immediately (or after at most `queue_timeout` waiting for a
+    global slot) and should fall back to a local answer instead of tying up a
+    worker.
+    """
+
+    def __init__(self, max_concurrent, max_per_user, queue_timeout, call_timeout, breaker):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self.breaker = breaker
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._per_user = Counter()
+        self._waiting = 0
+        self._in_flight = 0
+        self.rejected = Counter()
+        self.completed = 0
+        self.failed = 0
+
+    def _reject(self, reason):
+        with self._lock:
+            self.rejected[reason] += 1
+        raise LLMUnavailable(reason)
+
+    def acquire(self, user_id=None):
+        """
+        Reserve a call slot; pair with release().
+
+        Returns:
+            float: Seconds left of the call budget, to use as the client timeout
+        """
+        started = time.monotonic()
+        if not self.breaker.allow():
+            self._reject('circuit_open')
+
+        with self._lock:
+            if user_id is not None and self._per_user[user_id] >= self.max_per_user:
+                user_limited = True
+            else:
+                user_limited = False
+                if user_id is not None:
+                    self._per_user[user_id] += 1
+                self._waiting += 1
+        if user_limited:
+            self.breaker.cancel_trial()
+            self._reject('user_limit')
+
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self._waiting -= 1
+            if acquired:
+                self._in_flight += 1
+            elif user_id is not None:
+                self._per_user[user_id] -= 1
+        if not acquired:
+            self.breaker.cancel_trial()
+            self._reject('busy')
+
+        return max(self.call_timeout - (time.monotonic() - started), 0.1)
+
+    def release(self, user_id=None, succeeded=True):
+        """Free a slot taken by acquire() and record the call's outcome"""
+        with self._lock:
+            self._in_flight -= 1
+            if user_id is not None:
+                self._per_user[user_id] -= 1
+                if self._per_user[user_id] <= 0:
+                    del self._per_user[user_id]
+            if succeeded:
+                self.completed += 1
+            else:
+                self.failed += 1
+        self._slots.release()
+        if succeeded:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    @contextmanager
+    def slot(self, user_id=None):
+        """
+        Hold a call slot for the duration of the block; yields the timeout to
+        pass to the client. An exception raised in the block counts as a
+        failed call, so keep only the model call inside it.
+        """
+        timeout = self.acquire(user_id)
+        try:
+            yield timeout
+        except Exception:
+            self.release(user_id, succeeded=False)
+            raise
+        self.release(user_id, succeeded=True)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'circuit': self.breaker.state,
+                'consecutive_failures': self.breaker.consecutive_failures,
+                'times_opened': self.breaker.times_opened,
+                'in_flight': self._in_flight,
+                'queue_depth': self._waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_per_user': self.max_per_user,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': dict(self.rejected),
+            }
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def get_llm_guard():
+    """Return the process-wide guard configured by the LLM_* settings"""
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                _guard = LLMGuard(
+                    max_concurrent=settings.LLM_MAX_CONCURRENT_CALLS,
+                    max_per_user=settings.LLM_MAX_CONCURRENT_CALLS_PER_USER,
+                    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+                    call_timeout=settings.LLM_CALL_TIMEOUT,
+                    breaker=CircuitBreaker(
+                        failure_threshold=settings.LLM_BREAKER_FAILURE_THRESHOLD,
+                        recovery_seconds=settings.LLM_BREAKER_RECOVERY_SECONDS
+                    )
+                )
+    return _guard
+
+
+def reset_llm_guard():
+    global _guard
+    _guard = None
+
+
+@receiver(setting_changed)
+def _reset_llm_guard(setting, **kwargs):
+    if setting.startswith(('LLM_MAX_', 'LLM_QUEUE_', 'LLM_CALL_', 'LLM_BREAKER_')):
+        reset_llm_guard()
@@ -0,0 +1,102 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.data_cache import bump_data_version
+from api.models import Category, Expense, Income
+
+# What the dashboard requested on load before /api/dashboard/
+FAN_OUT_URLS = (
+    '/api/users/me/',
+    '/api/categories/',
+    '/api/expenses/summary/',
+    '/api/incomes/total/',
+    '/api/expenses/',
+)
+BOOTSTRAP_URLS = ('/api/dashboard/',)
+CATEGORIES = ('Food', 'Groceries', 'Transportation', 'Entertainment', 'Healthcare', 'Shopping')
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compares loading the dashboard through /api/dashboard/ with the five separate requests it replaces'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=5000, help='Expenses of the generated user')
+        parser.add_argument('--loads', type=int, default=50, help='Dashboard loads timed per variant')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the generated expenses')
+
+    def create_user(self, expenses, seed):
+        generator = random.Random(seed)
+        user = get_user_model().objects.create_user(email='dashboard-benchmark@example.invalid', password=None)
+        categories = Category.objects.bulk_create([Category(user=user, name=name) for name in CATEGORIES])
+        now = timezone.now()
+        Expense.objects.bulk_create([
+            Expense(
+                user=user,
+                expense_note=f'Expense {i}',
+                expense_amount=Decimal(generator.randrange(100, 20000)) / 100,
+                transaction_datetime=now - timedelta(minutes=generator.randrange(365 * 24 * 60)),
+                category=generator.choice(categories)
+            )
+            for i in range(expenses)
+        ], batch_size=1000)
+        Income.objects.create(user=user, everymonth_payment_date=1, amount=Decimal('3000.00'), description='Salary')
+        return user
+
+    def time_loads(self, client, urls, loads):
+        """Return (median ms, queries) of one dashboard load, each URL requested in turn"""
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        # Warm up: the first load fills the read cache when it is enabled
+        for url in urls:
+            if client.get(url).status_code != 200:
+                raise CommandError(f"GET {url} failed")
+        timings = []
+        with connection.execute_wrapper(count):
+            for _ in range(loads):
+                started = time.perf_counter()
+                for url in urls:
+                    client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), queries / loads
+
+    def handle(self, *args, **options):
+        results = []
+        try:
+            with transaction.atomic():
+                user = self.create_user(options['expenses'], options['seed'])
+                client = Client(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+                for cache_label, cache_settings in (('uncached', {'DATA_CACHE_BACKEND': ''}), ('cached', {})):
+                    with override_settings(**cache_settings):
+                        for label, urls in (('fan-out', FAN_OUT_URLS), ('bootstrap', BOOTSTRAP_URLS)):
+                            median_ms, queries = self.time_loads(client, urls, options['loads'])
+                            results.append((cache_label, label, len(urls), median_ms, queries))
+                # The user's id may be reused once rolled back; leave no payload cached under it
+                bump_data_version(user.id)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        for cache_label, label, requests, median_ms, queries in results:
+            self.stdout.write(
+                f"{cache_label} {label}: requests={requests} queries={queries:.0f} median_ms={median_ms:.1f}"
+            )
+        self.stdout.write(self.style.SUCCESS("Dashboard benchmark finished"))
@@ -0,0 +1,102 @@
+import csv
+import random
+import resource
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.importers import ExpenseCSVImporter
+from api.rollups import find_rollup_mismatches
+
+MERCHANTS = ('Coffee Shop', 'Grocery Mart', 'City Transit', 'Cinema', 'Pharmacy', 'Book Store',
+             'Gas Station', 'Pizza Place', 'Hardware Store', 'Online Shop')
+CATEGORIES = ('Food', 'Groceries', 'Transportation', 'Entertainment', 'Healthcare', 'Shopping')
+
+
+class _Rollback(Exception):
+    pass
+
+
+def write_statement(stream, rows, seed):
+    """Write a synthetic statement CSV in bank-export style (M/D/Y dates, negative debits)"""
+    generator = random.Random(seed)
+    writer = csv.writer(stream)
+    writer.writerow(['Date', 'Description', 'Amount', 'Category'])
+    start = date(2023, 1, 1)
+    for i in range(rows):
+        day = start + timedelta(days=generator.randrange(730))
+        writer.writerow([
+            day.strftime('%m/%d/%Y'),
+            f"{generator.choice(MERCHANTS)} #{generator.randrange(500)}",
+            f"-{generator.randrange(100, 20000) / 100:.2f}",
+            generator.choice(CATEGORIES),
+        ])
+
+
+class Command(BaseCommand):
+    help = 'Measures statement CSV import throughput and memory (the data is rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000, help='Rows in the generated statement')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Rows per bulk insert (default: settings.EXPENSE_IMPORT_BATCH_SIZE)'
+        )
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the generated statement')
+        parser.add_argument(
+            '--trace-memory',
+            action='store_true',
+            help='Report peak Python allocations of each import (slows the import down considerably)'
+        )
+
+    def run_import(self, user, path, batch_size, label, trace_memory):
+        if trace_memory:
+            tracemalloc.start()
+        with open(path, newline='') as stream:
+            stats = ExpenseCSVImporter(user, batch_size=batch_size).run(stream)
+        if trace_memory:
+            memory = f"peak_alloc_mb={tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f}"
+            tracemalloc.stop()
+        else:
+            # ru_maxrss is in KiB on Linux
+            memory = f"max_rss_mb={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}"
+        rate = stats['rows_read'] / stats['seconds'] if stats['seconds'] else 0
+        self.stdout.write(
+            f"{label}: rows={stats['rows_read']} imported={stats['imported']} duplicates={stats['duplicates']} "
+            f"failed={stats['failed_rows']} seconds={stats['seconds']} rows_per_s={rate:.0f} {memory}"
+        )
+        return stats
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='') as statement:
+            write_statement(statement, rows, options['seed'])
+            statement.flush()
+
+            try:
+                with transaction.atomic():
+                    user = get_user_model().objects.create_user(
+                        email='import-benchmark@example.invalid', password=None
+                    )
+                    first = self.run_import(
+                        user, statement.name, options['batch_size'], 'first import', options['trace_memory']
+                    )
+                    again = self.run_import(
+                        user, statement.name, options['batch_size'], 'reimport', options['trace_memory']
+                    )
+                    mismatches = find_rollup_mismatches(user.id)
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+        if first['imported'] != rows or first['failed_rows']:
+            raise CommandError(f"Expected {rows} imported rows, got {first['imported']} ({first['failed_rows']} failed)")
+        if again['imported'] or again['duplicates'] != rows:
+            raise CommandError(f"Reimport should skip every row, imported {again['imported']}")
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} rollup days disagree with the imported expenses")
+        self.stdout.write(self.style.SUCCESS("Import benchmark passed"))
@@ -0,0 +1,85 @@
+import json
+import os
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from api.intents import parse_chat_intent
+
+DEFAULT_CORPUS = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'benchmarks', 'intent_corpus.jsonl'
+)
+
+
+def _matches(parsed, expected):
+    if parsed is None or expected is None:
+        return parsed is None and expected is None
+    for key, value in expected.items():
+        actual = parsed.get(key)
+        if key == 'amount':
+            actual = None if actual is None else f"{Decimal(actual):.2f}"
+        if actual != value:
+            return False
+    return True
+
+
+class Command(BaseCommand):
+    help = 'Measures hit rate, accuracy and latency of the local chat intent parser'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corpus',
+            default=DEFAULT_CORPUS,
+            help='JSONL file of {"message": ..., "expected": {...} or null} rows'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=200,
+            help='Times each message is parsed when timing'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['corpus']) as corpus:
+                rows = [json.loads(line) for line in corpus if line.strip()]
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read corpus: {str(e)}")
+        if not rows:
+            raise CommandError("Corpus is empty")
+
+        repeat = max(1, options['repeat'])
+        latencies = []
+        hits = correct = false_positives = missed = 0
+        for row in rows:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                parsed = parse_chat_intent(row['message'])
+            latencies.append((time.perf_counter() - started) / repeat)
+
+            expected = row.get('expected')
+            if parsed is not None:
+                hits += 1
+                if expected is None:
+                    false_positives += 1
+            elif expected is not None:
+                missed += 1
+            if _matches(parsed, expected):
+                correct += 1
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f"MISMATCH {row['message']!r}: expected {expected}, got "
+                    f"{None if parsed is None else {key: parsed[key] for key in ('intent', 'category', 'amount', 'time_period')}}"
+                ))
+
+        latencies.sort()
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e6
+
+        self.stdout.write(f"messages={len(rows)} hits={hits} hit_rate={hits / len(rows):.1%}")
+        self.stdout.write(f"accuracy={correct / len(rows):.1%} false_positives={false_positives} missed={missed}")
+        self.stdout.write(f"latency_us p50={percentile(0.5):.1f} p95={percentile(0.95):.1f} max={latencies[-1] * 1e6:.1f}")
+        if correct == len(rows):
+            self.stdout.write(self.style.SUCCESS("All corpus messages parsed as expected"))
+        else:
+            raise CommandError(f"{len(rows) - correct} corpus messages were parsed incorrectly")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.sync import compact_change_log, expire_sync_operations
+
+
+class Command(BaseCommand):
+    help = 'Deletes change log entries superseded by a later entry for the same object, and expired sync batch keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Entries deleted per transaction (default: settings.PURGE_BATCH_SIZE)'
+        )
+
+    def handle(self, *args, **options):
+        deleted = compact_change_log(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"[{timezone.now()}] Deleted {deleted} superseded change log entries"))
+        expired = expire_sync_operations()
+        self.stdout.write(self.style.SUCCESS(f"[{timezone.now()}] Deleted {expired} expired sync operation keys"))
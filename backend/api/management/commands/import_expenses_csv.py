@@ -0,0 +1,66 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.importers import AMOUNT_SIGNS, ExpenseCSVImporter, CSVImportError
+
+
+class Command(BaseCommand):
+    help = 'Imports a bank statement CSV as expenses for one user, skipping rows imported before'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user the expenses belong to')
+        parser.add_argument('path', help='CSV file to import')
+        for field in ('note', 'amount', 'datetime', 'category'):
+            parser.add_argument(f'--{field}-column', help=f'Header of the {field} column (default: detected)')
+        parser.add_argument('--date-format', help='strptime format of the date column (default: detected)')
+        parser.add_argument(
+            '--amount-sign',
+            choices=AMOUNT_SIGNS,
+            default='positive',
+            help='Sign of spending in the amount column; rows of the other sign are skipped as credits'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Rows per bulk insert (default: settings.EXPENSE_IMPORT_BATCH_SIZE)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with email {options['email']}")
+
+        columns = {
+            field: options[f'{field}_column']
+            for field in ('note', 'amount', 'datetime', 'category')
+            if options[f'{field}_column']
+        }
+
+        def report(stats):
+            self.stdout.write(
+                f"[{timezone.now()}] {stats['rows_read']} rows read: {stats['imported']} imported, "
+                f"{stats['duplicates']} duplicates, {stats['credits']} credits, {stats['failed_rows']} failed"
+            )
+
+        importer = ExpenseCSVImporter(
+            user,
+            columns=columns,
+            date_format=options['date_format'],
+            amount_sign=options['amount_sign'],
+            batch_size=options['batch_size'],
+            on_progress=report
+        )
+        try:
+            with open(options['path'], encoding='utf-8-sig', errors='replace', newline='') as stream:
+                stats = importer.run(stream)
+        except (OSError, CSVImportError) as e:
+            raise CommandError(str(e))
+
+        for error in stats['errors']:
+            self.stdout.write(self.style.WARNING(f"line {error['line']}: {error['error']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"[{timezone.now()}] Imported {stats['imported']} expenses from {stats['rows_read']} rows in "
+            f"{stats['seconds']}s ({stats['duplicates']} duplicates, {stats['credits']} credits, {stats['failed_rows']} failed, "
+            f"{stats['categories_created']} categories created)"
+        ))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.models import User
+from api.rollups import rebuild_user_rollups, find_rollup_mismatches
+
+
+class Command(BaseCommand):
+    help = 'Backfills or verifies the per-day expense rollup table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Only process the user with this email address'
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Compare rollups against the expense table instead of rebuilding them'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.all().order_by('id')
+        if options['user']:
+            users = users.filter(email=options['user'])
+            if not users.exists():
+                raise CommandError(f"No user found with email {options['user']}")
+
+        self.stdout.write(f"[{timezone.now()}] {'Verifying' if options['verify'] else 'Rebuilding'} expense rollups...")
+
+        total_rows = 0
+        total_mismatches = 0
+        for user in users.iterator():
+            if options['verify']:
+                mismatches = find_rollup_mismatches(user.id)
+                total_mismatches += len(mismatches)
+                for mismatch in mismatches:
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f"{user.email} {mismatch['date']} category={mismatch['category_id']} "
+                            f"subcategory={mismatch['subcategory_id']}: expected {mismatch['expected']}, "
+                            f"found {mismatch['actual']}"
+                        )
+                    )
+            else:
+                total_rows += rebuild_user_rollups(user.id)
+
+        if options['verify']:
+            if total_mismatches:
+                raise CommandError(f"Found {total_mismatches} mismatched rollup buckets")
+            self.stdout.write(self.style.SUCCESS(f"[{timezone.now()}] Rollups are consistent"))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f"[{timezone.now()}] Wrote {total_rows} rollup rows")
+            )
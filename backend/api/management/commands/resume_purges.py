@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from api.models import PurgeJob
+from api.purge import run_purge
+
+
+class Command(BaseCommand):
+    help = 'Resumes background purges that failed or were interrupted by a restart'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-minutes',
+            type=int,
+            default=10,
+            help='Treat pending or running jobs without progress for this long as interrupted (default: 10)'
+        )
+
+    def handle(self, *args, **options):
+        stale_before = timezone.now() - timedelta(minutes=options['stale_minutes'])
+        jobs = PurgeJob.objects.filter(
+            Q(status=PurgeJob.STATUS_FAILED) |
+            Q(status__in=[PurgeJob.STATUS_PENDING, PurgeJob.STATUS_RUNNING], updated_at__lt=stale_before)
+        ).order_by('created_at')
+
+        resumed = failed = 0
+        for job in jobs:
+            self.stdout.write(
+                f"[{timezone.now()}] Resuming {job.kind} purge {job.pk} "
+                f"({job.status}, step {job.step or '-'}, {job.deleted_rows} rows deleted so far)"
+            )
+            try:
+                run_purge(job.pk)
+                resumed += 1
+            except Exception as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"[{timezone.now()}] Purge {job.pk} failed: {str(e)}"))
+
+        self.stdout.write(
+            self.style.SUCCESS(f"[{timezone.now()}] Resumed {resumed} purges, {failed} failed")
+        )
@@ -1,21 +1,83 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from api.utils import send_weekly_expense_reports
+from api.utils import send_weekly_expense_reports, parse_shard
 
 
 class Command(BaseCommand):
     help = 'Sends weekly expense reports to subscribed users'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of threads building reports (default: settings.WEEKLY_REPORT_WORKERS)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Subscriptions per build/send batch (default: settings.WEEKLY_REPORT_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--shard',
+            help='Only serve shard i of n, as "i/n" (users whose id %% n == i)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many reports would be sent and estimate how long it would take'
+        )
+        parser.add_argument(
+            '--sample-size',
+            type=int,
+            default=5,
+            help='Reports built (not sent) to estimate the run time in a dry run'
+        )
+
     def handle(self, *args, **options):
+        shard = None
+        if options['shard']:
+            try:
+                shard = parse_shard(options['shard'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
         current_time = timezone.now()
         self.stdout.write(f"[{current_time}] Starting weekly report delivery...")
-        
+
         try:
-            count = send_weekly_expense_reports()
+            stats = send_weekly_expense_reports(
+                workers=options['workers'],
+                batch_size=options['batch_size'],
+                shard=shard,
+                dry_run=options['dry_run'],
+                sample_size=options['sample_size']
+            )
+            if stats['dry_run']:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"[{timezone.now()}] Dry run: {stats['pending']} reports would be sent "
+                        f"({stats['already_sent']} already sent this week, {stats['skipped']} unverified)"
+                    )
+                )
+                self.stdout.write(
+                    f"  sampled={stats['sampled']} seconds_per_report={stats['seconds_per_report']} "
+                    f"estimated={stats['estimated_seconds']}s with {stats['workers']} workers"
+                )
+                return
+
             self.stdout.write(
-                self.style.SUCCESS(f"[{timezone.now()}] Successfully sent {count} weekly reports")
+                self.style.SUCCESS(f"[{timezone.now()}] Successfully sent {stats['sent']} weekly reports")
+            )
+            self.stdout.write(
+                f"  subscriptions={stats['subscriptions']} already_sent={stats['already_sent']} "
+                f"skipped={stats['skipped']} failed={stats['failed']} "
+                f"batches={stats['batches']} workers={stats['workers']}"
+            )
+            self.stdout.write(
+                f"  elapsed={stats['elapsed_seconds']}s send={stats['send_seconds']}s "
+                f"throughput={stats['reports_per_second']} reports/s"
             )
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f"[{timezone.now()}] Error sending weekly reports: {str(e)}")
-            ) 
\ No newline at end of file
+            )
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.18 on 2026-10-17 19:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_rollups(apps, schema_editor):
+    from django.db.models import Sum, Count
+    from django.db.models.functions import TruncDate
+
+    Expense = apps.get_model('api', 'Expense')
+    ExpenseDailyRollup = apps.get_model('api', 'ExpenseDailyRollup')
+
+    grouped = Expense.objects.annotate(
+        day=TruncDate('transaction_datetime')
+    ).values('user_id', 'day', 'category_id', 'subcategory_id').annotate(
+        total=Sum('expense_amount'),
+        count=Count('id')
+    ).order_by()
+
+    ExpenseDailyRollup.objects.bulk_create([
+        ExpenseDailyRollup(
+            user_id=row['user_id'],
+            date=row['day'],
+            category_id=row['category_id'],
+            subcategory_id=row['subcategory_id'],
+            total_amount=row['total'],
+            expense_count=row['count']
+        )
+        for row in grouped.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_weeklyreportsubscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expense_count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rollups', to='api.category')),
+                ('subcategory', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rollups', to='api.subcategory')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expense_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'date'], name='api_rollup_user_date_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
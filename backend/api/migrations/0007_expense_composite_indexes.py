@@ -0,0 +1,21 @@
+# Generated by Django 4.2.18 on 2026-10-17 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_expensedailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'transaction_datetime'], name='api_expense_user_txn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'category', 'transaction_datetime'], name='api_expense_user_cat_txn_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.18 on 2026-10-17 19:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_expense_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyReportDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField(help_text='First day of the week the report covers')),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+                ('subscription', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deliveries', to='api.weeklyreportsubscription')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_report_deliveries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'period_start')},
+            },
+        ),
+    ]
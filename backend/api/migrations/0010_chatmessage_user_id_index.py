@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-17 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_chatmessage_prompt_tokens'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['user', 'id'], name='api_chatmsg_user_id_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.18 on 2026-10-17 20:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_change_log(apps, schema_editor):
+    # Existing rows get an upsert each, so a full sync (since=0) returns the whole ledger
+    ChangeLogEntry = apps.get_model('api', 'ChangeLogEntry')
+    for kind, model_name in (
+        ('category', 'Category'), ('subcategory', 'SubCategory'), ('expense', 'Expense'), ('income', 'Income')
+    ):
+        rows = apps.get_model('api', model_name).objects.order_by('pk').values_list('user_id', 'pk')
+        ChangeLogEntry.objects.bulk_create((
+            ChangeLogEntry(user_id=user_id, kind=kind, object_id=object_id, action='upsert')
+            for user_id, object_id in rows.iterator(chunk_size=2000)
+        ), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_expense_import'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('expense', 'Expense'), ('category', 'Category'), ('subcategory', 'Subcategory'), ('income', 'Income')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='change_log', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'id'], name='api_changelog_user_id_idx'), models.Index(fields=['user', 'kind', 'object_id'], name='api_changelog_object_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_change_log, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-17 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_sync_operation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncoperation',
+            name='client',
+            field=models.CharField(default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-17 20:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_sync_operation_client'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='chat_cleared_upto_id',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.18 on 2026-10-17 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_user_chat_cleared_upto_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expenseimport',
+            name='amount_sign',
+            field=models.CharField(default='positive', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='expenseimport',
+            name='credits',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils import timezone
 
@@ -46,6 +46,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     otp_created_at = models.DateTimeField(blank=True, null=True)
     is_email_verified = models.BooleanField(default=False)
     
+    # Chat messages up to this id were cleared; a background purge may still be deleting them
+    chat_cleared_upto_id = models.PositiveIntegerField(default=0)
+    
     objects = UserManager()
     
     USERNAME_FIELD = 'email'
@@ -57,7 +60,30 @@ class User(AbstractBaseUser, PermissionsMixin):
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}"
 
-class Category(models.Model):
+class ChangeLoggedModel(models.Model):
+    """
+    Base for the models clients sync (see api.sync).
+
+    Saves run in a transaction that also covers the post_save signal, so the
+    change log entry written there commits or rolls back with the row.
+    Deletes send their signals inside the delete transaction already; the
+    entries of a whole cascade are inserted together.
+    """
+    
+    class Meta:
+        abstract = True
+    
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        from .data_cache import deferred_data_version_bumps
+        from .sync import deferred_change_log
+        with deferred_data_version_bumps(), deferred_change_log():
+            return super().delete(*args, **kwargs)
+
+class Category(ChangeLoggedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='categories')
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
@@ -70,7 +96,7 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
-class SubCategory(models.Model):
+class SubCategory(ChangeLoggedModel):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='subcategories')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subcategories')
     name = models.CharField(max_length=100)
@@ -84,7 +110,95 @@ class SubCategory(models.Model):
     def __str__(self):
         return f"{self.category.name} - {self.name}"
 
-class Expense(models.Model):
+class ExpenseQuerySet(models.QuerySet):
+    """
+    QuerySet that keeps ExpenseDailyRollup, the cached read payloads and the
+    change log in sync on bulk write paths, which bypass the per-instance
+    save/delete signals.
+    """
+    ROLLUP_FIELDS = {'user', 'user_id', 'expense_amount', 'transaction_datetime',
+                     'category', 'category_id', 'subcategory', 'subcategory_id'}
+
+    @staticmethod
+    def _record_writes(rows):
+        """Invalidate cached payloads and log upserts for (user_id, pk) pairs just written"""
+        from .data_cache import bump_data_version
+        from .sync import record_changes
+        rows = list(rows)
+        for user_id in {user_id for user_id, _ in rows}:
+            bump_data_version(user_id)
+        record_changes(ChangeLogEntry.KIND_EXPENSE, ChangeLogEntry.ACTION_UPSERT, rows)
+
+    def _rollup_keys(self):
+        from .rollups import rollup_key
+        return {
+            rollup_key(user_id, transaction_datetime)
+            for user_id, transaction_datetime in self.values_list('user_id', 'transaction_datetime')
+        }
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from .rollups import deferred_rollup_refresh, schedule_rollup_refresh, rollup_key
+        with deferred_rollup_refresh():
+            created = super().bulk_create(objs, *args, **kwargs)
+            schedule_rollup_refresh(
+                rollup_key(obj.user_id, obj.transaction_datetime) for obj in created
+            )
+            self._record_writes((obj.user_id, obj.pk) for obj in created)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from .rollups import deferred_rollup_refresh, rollup_refresh_disabled, schedule_rollup_refresh, rollup_key
+        if not self.ROLLUP_FIELDS.intersection(fields):
+            with transaction.atomic(savepoint=False), rollup_refresh_disabled():
+                updated = super().bulk_update(objs, fields, *args, **kwargs)
+                self._record_writes((obj.user_id, obj.pk) for obj in objs)
+            return updated
+        with deferred_rollup_refresh():
+            previous = self.model.objects.filter(pk__in=[obj.pk for obj in objs])._rollup_keys()
+            # Django's bulk_update runs update() per batch; the days are already known here
+            with rollup_refresh_disabled():
+                updated = super().bulk_update(objs, fields, *args, **kwargs)
+            schedule_rollup_refresh(previous | {
+                rollup_key(obj.user_id, obj.transaction_datetime) for obj in objs
+            })
+            self._record_writes((obj.user_id, obj.pk) for obj in objs)
+        return updated
+
+    def update(self, **kwargs):
+        from .rollups import deferred_rollup_refresh, rollup_refresh_is_disabled, schedule_rollup_refresh
+        if rollup_refresh_is_disabled():
+            # Inside bulk_update (which records its writes itself), a purge or an import
+            return super().update(**kwargs)
+        with deferred_rollup_refresh():
+            rows = list(self.values_list('user_id', 'pk'))
+            pks = [pk for _, pk in rows]
+            if self.ROLLUP_FIELDS.intersection(kwargs):
+                previous = self.model.objects.filter(pk__in=pks)._rollup_keys()
+                updated = super().update(**kwargs)
+                schedule_rollup_refresh(previous | self.model.objects.filter(pk__in=pks)._rollup_keys())
+            else:
+                updated = super().update(**kwargs)
+            if 'user_id' in kwargs or 'user' in kwargs:
+                # Moved to another user: the previous owners see a delete
+                from .data_cache import bump_data_version
+                from .sync import record_changes
+                for user_id in {user_id for user_id, _ in rows}:
+                    bump_data_version(user_id)
+                record_changes(ChangeLogEntry.KIND_EXPENSE, ChangeLogEntry.ACTION_DELETE, rows)
+                rows = list(self.model.objects.filter(pk__in=pks).values_list('user_id', 'pk'))
+            self._record_writes(rows)
+        return updated
+
+    def delete(self):
+        from .data_cache import deferred_data_version_bumps
+        from .rollups import deferred_rollup_refresh
+        from .sync import deferred_change_log
+        # Per-instance post_delete handlers queue their buckets, log entries and version
+        # bumps; write them once at the end
+        with deferred_data_version_bumps(), deferred_rollup_refresh(), deferred_change_log():
+            return super().delete()
+
+class Expense(ChangeLoggedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expenses')
     expense_note = models.TextField()
     expense_amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -92,12 +206,58 @@ class Expense(models.Model):
     receiver = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='received_expenses')
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='expenses')
     subcategory = models.ForeignKey(SubCategory, on_delete=models.SET_NULL, null=True, blank=True, related_name='expenses')
+    # Set on rows imported from a statement, so importing it again skips them
+    import_fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = ExpenseQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Date-range scans within one user's expenses (reports, rollup refresh, listing)
+            models.Index(fields=['user', 'transaction_datetime'], name='api_expense_user_txn_idx'),
+            # Category filters within one user's expenses, optionally bounded by date
+            models.Index(fields=['user', 'category', 'transaction_datetime'], name='api_expense_user_cat_txn_idx'),
+            # Duplicate detection when importing statements
+            models.Index(fields=['user', 'import_fingerprint'], name='api_expense_user_import_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.user.email} - {self.expense_amount} - {self.transaction_datetime}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the rollup bucket as loaded so a later save can refresh it if it moves
+        if 'user_id' in field_names and 'transaction_datetime' in field_names:
+            instance._loaded_rollup_values = (instance.user_id, instance.transaction_datetime)
+        return instance
+
+class ExpenseDailyRollup(models.Model):
+    """
+    Pre-aggregated expense totals per user, day, category and subcategory.
 
-class Income(models.Model):
+    Maintained from Expense writes (see api/signals.py and ExpenseQuerySet);
+    rebuild with `python manage.py rebuild_expense_rollups`.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expense_rollups')
+    date = models.DateField()
+    # SET_NULL mirrors Expense.category/subcategory, so deleting a category moves
+    # its totals to "Uncategorized" exactly like the underlying expenses
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='rollups')
+    subcategory = models.ForeignKey(SubCategory, on_delete=models.SET_NULL, null=True, blank=True, related_name='rollups')
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date'], name='api_rollup_user_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.date} - {self.total_amount}"
+
+class Income(ChangeLoggedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='incomes')
     everymonth_payment_date = models.PositiveSmallIntegerField(help_text="Day of the month for payment (1-31)")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -122,10 +282,16 @@ class ChatMessage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_messages')
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='user')
     content = models.TextField()
+    # Estimated prompt tokens sent to the model for this reply (assistant rows only)
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # History windows (since_id / before_id) within one user's messages
+            models.Index(fields=['user', 'id'], name='api_chatmsg_user_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.email} - {self.role} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
@@ -195,3 +361,163 @@ class WeeklyReportSubscription(models.Model):
     
     def __str__(self):
         return f"{self.user.email} - {'Active' if self.is_active else 'Inactive'}"
+
+class WeeklyReportDelivery(models.Model):
+    """Ledger of delivered weekly reports, so reruns skip users already served"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='weekly_report_deliveries')
+    subscription = models.ForeignKey(
+        WeeklyReportSubscription, on_delete=models.SET_NULL, null=True, blank=True, related_name='deliveries'
+    )
+    period_start = models.DateField(help_text="First day of the week the report covers")
+    sent_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('user', 'period_start')
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.period_start}"
+
+class PurgeJob(models.Model):
+    """Progress of a batched background delete (chat history or a whole account)"""
+    KIND_CHAT_HISTORY = 'chat_history'
+    KIND_ACCOUNT = 'account'
+    KIND_CHOICES = (
+        (KIND_CHAT_HISTORY, 'Chat history'),
+        (KIND_ACCOUNT, 'Account'),
+    )
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    
+    # Nulled when an account purge deletes the user itself, in its final step
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='purge_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # Chat history purges only delete messages up to this id, so newer ones survive
+    cutoff_id = models.PositiveIntegerField(null=True, blank=True)
+    step = models.CharField(max_length=50, blank=True, help_text="Table currently being purged")
+    deleted_rows = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.kind} purge for {self.user_id} - {self.status}"
+
+class ExpenseImport(models.Model):
+    """An uploaded statement CSV being imported as expenses, with its progress"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expense_imports')
+    # Removed once the import finishes
+    file = models.FileField(upload_to='imports/', blank=True)
+    file_name = models.CharField(max_length=255, blank=True)
+    # Overrides of the detected columns, e.g. {"note": "Payee"}, and an optional strptime format
+    columns = models.JSONField(default=dict, blank=True)
+    date_format = models.CharField(max_length=50, blank=True)
+    # Sign of spending in the amount column; rows of the other sign are credits (see api.importers)
+    amount_sign = models.CharField(max_length=10, default='positive')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    rows_read = models.PositiveIntegerField(default=0)
+    imported = models.PositiveIntegerField(default=0)
+    duplicates = models.PositiveIntegerField(default=0)
+    # Refunds, deposits and other credits skipped
+    credits = models.PositiveIntegerField(default=0)
+    failed_rows = models.PositiveIntegerField(default=0)
+    categories_created = models.PositiveIntegerField(default=0)
+    # The first few row errors as {"line": ..., "error": ...}
+    errors = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.file_name} - {self.status}"
+
+class ChangeLogEntry(models.Model):
+    """
+    Append-only log of writes to a user's synced data (the sync outbox).
+
+    One row per object written, in the same transaction as the write; the id
+    is the cursor clients pass to /api/sync/changes/. Superseded rows can be
+    removed with `python manage.py compact_change_log`.
+    """
+    KIND_EXPENSE = 'expense'
+    KIND_CATEGORY = 'category'
+    KIND_SUBCATEGORY = 'subcategory'
+    KIND_INCOME = 'income'
+    KIND_CHOICES = (
+        (KIND_EXPENSE, 'Expense'),
+        (KIND_CATEGORY, 'Category'),
+        (KIND_SUBCATEGORY, 'Subcategory'),
+        (KIND_INCOME, 'Income'),
+    )
+    ACTION_UPSERT = 'upsert'
+    ACTION_DELETE = 'delete'
+    ACTION_CHOICES = (
+        (ACTION_UPSERT, 'Upsert'),
+        (ACTION_DELETE, 'Delete'),
+    )
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='change_log')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # Reading a user's entries after a cursor
+            models.Index(fields=['user', 'id'], name='api_changelog_user_id_idx'),
+            # Finding superseded entries of an object when compacting
+            models.Index(fields=['user', 'kind', 'object_id'], name='api_changelog_object_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.action} {self.kind} {self.object_id}"
+
+class SyncOperation(models.Model):
+    """
+    An operation applied by /api/sync/batch/, remembered by its client key.
+
+    Replaying a key returns the stored result instead of applying the
+    operation again, so a client may resend a batch whose response it lost.
+    Creates also keep the id they produced, so later operations can target
+    the new expense by the key of its create.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sync_operations')
+    # Device or install that sent the batch; only its own changes are exempt from conflicts
+    client = models.CharField(max_length=64, default='')
+    key = models.CharField(max_length=64)
+    object_id = models.BigIntegerField(null=True, blank=True)
+    # Last change log id when the batch committed: this client's own entries, never a conflict
+    change_id = models.BigIntegerField(default=0)
+    result = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('user', 'key')
+        indexes = [
+            # Expiring old operations
+            models.Index(fields=['created_at'], name='api_syncop_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.key}"
@@ -0,0 +1,162 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+MAX_PAGE_SIZE = 100
+
+
+class StandardPageNumberPagination(PageNumberPagination):
+    """
+    Default page-number pagination that honours the client's `page_size`,
+    capped at MAX_PAGE_SIZE.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Keyset pagination over an (ordering field, id) pair.
+
+    Each page is fetched with `WHERE (field, id) < (last field, last id)` and a
+    LIMIT, with no OFFSET and no COUNT(*), so a page costs the same no matter
+    how deep the client scrolls. The cursor is an opaque token carrying the
+    last row's key; follow `next` until it is null.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Return the (field, id) ordering, honouring an explicit ?ordering= from
+        OrderingFilter and always breaking ties on id in the same direction.
+        """
+        ordering = self.ordering
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering') and backend.ordering_param in request.query_params:
+                requested = backend().get_ordering(request, queryset, view)
+                if requested:
+                    ordering = tuple(requested)
+                break
+        field = ordering[0]
+        descending = field.startswith('-')
+        return field.lstrip('-'), descending
+
+    def encode_cursor(self, value, pk):
+        payload = json.dumps([value, pk], default=str).encode()
+        return base64.urlsafe_b64encode(payload).decode()
+
+    def decode_cursor(self, request, field):
+        """
+        Return the (value, pk) key carried by the request's cursor, or None
+        without one.
+
+        Raises:
+            NotFound: For a cursor that is not one of ours, e.g. tampered with
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            key = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if not isinstance(key, list) or len(key) != 2:
+                raise ValueError('A cursor holds a [value, pk] pair')
+            value, pk = key
+            value = field.to_python(value)
+            if value is None:
+                raise ValueError('Ordering values are never null')
+            return value, int(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        field, descending = self.get_ordering(request, queryset, view)
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{field}', f'{prefix}pk')
+
+        cursor = self.decode_cursor(request, queryset.model._meta.get_field(field))
+        if cursor is not None:
+            value, pk = cursor
+            after, bound = ('lt', 'lte') if descending else ('gt', 'gte')
+            # The leading `field <= value` keeps the range on the composite index
+            queryset = queryset.filter(
+                Q(**{f'{field}__{bound}': value}) &
+                (Q(**{f'{field}__{after}': value}) | Q(**{f'pk__{after}': pk}))
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_key = (getattr(rows[-1], field), rows[-1].pk) if self.has_next else None
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(*self.next_key))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class ExpenseCursorPagination(KeysetCursorPagination):
+    ordering = ('-transaction_datetime', '-id')
+
+
+class CursorPaginationMixin:
+    """
+    Lets a viewset serve either page-number or keyset pagination.
+
+    Keyset mode is selected with `?pagination=cursor`, and stays selected for
+    the `next` links since those carry a `cursor` parameter.
+    """
+    cursor_pagination_class = KeysetCursorPagination
+
+    def uses_cursor_pagination(self):
+        params = self.request.query_params
+        return params.get('pagination') == 'cursor' or 'cursor' in params
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.uses_cursor_pagination():
+                self._paginator = self.cursor_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
@@ -0,0 +1,193 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .data_cache import deferred_data_version_bumps
+from .jobs import JobQueue
+from .rollups import rollup_refresh_disabled
+from .sync import change_log_disabled
+
+logger = logging.getLogger('api')
+
+purge_queue = JobQueue(
+    'purge',
+    max_workers=settings.PURGE_WORKERS,
+    max_retries=settings.PURGE_MAX_RETRIES,
+    retry_delay=settings.PURGE_RETRY_DELAY
+)
+
+
+def chat_history_floor(user):
+    """
+    Return the id up to which the user's chat messages were cleared.
+
+    A long history is cleared in the background; chat reads skip messages
+    at or below this id so the history looks cleared straight away. It is
+    kept on the user's row, so every process sees it, before and after a
+    restart, at no extra query. 0 when the history was never cleared.
+    """
+    return user.chat_cleared_upto_id
+
+
+def delete_in_batches(queryset, batch_size, on_batch=None):
+    """
+    Delete the rows of a queryset `batch_size` at a time.
+
+    Each batch is selected by primary key and deleted in its own short
+    transaction, with a PURGE_BATCH_PAUSE sleep in between so other writers
+    get the database lock. Stopping half way leaves the queryset with fewer
+    rows and nothing else, so calling this again simply carries on.
+
+    Args:
+        queryset: Rows to delete; cascades run per batch as usual
+        batch_size: Rows selected per batch
+        on_batch: Optional callable receiving the rows deleted by each batch
+
+    Returns:
+        int: Rows deleted, cascaded rows included
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # Bumped once per batch, after it commits
+        with deferred_data_version_bumps(), transaction.atomic():
+            count, _ = queryset.model.objects.filter(pk__in=ids).delete()
+        deleted += count
+        if on_batch is not None:
+            on_batch(count)
+        if len(ids) < batch_size:
+            return deleted
+        time.sleep(settings.PURGE_BATCH_PAUSE)
+
+
+def _purge_steps(job):
+    """Return the (step name, queryset) pairs of a job, in deletion order"""
+    from .models import (
+        ChatMessage, Expense, ExpenseDailyRollup, Income, Category, SubCategory,
+        WeeklyReportSubscription, WeeklyReportDelivery, ChangeLogEntry, SyncOperation
+    )
+
+    user_id = job.user_id
+    if job.kind == job.KIND_CHAT_HISTORY:
+        return [('chat_messages', ChatMessage.objects.filter(user_id=user_id, id__lte=job.cutoff_id))]
+    # Children before parents, so each batch cascades to nothing big
+    return [
+        ('chat_messages', ChatMessage.objects.filter(user_id=user_id)),
+        ('expenses', Expense.objects.filter(user_id=user_id)),
+        ('expense_rollups', ExpenseDailyRollup.objects.filter(user_id=user_id)),
+        ('incomes', Income.objects.filter(user_id=user_id)),
+        ('weekly_report_deliveries', WeeklyReportDelivery.objects.filter(user_id=user_id)),
+        ('weekly_report_subscriptions', WeeklyReportSubscription.objects.filter(user_id=user_id)),
+        ('subcategories', SubCategory.objects.filter(user_id=user_id)),
+        ('categories', Category.objects.filter(user_id=user_id)),
+        ('change_log', ChangeLogEntry.objects.filter(user_id=user_id)),
+        ('sync_operations', SyncOperation.objects.filter(user_id=user_id)),
+    ]
+
+
+def run_purge(job_id):
+    """
+    Run or resume a purge job.
+
+    Every step deletes whatever still matches it, so a job interrupted by a
+    crash or restart is resumed by running it again. Progress (current step
+    and rows deleted) is saved after every batch. An account purge deletes
+    the user row last, once nothing big is left to cascade. Raises on errors
+    so the queue retries.
+    """
+    from .models import PurgeJob, User
+
+    job = PurgeJob.objects.filter(pk=job_id).exclude(status=PurgeJob.STATUS_DONE).first()
+    if job is None:
+        return
+    started = time.monotonic()
+    job.status = PurgeJob.STATUS_RUNNING
+    job.error = ''
+    job.save(update_fields=['status', 'error', 'updated_at'])
+
+    def record_batch(count):
+        job.deleted_rows += count
+        job.save(update_fields=['deleted_rows', 'updated_at'])
+
+    try:
+        if job.user_id is not None:
+            # The rollup rows and change log are purged too; maintaining them per batch would be wasted
+            with rollup_refresh_disabled(), change_log_disabled():
+                for step, queryset in _purge_steps(job):
+                    job.step = step
+                    job.save(update_fields=['step', 'updated_at'])
+                    delete_in_batches(queryset, settings.PURGE_BATCH_SIZE, record_batch)
+
+        with transaction.atomic():
+            if job.kind == PurgeJob.KIND_ACCOUNT and job.user_id is not None:
+                job.step = 'user'
+                record_batch(User.objects.filter(pk=job.user_id).delete()[0])
+            PurgeJob.objects.filter(pk=job.pk).update(
+                status=PurgeJob.STATUS_DONE,
+                step='',
+                deleted_rows=job.deleted_rows,
+                finished_at=timezone.now()
+            )
+    except Exception as e:
+        PurgeJob.objects.filter(pk=job.pk).update(status=PurgeJob.STATUS_FAILED, error=str(e))
+        raise
+
+    logger.info(
+        f"Purge {job.pk} ({job.kind}) finished: {job.deleted_rows} rows "
+        f"in {time.monotonic() - started:.2f}s"
+    )
+
+
+def clear_chat_history(user):
+    """
+    Delete a user's chat messages.
+
+    Histories of up to PURGE_BATCH_SIZE messages are deleted right away. Longer
+    ones are handed to a background purge job and hidden from chat reads at
+    once through the user's chat_cleared_upto_id; messages sent after this
+    call are kept.
+
+    Returns:
+        tuple: (messages deleted now, PurgeJob or None)
+    """
+    from .models import ChatMessage, PurgeJob, User
+
+    batch_size = settings.PURGE_BATCH_SIZE
+    ids = list(
+        ChatMessage.objects.filter(user=user).order_by('-id').values_list('id', flat=True)[:batch_size + 1]
+    )
+    if len(ids) <= batch_size:
+        deleted, _ = ChatMessage.objects.filter(pk__in=ids).delete()
+        return deleted, None
+
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(chat_cleared_upto_id=ids[0])
+        user.chat_cleared_upto_id = ids[0]
+        job = PurgeJob.objects.create(user=user, kind=PurgeJob.KIND_CHAT_HISTORY, cutoff_id=ids[0])
+        purge_queue.submit(run_purge, job.id)
+    return 0, job
+
+
+def start_account_purge(user):
+    """
+    Deactivate an account and queue the deletion of all of its data.
+
+    The user can no longer authenticate once this returns; the rows are then
+    removed in batches by a background purge job.
+
+    Returns:
+        PurgeJob: The queued job
+    """
+    from .models import PurgeJob, User
+
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        job = PurgeJob.objects.create(user=user, kind=PurgeJob.KIND_ACCOUNT)
+        purge_queue.submit(run_purge, job.id)
+    logger.info(f"Queued account purge {job.pk} for user {user.pk}")
+    return job
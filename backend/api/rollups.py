@@ -0,0 +1,230 @@
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Sum, Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .data_cache import bump_data_version
+
+logger = logging.getLogger('api')
+
+_state = threading.local()
+
+
+def rollup_key(user_id, transaction_datetime):
+    """
+    Return the (user_id, date) bucket an expense belongs to.
+
+    Days are computed in the current timezone, the same way TruncDate does.
+    """
+    if transaction_datetime is None:
+        return None
+    if isinstance(transaction_datetime, str):
+        from django.utils.dateparse import parse_datetime
+        transaction_datetime = parse_datetime(transaction_datetime)
+    if timezone.is_naive(transaction_datetime):
+        transaction_datetime = timezone.make_aware(transaction_datetime)
+    return (user_id, timezone.localdate(transaction_datetime))
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _contiguous_runs(days):
+    """Split a set of dates into (first, last) runs of consecutive days"""
+    runs = []
+    for day in sorted(days):
+        if runs and day == runs[-1][1] + timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def refresh_expense_rollups(keys):
+    """
+    Recompute the rollup rows for the given (user_id, date) buckets.
+
+    Each contiguous run of days is rebuilt with a single grouped query over
+    Expense, so the cost scales with the expenses on those days only.
+    """
+    from .models import Expense, ExpenseDailyRollup
+
+    days_by_user = defaultdict(set)
+    for key in keys:
+        if key is not None:
+            days_by_user[key[0]].add(key[1])
+
+    with transaction.atomic():
+        for user_id, days in days_by_user.items():
+            for first_day, last_day in _contiguous_runs(days):
+                ExpenseDailyRollup.objects.filter(
+                    user_id=user_id,
+                    date__gte=first_day,
+                    date__lte=last_day
+                ).delete()
+
+                grouped = Expense.objects.filter(
+                    user_id=user_id,
+                    transaction_datetime__gte=_day_start(first_day),
+                    transaction_datetime__lt=_day_start(last_day + timedelta(days=1))
+                ).annotate(
+                    day=TruncDate('transaction_datetime')
+                ).values('day', 'category_id', 'subcategory_id').annotate(
+                    total=Sum('expense_amount'),
+                    count=Count('id')
+                ).order_by()
+
+                ExpenseDailyRollup.objects.bulk_create([
+                    ExpenseDailyRollup(
+                        user_id=user_id,
+                        date=row['day'],
+                        category_id=row['category_id'],
+                        subcategory_id=row['subcategory_id'],
+                        total_amount=row['total'],
+                        expense_count=row['count']
+                    )
+                    for row in grouped
+                ])
+
+
+def schedule_rollup_refresh(keys):
+    """
+    Refresh the given buckets now, or at the end of the enclosing
+    deferred_rollup_refresh() block if one is active.
+    """
+    if rollup_refresh_is_disabled():
+        return
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending.update(key for key in keys if key is not None)
+    else:
+        refresh_expense_rollups(keys)
+
+
+@contextmanager
+def deferred_rollup_refresh():
+    """
+    Collect rollup refreshes for the duration of the block and apply them once.
+
+    Used by bulk write paths so that touching many expenses on the same day
+    results in a single refresh of that day instead of one per row.
+    """
+    if getattr(_state, 'pending', None) is not None:
+        # Nested block: the outermost one will flush
+        yield
+        return
+
+    _state.pending = set()
+    try:
+        with transaction.atomic():
+            yield
+            pending = _state.pending
+            _state.pending = None
+            if pending:
+                refresh_expense_rollups(pending)
+    finally:
+        _state.pending = None
+
+
+def rollup_refresh_is_disabled():
+    return getattr(_state, 'disabled', False)
+
+
+@contextmanager
+def rollup_refresh_disabled():
+    """
+    Skip rollup refreshes for the duration of the block.
+
+    For purges that delete a user's rollup rows themselves, where refreshing
+    the days of every deleted expense batch would be wasted work, and for
+    bulk paths that work out the affected days on their own.
+    """
+    previous = getattr(_state, 'disabled', False)
+    _state.disabled = True
+    try:
+        yield
+    finally:
+        _state.disabled = previous
+
+
+def rebuild_user_rollups(user_id):
+    """
+    Drop and rebuild every rollup row for a user from their expenses.
+
+    Cached payloads built from the old rows are invalidated, since a rebuild
+    may change totals without any expense being written.
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    from .models import Expense, ExpenseDailyRollup
+
+    with transaction.atomic():
+        ExpenseDailyRollup.objects.filter(user_id=user_id).delete()
+        grouped = Expense.objects.filter(user_id=user_id).annotate(
+            day=TruncDate('transaction_datetime')
+        ).values('day', 'category_id', 'subcategory_id').annotate(
+            total=Sum('expense_amount'),
+            count=Count('id')
+        ).order_by()
+        rollups = ExpenseDailyRollup.objects.bulk_create([
+            ExpenseDailyRollup(
+                user_id=user_id,
+                date=row['day'],
+                category_id=row['category_id'],
+                subcategory_id=row['subcategory_id'],
+                total_amount=row['total'],
+                expense_count=row['count']
+            )
+            for row in grouped
+        ], batch_size=500)
+        bump_data_version(user_id)
+    return len(rollups)
+
+
+def find_rollup_mismatches(user_id):
+    """
+    Compare a user's rollup rows against a fresh aggregation of their expenses.
+
+    Returns:
+        list: One dict per (date, category, subcategory) bucket that disagrees
+    """
+    from .models import Expense, ExpenseDailyRollup
+
+    expected = {
+        (row['day'], row['category_id'], row['subcategory_id']): (row['total'], row['count'])
+        for row in Expense.objects.filter(user_id=user_id).annotate(
+            day=TruncDate('transaction_datetime')
+        ).values('day', 'category_id', 'subcategory_id').annotate(
+            total=Sum('expense_amount'),
+            count=Count('id')
+        ).order_by()
+    }
+    actual = {
+        (row['date'], row['category_id'], row['subcategory_id']): (row['total'], row['count'])
+        for row in ExpenseDailyRollup.objects.filter(user_id=user_id).values(
+            'date', 'category_id', 'subcategory_id'
+        ).annotate(
+            total=Sum('total_amount'),
+            count=Sum('expense_count')
+        ).order_by()
+    }
+
+    mismatches = []
+    for bucket in expected.keys() | actual.keys():
+        if expected.get(bucket) != actual.get(bucket):
+            mismatches.append({
+                'date': bucket[0],
+                'category_id': bucket[1],
+                'subcategory_id': bucket[2],
+                'expected': expected.get(bucket),
+                'actual': actual.get(bucket),
+            })
+    return mismatches
@@ -1,7 +1,12 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
-from .models import Category, SubCategory, Expense, Income, ChatMessage, OTPVerification, WeeklyReportSubscription
+from .models import (
+    Category, SubCategory, Expense, Income, ChatMessage, OTPVerification, WeeklyReportSubscription, PurgeJob,
+    ExpenseImport
+)
+from .importers import AMOUNT_SIGNS
 
 User = get_user_model()
 
@@ -60,7 +65,7 @@ class SubCategorySerializer(serializers.ModelSerializer):
         return super().create(validated_data)
     
     def validate_category(self, value):
-        if value.user != self.context['request'].user:
+        if value.user_id != self.context['request'].user.id:
             raise serializers.ValidationError("Category does not belong to this user")
         return value
 
@@ -86,22 +91,78 @@ class ExpenseSerializer(serializers.ModelSerializer):
     
     def validate(self, attrs):
         if 'category' in attrs and 'subcategory' in attrs and attrs['subcategory']:
-            if attrs['subcategory'].category != attrs['category']:
+            if attrs['subcategory'].category_id != (attrs['category'].id if attrs['category'] else None):
                 raise serializers.ValidationError({
                     "subcategory": "Subcategory does not belong to the selected category"
                 })
         return attrs
     
     def validate_category(self, value):
-        if value and value.user != self.context['request'].user:
+        if value and value.user_id != self.context['request'].user.id:
             raise serializers.ValidationError("Category does not belong to this user")
         return value
     
     def validate_subcategory(self, value):
-        if value and value.user != self.context['request'].user:
+        if value and value.user_id != self.context['request'].user.id:
             raise serializers.ValidationError("Subcategory does not belong to this user")
         return value
 
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field resolved from objects preloaded into
+    context['preloaded'][model], so validating a batch costs no query per row.
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = self.context['preloaded'][self.queryset.model].get(pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+class BulkExpenseSerializer(ExpenseSerializer):
+    """ExpenseSerializer for one item of a bulk request; see ExpenseViewSet.bulk_context()"""
+    receiver = PreloadedPrimaryKeyRelatedField(queryset=User.objects.all(), required=False, allow_null=True)
+    category = PreloadedPrimaryKeyRelatedField(queryset=Category.objects.all(), required=False, allow_null=True)
+    subcategory = PreloadedPrimaryKeyRelatedField(
+        queryset=SubCategory.objects.all(), required=False, allow_null=True
+    )
+
+class ExpenseImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExpenseImport
+        fields = ['id', 'file_name', 'status', 'amount_sign', 'rows_read', 'imported', 'duplicates', 'credits',
+                  'failed_rows', 'categories_created', 'errors', 'created_at', 'updated_at', 'finished_at']
+        read_only_fields = fields
+
+class ExpenseImportRequestSerializer(serializers.Serializer):
+    """Upload for ExpenseViewSet.import_csv; the *_column fields override detected headers"""
+    file = serializers.FileField()
+    note_column = serializers.CharField(required=False, allow_blank=True)
+    amount_column = serializers.CharField(required=False, allow_blank=True)
+    datetime_column = serializers.CharField(required=False, allow_blank=True)
+    category_column = serializers.CharField(required=False, allow_blank=True)
+    date_format = serializers.CharField(required=False, allow_blank=True, max_length=50)
+    amount_sign = serializers.ChoiceField(choices=AMOUNT_SIGNS, default='positive')
+    
+    def validate_file(self, value):
+        if value.size > settings.EXPENSE_IMPORT_MAX_BYTES:
+            raise serializers.ValidationError(
+                f"File is larger than {settings.EXPENSE_IMPORT_MAX_BYTES // (1024 * 1024)} MB"
+            )
+        return value
+    
+    def columns(self):
+        return {
+            field: self.validated_data[f'{field}_column']
+            for field in ('note', 'amount', 'datetime', 'category')
+            if self.validated_data.get(f'{field}_column')
+        }
+
 class IncomeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Income
@@ -119,12 +180,19 @@ class IncomeSerializer(serializers.ModelSerializer):
 class ChatMessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatMessage
-        fields = ['id', 'role', 'content', 'created_at']
+        fields = ['id', 'role', 'content', 'prompt_tokens', 'created_at']
+        read_only_fields = ['prompt_tokens']
     
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
+class PurgeJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PurgeJob
+        fields = ['id', 'kind', 'status', 'step', 'deleted_rows', 'error', 'created_at', 'updated_at', 'finished_at']
+        read_only_fields = fields
+
 class OTPRequestSerializer(serializers.Serializer):
     email = serializers.EmailField(required=True)
     verification_type = serializers.ChoiceField(
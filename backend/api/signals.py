@@ -0,0 +1,106 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django.contrib.auth import get_user_model
+
+from .models import Expense, Income, Category, SubCategory, ChangeLogEntry
+from .rollups import rollup_key, schedule_rollup_refresh
+from .data_cache import bump_data_version
+from .sync import record_changes
+
+User = get_user_model()
+
+CHANGE_LOG_KINDS = {
+    Expense: ChangeLogEntry.KIND_EXPENSE,
+    Category: ChangeLogEntry.KIND_CATEGORY,
+    SubCategory: ChangeLogEntry.KIND_SUBCATEGORY,
+    Income: ChangeLogEntry.KIND_INCOME,
+}
+
+
+@receiver(post_save, sender=Expense)
+def refresh_rollups_on_expense_save(sender, instance, raw=False, **kwargs):
+    """Refresh the day the expense is on now, and the day it was on before"""
+    if raw:
+        return
+    keys = {rollup_key(instance.user_id, instance.transaction_datetime)}
+    loaded = getattr(instance, '_loaded_rollup_values', None)
+    if loaded:
+        keys.add(rollup_key(*loaded))
+    schedule_rollup_refresh(keys)
+    instance._loaded_rollup_values = (instance.user_id, instance.transaction_datetime)
+
+
+@receiver(post_delete, sender=Expense)
+def refresh_rollups_on_expense_delete(sender, instance, origin=None, **kwargs):
+    # Deleting a user cascades to their rollups as well; nothing to refresh
+    if isinstance(origin, User):
+        return
+    schedule_rollup_refresh({rollup_key(instance.user_id, instance.transaction_datetime)})
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Income)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=SubCategory)
+def bump_data_version_on_write(sender, instance, raw=False, origin=None, **kwargs):
+    """Invalidate the owner's cached read payloads (see api.data_cache)"""
+    # Nothing is left to serve once the user row itself is deleted
+    if raw or isinstance(origin, User):
+        return
+    bump_data_version(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def bump_data_version_on_user_save(sender, instance, raw=False, **kwargs):
+    # /api/users/me/ is cached as well
+    if not raw:
+        bump_data_version(instance.pk)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Income)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=SubCategory)
+def log_change_on_save(sender, instance, raw=False, **kwargs):
+    """Runs inside ChangeLoggedModel.save's transaction"""
+    if not raw:
+        record_changes(CHANGE_LOG_KINDS[sender], ChangeLogEntry.ACTION_UPSERT, [(instance.user_id, instance.pk)])
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=SubCategory)
+def log_change_on_delete(sender, instance, origin=None, **kwargs):
+    # The user's log goes with the user
+    if isinstance(origin, User):
+        return
+    record_changes(CHANGE_LOG_KINDS[sender], ChangeLogEntry.ACTION_DELETE, [(instance.user_id, instance.pk)])
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=SubCategory)
+def log_expenses_losing_category(sender, instance, origin=None, **kwargs):
+    """Deleting a (sub)category nulls it on its expenses with a plain UPDATE, which sends no signal"""
+    if isinstance(origin, User):
+        return
+    field = 'category' if sender is Category else 'subcategory'
+    record_changes(
+        ChangeLogEntry.KIND_EXPENSE,
+        ChangeLogEntry.ACTION_UPSERT,
+        Expense.objects.filter(**{field: instance}).values_list('user_id', 'pk')
+    )
+
+
+
+@receiver(pre_delete, sender=User)
+def log_expenses_losing_receiver(sender, instance, **kwargs):
+    """Deleting a user nulls them as receiver on other users' expenses with a plain UPDATE, which sends no signal"""
+    rows = list(Expense.objects.filter(receiver=instance).exclude(user=instance).values_list('user_id', 'pk'))
+    record_changes(ChangeLogEntry.KIND_EXPENSE, ChangeLogEntry.ACTION_UPSERT, rows)
+    for user_id in {user_id for user_id, _ in rows}:
+        bump_data_version(user_id)
@@ -0,0 +1,381 @@
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+logger = logging.getLogger('api')
+
+_state = threading.local()
+
+
+def change_log_is_disabled():
+    return getattr(_state, 'disabled', False)
+
+
+@contextmanager
+def change_log_disabled():
+    """
+    Skip change log writes for the duration of the block.
+
+    For account purges: the user's log rows are deleted along with the user,
+    so logging every purged row first would be wasted work.
+    """
+    previous = getattr(_state, 'disabled', False)
+    _state.disabled = True
+    try:
+        yield
+    finally:
+        _state.disabled = previous
+
+
+@contextmanager
+def deferred_change_log():
+    """
+    Collect change log entries for the duration of the block and insert them
+    with one bulk_create at the end, in the same transaction as the writes.
+    """
+    if getattr(_state, 'pending', None) is not None:
+        # Nested block: the outermost one will flush
+        yield
+        return
+
+    _state.pending = []
+    try:
+        with transaction.atomic(savepoint=False):
+            yield
+            pending = _state.pending
+            _state.pending = None
+            if pending:
+                _insert_entries(pending)
+    finally:
+        _state.pending = None
+
+
+def _insert_entries(entries):
+    from .models import ChangeLogEntry
+
+    ChangeLogEntry.objects.bulk_create(
+        [ChangeLogEntry(user_id=user_id, kind=kind, object_id=object_id, action=action)
+         for user_id, kind, object_id, action in entries],
+        batch_size=500
+    )
+
+
+def record_changes(kind, action, rows):
+    """
+    Append entries to the change log.
+
+    Call this inside the transaction of the write it describes, so the entry
+    commits (or rolls back) together with the row.
+
+    Args:
+        kind: One of ChangeLogEntry.KIND_* ('expense', 'category', ...)
+        action: ChangeLogEntry.ACTION_UPSERT or ACTION_DELETE
+        rows: Iterable of (user_id, object_id) pairs
+    """
+    if change_log_is_disabled():
+        return
+    entries = [(user_id, kind, object_id, action) for user_id, object_id in rows if user_id is not None]
+    if not entries:
+        return
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending.extend(entries)
+    else:
+        _insert_entries(entries)
+
+
+def _sync_sources():
+    """(kind, response key, queryset, serializer class) for every synced model"""
+    from .models import ChangeLogEntry, Category, SubCategory, Expense, Income
+    from .serializers import CategorySerializer, SubCategorySerializer, ExpenseSerializer, IncomeSerializer
+
+    return (
+        (ChangeLogEntry.KIND_CATEGORY, 'categories', Category.objects.all(), CategorySerializer),
+        (ChangeLogEntry.KIND_SUBCATEGORY, 'subcategories', SubCategory.objects.select_related('category'),
+         SubCategorySerializer),
+        (ChangeLogEntry.KIND_EXPENSE, 'expenses', Expense.objects.select_related('category', 'subcategory'),
+         ExpenseSerializer),
+        (ChangeLogEntry.KIND_INCOME, 'incomes', Income.objects.all(), IncomeSerializer),
+    )
+
+
+def changes_since(user, since=0, limit=None, context=None):
+    """
+    Return what changed in a user's ledger after a change log cursor.
+
+    Entries are collapsed per object to the last action, so an object edited
+    many times is sent once. Upserts carry the object as it is now, serialized
+    like the regular endpoints; an object deleted since it was logged comes
+    back as a tombstone. A cursor of 0 returns the whole ledger.
+
+    Log ids are only a safe cursor because SQLite serializes writers: an entry
+    can never commit after one with a higher id has been read.
+
+    Args:
+        user: Owner of the ledger
+        since: Cursor returned by the previous call (0 for a full sync)
+        limit: Log entries read per call (default: settings.SYNC_PAGE_SIZE)
+        context: Serializer context (the request, for absolute URLs)
+
+    Returns:
+        dict: cursor (pass as `since` next time), has_more, and per model
+            upserts (objects) and deletes (ids)
+    """
+    from .models import ChangeLogEntry
+
+    limit = limit or settings.SYNC_PAGE_SIZE
+    entries = list(
+        ChangeLogEntry.objects.filter(user=user, id__gt=since).order_by('id').values_list(
+            'id', 'kind', 'object_id', 'action'
+        )[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    last_action = {}
+    for _, kind, object_id, action in entries:
+        last_action[(kind, object_id)] = action
+
+    result = {
+        'cursor': entries[-1][0] if entries else since,
+        'has_more': has_more,
+        'upserts': {},
+        'deletes': {},
+    }
+    for kind, key, queryset, serializer_class in _sync_sources():
+        upsert_ids = [object_id for (entry_kind, object_id), action in last_action.items()
+                      if entry_kind == kind and action == ChangeLogEntry.ACTION_UPSERT]
+        deleted_ids = {object_id for (entry_kind, object_id), action in last_action.items()
+                       if entry_kind == kind and action == ChangeLogEntry.ACTION_DELETE}
+        objects = queryset.filter(user=user).in_bulk(upsert_ids) if upsert_ids else {}
+        # Deleted after the entries read here; the later tombstone is sent again, harmlessly
+        deleted_ids.update(object_id for object_id in upsert_ids if object_id not in objects)
+        result['upserts'][key] = serializer_class(
+            [objects[object_id] for object_id in sorted(objects)], many=True, context=context or {}
+        ).data
+        result['deletes'][key] = sorted(deleted_ids)
+    return result
+
+
+def compact_change_log(batch_size=None):
+    """
+    Delete log entries superseded by a later entry for the same object.
+
+    Any cursor still gets every object changed after it, since each object's
+    latest entry is kept, so compaction never forces clients to resync.
+
+    Returns:
+        int: Entries deleted
+    """
+    from .models import ChangeLogEntry
+    from .purge import delete_in_batches
+
+    superseded = ChangeLogEntry.objects.filter(Exists(ChangeLogEntry.objects.filter(
+        user_id=OuterRef('user_id'),
+        kind=OuterRef('kind'),
+        object_id=OuterRef('object_id'),
+        id__gt=OuterRef('id')
+    )))
+    deleted = delete_in_batches(superseded, batch_size or settings.PURGE_BATCH_SIZE)
+    logger.info(f"Change log compaction deleted {deleted} superseded entries")
+    return deleted
+
+
+BATCH_ACTIONS = ('create', 'update', 'delete')
+
+
+def _operation_errors(operation):
+    """Return the shape errors of one batch operation, or None when it is well formed"""
+    if not isinstance(operation, dict):
+        return {'non_field_errors': ['Expected an object']}
+    errors = {}
+    key = operation.get('key')
+    if not isinstance(key, str) or not 1 <= len(key) <= 64:
+        errors['key'] = ['A string of 1 to 64 characters is required']
+    if operation.get('op') not in BATCH_ACTIONS:
+        errors['op'] = [f"One of {', '.join(BATCH_ACTIONS)} is required"]
+    elif operation['op'] != 'create':
+        target_id, ref = operation.get('id'), operation.get('ref')
+        if (target_id is None) == (ref is None):
+            errors['id'] = ['Either id or ref (the key of an earlier create) is required']
+        elif target_id is not None and (not isinstance(target_id, int) or isinstance(target_id, bool)):
+            errors['id'] = ['Expected an integer']
+        elif ref is not None and not isinstance(ref, str):
+            errors['ref'] = ['Expected a string']
+    if operation.get('op') in ('create', 'update') and not isinstance(operation.get('data'), dict):
+        errors['data'] = ['An object with the expense fields is required']
+    if not isinstance(operation.get('force', False), bool):
+        errors['force'] = ['Expected a boolean']
+    return errors or None
+
+
+def apply_operations(user, client, since, operations, context):
+    """
+    Apply a client's queued expense operations, in order, in one transaction.
+
+    Each operation is {"key", "op", "id" or "ref", "data", "force"}: `key` is a
+    client-generated idempotency key, `op` is create, update or delete, and
+    updates and deletes target an expense by `id` or by `ref`, the key of an
+    earlier create (in this batch or a previous one). An operation whose key
+    was applied before is not applied again; its stored result is returned.
+
+    An update or delete conflicts when the expense changed after `since`, the
+    change log cursor the client last synced to, unless `force` is set. Failed
+    and conflicting operations are reported and skipped; the others are
+    applied. Changes made by the same client's earlier batches never conflict,
+    so resending a batch before syncing again is safe; those of the user's
+    other clients do, like any other write. Targets, their log
+    entries and recorded keys are read with one query each, however long the
+    batch.
+
+    Args:
+        user: Owner of the expenses
+        client: Id of the device or install sending the batch
+        since: Change log cursor of the client's last sync
+        operations: List of operation dicts, as sent by the client
+        context: Serializer context with the preloaded categories,
+            subcategories and receivers (see views.preload_expense_relations)
+
+    Returns:
+        list: One result per operation, in order, each with the `key`, a
+            `status` (applied, conflict or error) and the expense `id`, plus
+            `expense` (applied creates and updates), `current` (conflicts,
+            None when deleted) or `errors`
+    """
+    from .data_cache import deferred_data_version_bumps
+    from .models import ChangeLogEntry, Expense, SyncOperation
+    from .rollups import deferred_rollup_refresh
+    from .serializers import BulkExpenseSerializer, ExpenseSerializer
+
+    shape_errors = [_operation_errors(operation) for operation in operations]
+    valid = [operation for operation, errors in zip(operations, shape_errors) if errors is None]
+    keys = {operation['key'] for operation in valid} | {
+        operation['ref'] for operation in valid if operation.get('ref') is not None
+    }
+    recorded = {row.key: row for row in SyncOperation.objects.filter(user=user, key__in=keys)}
+
+    target_ids = {operation['id'] for operation in valid if operation.get('id') is not None}
+    target_ids.update(
+        recorded[operation['ref']].object_id for operation in valid
+        if operation.get('ref') in recorded and recorded[operation['ref']].object_id is not None
+    )
+    expenses = Expense.objects.filter(user=user).select_related('category', 'subcategory').in_bulk(target_ids)
+    changed = {}
+    for object_id, action in ChangeLogEntry.objects.filter(
+        user=user, kind=ChangeLogEntry.KIND_EXPENSE, object_id__in=target_ids, id__gt=since
+    ).exclude(Exists(SyncOperation.objects.filter(
+        user=user, client=client, object_id=OuterRef('object_id'), change_id__gte=OuterRef('id')
+    ))).order_by('id').values_list('object_id', 'action'):
+        changed[object_id] = action
+
+    def serialize(expense):
+        return ExpenseSerializer(expense, context=context).data
+
+    def remember(key, object_id, result):
+        records.append(SyncOperation(user=user, client=client, key=key, object_id=object_id, result=result))
+
+    results = []
+    created = {}
+    seen = set()
+    records = []
+    with deferred_data_version_bumps(), transaction.atomic():
+        with deferred_rollup_refresh(), deferred_change_log():
+            for operation, errors in zip(operations, shape_errors):
+                key = operation.get('key') if isinstance(operation, dict) else None
+                if errors is None and key in seen:
+                    errors = {'key': ['Key repeated in this batch']}
+                if errors is not None:
+                    results.append({'key': key, 'status': 'error', 'errors': errors})
+                    continue
+                seen.add(key)
+                if key in recorded:
+                    results.append({**recorded[key].result, 'replayed': True})
+                    continue
+
+                op = operation['op']
+                if op == 'create':
+                    serializer = BulkExpenseSerializer(data=operation['data'], context=context)
+                    if not serializer.is_valid():
+                        results.append({'key': key, 'status': 'error', 'errors': serializer.errors})
+                        continue
+                    expense = serializer.save()
+                    created[key] = expense
+                    expenses[expense.pk] = expense
+                    result = {'key': key, 'status': 'applied', 'id': expense.pk, 'expense': serialize(expense)}
+                    remember(key, expense.pk, result)
+                    results.append(result)
+                    continue
+
+                ref = operation.get('ref')
+                if ref is not None:
+                    if ref in created:
+                        object_id = created[ref].pk
+                    elif ref in recorded and recorded[ref].object_id is not None:
+                        object_id = recorded[ref].object_id
+                    else:
+                        results.append({'key': key, 'status': 'error', 'errors': {'ref': ['No create with this key']}})
+                        continue
+                else:
+                    object_id = operation['id']
+                expense = expenses.get(object_id)
+
+                # Expenses created in this batch cannot have changed behind the client's back
+                if object_id in changed and not operation.get('force') and ref not in created:
+                    if op == 'delete' and expense is None:
+                        # Deleted elsewhere too: the outcome the client asked for
+                        result = {'key': key, 'status': 'applied', 'id': object_id}
+                        remember(key, object_id, result)
+                        results.append(result)
+                    else:
+                        results.append({
+                            'key': key, 'status': 'conflict', 'id': object_id,
+                            'current': serialize(expense) if expense is not None else None
+                        })
+                    continue
+                if expense is None:
+                    results.append({'key': key, 'status': 'error', 'id': object_id, 'errors': {'id': ['Expense not found']}})
+                    continue
+
+                if op == 'update':
+                    serializer = BulkExpenseSerializer(expense, data=operation['data'], partial=True, context=context)
+                    if not serializer.is_valid():
+                        results.append({'key': key, 'status': 'error', 'id': object_id, 'errors': serializer.errors})
+                        continue
+                    expense = serializer.save()
+                    result = {'key': key, 'status': 'applied', 'id': object_id, 'expense': serialize(expense)}
+                else:
+                    expense.delete()
+                    del expenses[object_id]
+                    result = {'key': key, 'status': 'applied', 'id': object_id}
+                remember(key, object_id, result)
+                results.append(result)
+
+        if records:
+            change_id = ChangeLogEntry.objects.filter(user=user).aggregate(Max('id'))['id__max'] or 0
+            for record in records:
+                record.change_id = change_id
+            # A concurrent batch recording the same key fails here and rolls back whole
+            SyncOperation.objects.bulk_create(records)
+    return results
+
+
+def expire_sync_operations():
+    """
+    Delete batch operation keys older than SYNC_OPERATION_RETENTION_DAYS.
+
+    Returns:
+        int: Keys deleted
+    """
+    from .models import SyncOperation
+    from .purge import delete_in_batches
+
+    cutoff = timezone.now() - timedelta(days=settings.SYNC_OPERATION_RETENTION_DAYS)
+    deleted = delete_in_batches(SyncOperation.objects.filter(created_at__lt=cutoff), settings.PURGE_BATCH_SIZE)
+    logger.info(f"Expired {deleted} sync operation keys")
+    return deleted
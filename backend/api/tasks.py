@@ -0,0 +1,82 @@
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from .jobs import JobQueue
+from .llm import budgeted_client, get_openai_client, CHAT_MODEL
+from .llm_cache import get_completion_cache
+from .llm_guard import get_llm_guard
+
+logger = logging.getLogger('api')
+
+EXPENSE_NOTE_PROMPT = """
+                    You are an expert financial note taker.
+                    Generate a concise, professional expense note based on the user's input.
+                    Include specific details like the merchant/vendor name, purpose, location, and payment method if available.
+                    Use precise and descriptive language.
+                    Keep it brief but detailed, suitable for financial records.
+                    Format: [Current Date] - [Detailed Description with merchant/vendor] - [Category]
+                    Example: "2023-03-30 - Lunch at Chipotle with colleagues - Food"
+                    """
+
+note_queue = JobQueue(
+    'expense-note',
+    max_workers=settings.EXPENSE_NOTE_WORKERS,
+    max_retries=settings.EXPENSE_NOTE_MAX_RETRIES,
+    retry_delay=settings.EXPENSE_NOTE_RETRY_DELAY
+)
+
+
+def provisional_expense_note(category_name, user_message):
+    """Note stored with a chat-recorded expense until the AI-written one is ready"""
+    return f"Expense for {category_name}: {user_message[:50]}"
+
+
+def improve_expense_note(expense_id, user_message, provisional_note):
+    """
+    Replace an expense's provisional note with one written by the model.
+
+    The note is only replaced while it still equals the provisional text, so
+    an edit the user made in the meantime is never overwritten. Raises on API
+    errors so the queue retries.
+    """
+    from .models import Expense
+
+    # The note starts with the current date, so the date is part of the key
+    completion_cache = get_completion_cache()
+    cache_key = completion_cache.make_key('note', CHAT_MODEL, user_message, EXPENSE_NOTE_PROMPT, timezone.localdate())
+    expense_note = completion_cache.get(cache_key)
+
+    if expense_note is None:
+        client = get_openai_client()
+        if client is None:
+            logger.warning(f"Skipping note for expense {expense_id}: OpenAI API key is not configured")
+            return
+
+        # Shares the chat's concurrency caps and circuit breaker; a refusal raises
+        # LLMUnavailable, so the queue retries later
+        with get_llm_guard().slot() as timeout:
+            note_response = budgeted_client(client, timeout).chat.completions.create(
+                model=CHAT_MODEL, # Better model for structured data
+                messages=[
+                    {"role": "system", "content": EXPENSE_NOTE_PROMPT},
+                    {"role": "user", "content": user_message}
+                ],
+                max_tokens=100,
+                temperature=0.3, # Lower temperature for more accurate, factual responses
+            )
+        expense_note = note_response.choices[0].message.content.strip()
+        if not expense_note:
+            raise ValueError("Empty note returned")
+        completion_cache.set(cache_key, expense_note)
+
+    updated = Expense.objects.filter(pk=expense_id, expense_note=provisional_note).update(
+        expense_note=expense_note
+    )
+    logger.info(f"AI note for expense {expense_id} {'saved' if updated else 'discarded (note was edited)'}")
+
+
+def schedule_expense_note(expense, user_message):
+    """Queue improve_expense_note() for a just-created expense"""
+    note_queue.submit(improve_expense_note, expense.id, user_message, expense.expense_note)
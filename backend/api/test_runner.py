@@ -0,0 +1,31 @@
+import copy
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Django's runner, with the 'file' data cache in a temporary directory.
+
+    Test users get ids (1, 2, ...) that real users have too, so writing their
+    data versions and payloads to DATA_CACHE_DIR would let the development
+    server serve test payloads, and the other way round.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.data_cache_dir = tempfile.mkdtemp(prefix='spendora-test-cache-')
+        caches = copy.deepcopy(settings.CACHES)
+        if settings.DATA_CACHE_BACKEND == 'file':
+            caches[settings.DATA_CACHE_ALIAS]['LOCATION'] = self.data_cache_dir
+        self.data_cache_settings = override_settings(DATA_CACHE_DIR=self.data_cache_dir, CACHES=caches)
+        self.data_cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.data_cache_settings.disable()
+        shutil.rmtree(self.data_cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -1,10 +1,53 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.conf import settings
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.mail.backends import locmem
+from django.test.utils import CaptureQueriesContext
+from django.db import IntegrityError, connection, transaction
+from django.core.management import call_command
+from django.core.cache import CacheHandler, cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template.loader import render_to_string
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from .models import Expense, Category
-from .utils import generate_expense_report_data
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from .models import (
+    Expense, ExpenseDailyRollup, Category, SubCategory, Income, ChatMessage,
+    WeeklyReportSubscription, WeeklyReportDelivery, PurgeJob, ExpenseImport, ChangeLogEntry,
+    SyncOperation
+)
+from .rollups import find_rollup_mismatches, rebuild_user_rollups
+from .utils import generate_expense_report_data, send_weekly_expense_reports, parse_shard
+from .llm import get_openai_client, reset_openai_clients
+from .jobs import JobQueue
+from .intents import parse_chat_intent
+from .llm_cache import get_completion_cache, LocalLRUBackend, CompletionCache
+from .llm_guard import get_llm_guard, reset_llm_guard
+from .purge import run_purge
+from .data_cache import UserDataCache, get_data_cache
+from .importers import ExpenseCSVImporter, parse_amount
+from .sync import compact_change_log
+from .chat_context import (
+    build_chat_context, count_tokens, message_tokens, truncate_to_tokens,
+    REPLY_PRIMING_TOKENS, TRUNCATION_MARKER
+)
 from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+import base64
+import csv
 import datetime
+import gzip
+import json
+import os
+import re
+import smtplib
+import tempfile
+import threading
+import time
 
 User = get_user_model()
 
@@ -62,3 +105,2310 @@ class ExpenseReportTestCase(TestCase):
         # Verify top category
         self.assertEqual(report_data['top_category'], 'Test Category')
         self.assertEqual(report_data['top_category_percentage'], "100.0")
+    
+    def test_report_aggregates_in_one_query_and_streams_rows(self):
+        """Summary data costs one query; rows are only fetched while rendering"""
+        start_date = (timezone.now() - datetime.timedelta(days=10)).date()
+        end_date = timezone.now().date()
+        
+        with self.assertNumQueries(1):
+            report_data = generate_expense_report_data(self.user, start_date, end_date)
+        
+        with self.assertNumQueries(1):
+            html = render_to_string('email/expense_report.html', report_data)
+        self.assertIn('Test Expense 1', html)
+        self.assertIn('Test Expense 2', html)
+    
+    def test_report_caps_rendered_rows(self):
+        start_date = (timezone.now() - datetime.timedelta(days=10)).date()
+        end_date = timezone.now().date()
+        
+        report_data = generate_expense_report_data(self.user, start_date, end_date, max_rows=1)
+        self.assertEqual(report_data['transaction_count'], 2)
+        self.assertEqual(report_data['expenses_shown'], 1)
+        self.assertTrue(report_data['expenses_truncated'])
+        
+        html = render_to_string('email/expense_report.html', report_data)
+        # Newest first, so only the expense from 3 days ago is rendered
+        self.assertIn('Test Expense 2', html)
+        self.assertNotIn('Test Expense 1', html)
+        self.assertIn('Showing the 1 most recent of 2 transactions', html)
+
+class ExpenseDailyRollupTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='rollup@example.com',
+            password='testpassword',
+            first_name='Rollup',
+            last_name='User'
+        )
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.travel = Category.objects.create(user=self.user, name='Travel')
+        self.now = timezone.now()
+    
+    def assertRollupsConsistent(self):
+        self.assertEqual(find_rollup_mismatches(self.user.id), [])
+    
+    def test_single_expense_writes_keep_rollup_in_sync(self):
+        expense = Expense.objects.create(
+            user=self.user,
+            expense_note='Lunch',
+            expense_amount=Decimal('12.00'),
+            transaction_datetime=self.now,
+            category=self.food
+        )
+        self.assertRollupsConsistent()
+        
+        # Move the expense to another day and category
+        expense = Expense.objects.get(pk=expense.pk)
+        expense.transaction_datetime = self.now - datetime.timedelta(days=3)
+        expense.category = self.travel
+        expense.save()
+        self.assertRollupsConsistent()
+        self.assertFalse(
+            ExpenseDailyRollup.objects.filter(user=self.user, date=timezone.localdate(self.now)).exists()
+        )
+        
+        expense.delete()
+        self.assertRollupsConsistent()
+        self.assertFalse(ExpenseDailyRollup.objects.filter(user=self.user).exists())
+    
+    def test_bulk_paths_keep_rollup_in_sync(self):
+        Expense.objects.bulk_create([
+            Expense(
+                user=self.user,
+                expense_note=f'Expense {i}',
+                expense_amount=Decimal('5.00'),
+                transaction_datetime=self.now - datetime.timedelta(days=i % 4),
+                category=self.food
+            )
+            for i in range(20)
+        ])
+        self.assertRollupsConsistent()
+        
+        Expense.objects.filter(user=self.user, expense_note__endswith='1').update(category=self.travel)
+        self.assertRollupsConsistent()
+        
+        expenses = list(Expense.objects.filter(user=self.user)[:5])
+        for expense in expenses:
+            expense.expense_amount = Decimal('7.50')
+        Expense.objects.bulk_update(expenses, ['expense_amount'])
+        self.assertRollupsConsistent()
+        
+        Expense.objects.filter(user=self.user, category=self.travel).delete()
+        self.assertRollupsConsistent()
+        
+        # Deleting a category uncategorizes its expenses and their rollups alike
+        self.food.delete()
+        self.assertRollupsConsistent()
+    
+    def test_summary_reads_from_rollup(self):
+        Expense.objects.create(
+            user=self.user,
+            expense_note='Lunch',
+            expense_amount=Decimal('12.00'),
+            transaction_datetime=self.now,
+            category=self.food
+        )
+        client = APIClient()
+        client.force_authenticate(self.user)
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/expenses/summary/')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_amount'], Decimal('12.00'))
+        self.assertEqual(response.data['category_expenses'][0]['count'], 1)
+        self.assertFalse(any('"api_expense"' in query['sql'] for query in queries.captured_queries))
+    
+    def test_rebuild_command_restores_rollups(self):
+        Expense.objects.create(
+            user=self.user,
+            expense_note='Lunch',
+            expense_amount=Decimal('12.00'),
+            transaction_datetime=self.now,
+            category=self.food
+        )
+        ExpenseDailyRollup.objects.filter(user=self.user).delete()
+        self.assertNotEqual(find_rollup_mismatches(self.user.id), [])
+        
+        call_command('rebuild_expense_rollups', stdout=StringIO())
+        call_command('rebuild_expense_rollups', '--verify', stdout=StringIO())
+        self.assertRollupsConsistent()
+
+class QueryPlanRegressionTestCase(TestCase):
+    """
+    Captures EXPLAIN QUERY PLAN output for the Expense hot paths and fails if
+    any of them reads the expense tables with a full scan, or filters a date
+    range without an index that covers the range column.
+    """
+    HOT_TABLES = ('api_expense', 'api_expensedailyrollup')
+    RANGE_COLUMNS = ('transaction_datetime', 'date')
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='plans@example.com',
+            password='testpassword',
+            first_name='Plan',
+            last_name='User'
+        )
+        self.category = Category.objects.create(user=self.user, name='Food')
+        now = timezone.now()
+        Expense.objects.bulk_create([
+            Expense(
+                user=self.user,
+                expense_note=f'Expense {i}',
+                expense_amount=Decimal('3.00'),
+                transaction_datetime=now - datetime.timedelta(days=i),
+                category=self.category if i % 2 else None
+            )
+            for i in range(30)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[-1] for row in cursor.fetchall()]
+    
+    def assertNoFullTableScans(self, queries):
+        selects = [query['sql'] for query in queries if query['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects, "No SELECT queries were captured")
+        for sql in selects:
+            ranged = set(re.findall(r'"(\w+)"\."(\w+)" [<>]', sql))
+            for detail in self.explain(sql):
+                match = re.match(r'(SCAN|SEARCH) (?:TABLE )?(\w+)', detail)
+                if not match or match.group(2) not in self.HOT_TABLES:
+                    continue
+                table = match.group(2)
+                if match.group(1) == 'SCAN':
+                    self.fail(f"Full scan of {table} ({detail}) in query:\n{sql}")
+                for ranged_table, column in ranged:
+                    if ranged_table == table and column in self.RANGE_COLUMNS:
+                        self.assertRegex(
+                            detail, rf'\b{column}[<>]',
+                            f"Range on {table}.{column} is not served by an index in query:\n{sql}"
+                        )
+    
+    def test_summary_uses_indexes(self):
+        for period in ('week', 'month', 'year'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/expenses/summary/', {'period': period})
+            self.assertEqual(response.status_code, 200)
+            self.assertNoFullTableScans(queries.captured_queries)
+    
+    def test_report_data_uses_indexes(self):
+        end_date = timezone.now().date()
+        start_date = end_date - datetime.timedelta(days=7)
+        with CaptureQueriesContext(connection) as queries:
+            report_data = generate_expense_report_data(self.user, start_date, end_date)
+            list(report_data['expenses'])
+        self.assertNoFullTableScans(queries.captured_queries)
+    
+    def test_expense_list_uses_indexes(self):
+        for params in ({}, {'category': self.category.id}, {'ordering': '-transaction_datetime'}):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/expenses/', params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNoFullTableScans(queries.captured_queries)
+    
+    @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'})
+    @mock.patch('api.views.get_openai_client')
+    def test_chat_query_branch_uses_indexes(self, openai_client):
+        completion = mock.MagicMock()
+        completion.choices[0].message.content = "Based on your records, you spent $[amount] on Food last week."
+        openai_client.return_value.with_options.return_value = openai_client.return_value
+        openai_client.return_value.chat.completions.create.return_value = completion
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/chat/simple/', {'message': 'How much on food last week?'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('$12.00', response.data['message'])
+        self.assertNoFullTableScans(queries.captured_queries)
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Enforces a maximum query count for every viewset action routed in api/urls.py.
+    
+    Each action is exercised against a user with ROWS objects of every kind, so
+    a per-row query (N+1) blows the budget. New routed actions must be given a
+    budget in ACTION_REQUESTS, otherwise test_every_action_has_a_budget fails.
+    """
+    ROWS = 25
+    
+    # (basename, action): (method, url, data, max queries)
+    ACTION_REQUESTS = {
+        ('user', 'list'): ('get', '/api/users/', None, 2),
+        ('user', 'create'): ('post', '/api/users/', {
+            'email': 'new@example.com', 'first_name': 'New', 'last_name': 'User',
+            'password': 'Sp3ndora!pass', 'password_confirm': 'Sp3ndora!pass'
+        }, 2),
+        ('user', 'retrieve'): ('get', '/api/users/{user}/', None, 1),
+        ('user', 'update'): ('put', '/api/users/{user}/', {'first_name': 'Budget', 'last_name': 'User', 'is_active': True}, 2),
+        ('user', 'partial_update'): ('patch', '/api/users/{user}/', {'first_name': 'Budget'}, 2),
+        ('user', 'destroy'): ('delete', '/api/users/{user}/', None, 5),
+        ('user', 'me'): ('get', '/api/users/me/', None, 0),
+        ('user', 'cache_status'): ('get', '/api/users/cache_status/', None, 0),
+        ('user', 'profile'): ('patch', '/api/users/profile/', {'first_name': 'Budget'}, 1),
+        ('user', 'change_password'): ('post', '/api/users/change_password/', {
+            'current_password': 'testpassword', 'new_password': 'Sp3ndora!pass', 'confirm_password': 'Sp3ndora!pass'
+        }, 1),
+        ('user', 'upload_profile_image'): ('post', '/api/users/upload_profile_image/', {}, 0),
+        ('category', 'list'): ('get', '/api/categories/', None, 2),
+        ('category', 'create'): ('post', '/api/categories/', {'name': 'Budgeted'}, 2),
+        ('category', 'retrieve'): ('get', '/api/categories/{category}/', None, 1),
+        ('category', 'update'): ('put', '/api/categories/{category}/', {'name': 'Renamed'}, 3),
+        ('category', 'partial_update'): ('patch', '/api/categories/{category}/', {'name': 'Renamed'}, 3),
+        ('category', 'destroy'): ('delete', '/api/categories/{category}/', None, 11),
+        ('subcategory', 'list'): ('get', '/api/subcategories/', None, 2),
+        ('subcategory', 'create'): ('post', '/api/subcategories/', {'category': '{category}', 'name': 'Budgeted'}, 3),
+        ('subcategory', 'retrieve'): ('get', '/api/subcategories/{subcategory}/', None, 1),
+        ('subcategory', 'update'): ('put', '/api/subcategories/{subcategory}/', {'category': '{category}', 'name': 'Renamed'}, 4),
+        ('subcategory', 'partial_update'): ('patch', '/api/subcategories/{subcategory}/', {'name': 'Renamed'}, 3),
+        ('subcategory', 'destroy'): ('delete', '/api/subcategories/{subcategory}/', None, 6),
+        ('subcategory', 'by_category'): ('get', '/api/subcategories/by_category/?category_id={category}', None, 1),
+        ('expense', 'list'): ('get', '/api/expenses/', None, 2),
+        ('expense', 'create'): ('post', '/api/expenses/', {
+            'expense_note': 'Budgeted', 'expense_amount': '4.00',
+            'transaction_datetime': '2025-01-01T12:00:00Z', 'category': '{category}'
+        }, 8),
+        ('expense', 'retrieve'): ('get', '/api/expenses/{expense}/', None, 1),
+        ('expense', 'update'): ('put', '/api/expenses/{expense}/', {
+            'expense_note': 'Renamed', 'expense_amount': '4.00',
+            'transaction_datetime': '2025-01-01T12:00:00Z', 'category': '{category}'
+        }, 11),
+        ('expense', 'partial_update'): ('patch', '/api/expenses/{expense}/', {'expense_note': 'Renamed'}, 8),
+        ('expense', 'destroy'): ('delete', '/api/expenses/{expense}/', None, 7),
+        ('expense', 'bulk_create'): ('post', '/api/expenses/bulk_create/', [
+            {'expense_note': 'Bulk', 'expense_amount': '4.00', 'transaction_datetime': '2024-05-01T12:00:00Z',
+             'category': '{category}', 'subcategory': '{subcategory}'},
+        ], 13),
+        ('expense', 'bulk_update'): ('patch', '/api/expenses/bulk_update/', [
+            {'id': '{expense}', 'expense_amount': '6.00'},
+        ], 13),
+        ('expense', 'bulk_delete'): ('post', '/api/expenses/bulk_delete/', {'ids': ['{expense}']}, 12),
+        ('expense', 'import_csv'): ('post', '/api/expenses/import_csv/', {}, 0),
+        ('expense', 'export'): ('get', '/api/expenses/export/', None, 1),
+        ('expense', 'summary'): ('get', '/api/expenses/summary/', None, 2),
+        ('expense', 'timeseries'): (
+            'get', '/api/expenses/timeseries/?start=2025-01-01&granularity=week&by_category=true', None, 1
+        ),
+        ('expense', 'email_report'): ('post', '/api/expenses/email_report/', {
+            'start_date': '2025-01-01', 'end_date': '2025-01-31'
+        }, 3),
+        ('income', 'list'): ('get', '/api/incomes/', None, 2),
+        ('income', 'create'): ('post', '/api/incomes/', {
+            'everymonth_payment_date': 1, 'amount': '100.00', 'description': 'Budgeted'
+        }, 2),
+        ('income', 'retrieve'): ('get', '/api/incomes/{income}/', None, 1),
+        ('income', 'update'): ('put', '/api/incomes/{income}/', {
+            'everymonth_payment_date': 2, 'amount': '100.00', 'description': 'Renamed'
+        }, 3),
+        ('income', 'partial_update'): ('patch', '/api/incomes/{income}/', {'description': 'Renamed'}, 3),
+        ('income', 'destroy'): ('delete', '/api/incomes/{income}/', None, 3),
+        ('income', 'export'): ('get', '/api/incomes/export/?export_format=ndjson', None, 1),
+        ('income', 'total'): ('get', '/api/incomes/total/', None, 2),
+        ('chat', 'debug'): ('get', '/api/chat/debug/', None, 0),
+        ('chat', 'llm_status'): ('get', '/api/chat/llm_status/', None, 0),
+        ('chat', 'test'): ('post', '/api/chat/test/', {'message': 'hello'}, 2),
+        ('chat', 'simple'): ('post', '/api/chat/simple/', {'message': 'hello'}, 4),
+        ('chat', 'message'): ('post', '/api/chat/message/', {'message': 'hello'}, 4),
+        ('chat', 'history'): ('get', '/api/chat/history/', None, 1),
+        ('chat', 'clear_history'): ('post', '/api/chat/clear_history/', None, 2),
+        ('chat', 'init_message'): ('post', '/api/chat/init_message/', None, 2),
+        ('weekly-report', 'list'): ('get', '/api/weekly-reports/', None, 2),
+        ('weekly-report', 'create'): ('post', '/api/weekly-reports/', {'day_of_week': 2}, 1),
+        ('weekly-report', 'retrieve'): ('get', '/api/weekly-reports/{subscription}/', None, 1),
+        ('weekly-report', 'update'): ('put', '/api/weekly-reports/{subscription}/', {'day_of_week': 3, 'is_active': True}, 2),
+        ('weekly-report', 'partial_update'): ('patch', '/api/weekly-reports/{subscription}/', {'day_of_week': 3}, 2),
+        ('weekly-report', 'destroy'): ('delete', '/api/weekly-reports/{subscription}/', None, 3),
+        ('weekly-report', 'toggle'): ('post', '/api/weekly-reports/toggle/', None, 2),
+        ('sync', 'changes'): ('get', '/api/sync/changes/?since=0', None, 5),
+        ('sync', 'batch'): ('post', '/api/sync/batch/', {'client': 'budget', 'since': 0, 'operations': [
+            {'key': 'budget-create', 'op': 'create', 'data': {
+                'expense_note': 'Offline', 'expense_amount': '4.00',
+                'transaction_datetime': '2025-01-01T12:00:00Z', 'category': '{category}'
+            }},
+            {'key': 'budget-update', 'op': 'update', 'id': '{expense}', 'force': True, 'data': {'expense_amount': '6.00'}},
+            {'key': 'budget-delete', 'op': 'delete', 'ref': 'budget-create'},
+        ]}, 21),
+        ('dashboard', 'list'): ('get', '/api/dashboard/', None, 6),
+        ('purge', 'list'): ('get', '/api/purges/', None, 2),
+        ('purge', 'retrieve'): ('get', '/api/purges/{purge}/', None, 1),
+        ('expense-import', 'list'): ('get', '/api/expense-imports/', None, 2),
+        ('expense-import', 'retrieve'): ('get', '/api/expense-imports/{expense_import}/', None, 1),
+    }
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='budget@example.com',
+            password='testpassword',
+            first_name='Budget',
+            last_name='User'
+        )
+        categories = Category.objects.bulk_create([
+            Category(user=self.user, name=f'Category {i}') for i in range(self.ROWS)
+        ])
+        subcategories = SubCategory.objects.bulk_create([
+            SubCategory(user=self.user, category=category, name=f'Sub {i}')
+            for i, category in enumerate(categories)
+        ])
+        Expense.objects.bulk_create([
+            Expense(
+                user=self.user,
+                expense_note=f'Expense {i}',
+                expense_amount=Decimal('2.50'),
+                transaction_datetime=timezone.now() - datetime.timedelta(days=i),
+                category=categories[i],
+                subcategory=subcategories[i]
+            )
+            for i in range(self.ROWS)
+        ])
+        Income.objects.bulk_create([
+            Income(user=self.user, everymonth_payment_date=1, amount=Decimal('10.00'), description=f'Income {i}')
+            for i in range(self.ROWS)
+        ])
+        ChatMessage.objects.bulk_create([
+            ChatMessage(user=self.user, role='user', content=f'Message {i}') for i in range(self.ROWS)
+        ])
+        self.ids = {
+            'user': self.user.id,
+            'category': categories[0].id,
+            'subcategory': subcategories[0].id,
+            'expense': Expense.objects.filter(user=self.user).first().id,
+            'income': Income.objects.filter(user=self.user).first().id,
+            'subscription': WeeklyReportSubscription.objects.create(user=self.user).id,
+            'purge': PurgeJob.objects.create(user=self.user, kind=PurgeJob.KIND_CHAT_HISTORY, cutoff_id=0).id,
+            'expense_import': ExpenseImport.objects.create(user=self.user, file_name='statement.csv').id,
+        }
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def routed_actions(self):
+        from .urls import router
+        actions = set()
+        for prefix, viewset, basename in router.registry:
+            for route in router.get_routes(viewset):
+                for action in router.get_method_map(viewset, route.mapping).values():
+                    actions.add((basename, action))
+        return actions
+    
+    def fill(self, value):
+        if isinstance(value, str):
+            placeholder = re.fullmatch(r'\{(\w+)\}', value)
+            # A bare placeholder stands for the id itself, as JSON clients send it
+            return self.ids[placeholder.group(1)] if placeholder else value.format(**self.ids)
+        if isinstance(value, dict):
+            return {key: self.fill(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.fill(item) for item in value]
+        return value
+    
+    def test_every_action_has_a_budget(self):
+        missing = self.routed_actions() - set(self.ACTION_REQUESTS)
+        self.assertFalse(missing, f"Routed actions without a query budget: {sorted(missing)}")
+    
+    @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'})
+    @mock.patch('api.views.get_openai_client')
+    def test_actions_stay_within_query_budget(self, openai_client):
+        completion = mock.MagicMock()
+        completion.choices[0].message.content = "Hello! How can I help with your expenses?"
+        openai_client.return_value.with_options.return_value = openai_client.return_value
+        openai_client.return_value.chat.completions.create.return_value = completion
+        
+        for (basename, action), (method, url, data, budget) in sorted(self.ACTION_REQUESTS.items()):
+            with self.subTest(basename=basename, action=action):
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as queries:
+                        response = getattr(self.client, method)(self.fill(url), self.fill(data), format='json')
+                        if response.streaming:
+                            # Streamed bodies query while they are consumed
+                            b''.join(response.streaming_content)
+                    self.assertLess(response.status_code, 500, getattr(response, 'data', None))
+                    self.assertLessEqual(
+                        len(queries.captured_queries), budget,
+                        f"{basename}.{action} ran {len(queries.captured_queries)} queries (budget {budget}):\n"
+                        + "\n".join(query['sql'] for query in queries.captured_queries)
+                    )
+                    transaction.set_rollback(True)
+
+class PaginationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='pages@example.com',
+            password='testpassword',
+            first_name='Page',
+            last_name='User'
+        )
+        now = timezone.now()
+        # Pairs of expenses share a timestamp so ordering has to fall back to id
+        Expense.objects.bulk_create([
+            Expense(
+                user=self.user,
+                expense_note=f'Expense {i}',
+                expense_amount=Decimal('1.00'),
+                transaction_datetime=now - datetime.timedelta(hours=i // 2)
+            )
+            for i in range(25)
+        ])
+        ChatMessage.objects.bulk_create([
+            ChatMessage(user=self.user, role='user', content=f'Message {i}') for i in range(15)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def walk(self, url, params):
+        """Follow `next` links until exhausted, returning every row and each page's query log"""
+        rows, query_logs = [], []
+        response = None
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params) if response is None else self.client.get(response.data['next'])
+            self.assertEqual(response.status_code, 200)
+            rows.extend(response.data['results'])
+            query_logs.append(queries.captured_queries)
+            if not response.data['next']:
+                return rows, query_logs
+    
+    def test_page_number_mode_honours_bounded_page_size(self):
+        response = self.client.get('/api/expenses/', {'page_size': 5})
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(response.data['count'], 25)
+        
+        response = self.client.get('/api/expenses/', {'page_size': 10_000})
+        self.assertEqual(len(response.data['results']), 25)
+    
+    def test_expense_cursor_mode_walks_every_row_in_keyset_order(self):
+        # Odd page size so page boundaries split rows that share a timestamp
+        rows, query_logs = self.walk('/api/expenses/', {'pagination': 'cursor', 'page_size': 3})
+        
+        expected = list(
+            Expense.objects.filter(user=self.user).order_by('-transaction_datetime', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual([row['id'] for row in rows], expected)
+        self.assertNotIn('count', self.client.get('/api/expenses/', {'pagination': 'cursor'}).data)
+        for queries in query_logs:
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+            self.assertFalse(any('OFFSET' in query['sql'] for query in queries))
+    
+    def test_expense_cursor_mode_honours_ordering_param(self):
+        rows, _ = self.walk('/api/expenses/', {'pagination': 'cursor', 'page_size': 7, 'ordering': 'created_at'})
+        expected = list(
+            Expense.objects.filter(user=self.user).order_by('created_at', 'id').values_list('id', flat=True)
+        )
+        self.assertEqual([row['id'] for row in rows], expected)
+    
+    def test_malformed_cursors_are_not_found(self):
+        for key in (['notadate', 1], ['2025-01-01T00:00:00Z'], ['2025-01-01T00:00:00Z', 'x'], [None, 1],
+                    {'value': 1, 'pk': 2}, 'ab'):
+            cursor = base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+            response = self.client.get('/api/expenses/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, key)
+        self.assertEqual(self.client.get('/api/expenses/', {'cursor': 'not base64!'}).status_code, 404)
+    
+    def test_chat_history_cursor_mode(self):
+        rows, query_logs = self.walk('/api/chat/history/', {'pagination': 'cursor', 'page_size': 6})
+        self.assertEqual(len(rows), 15)
+        self.assertEqual(rows[0]['content'], 'Message 14')
+        self.assertEqual(len(query_logs), 3)
+
+    @override_settings(CHAT_HISTORY_PAGE_SIZE=10)
+    def test_chat_history_default_returns_newest_window(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/chat/history/')
+        self.assertEqual([row['content'] for row in response.data], [f'Message {i}' for i in range(5, 15)])
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+    def test_chat_history_loads_older_messages_before_id(self):
+        newest = self.client.get('/api/chat/history/', {'limit': 6}).data
+        response = self.client.get('/api/chat/history/', {'before_id': newest[0]['id'], 'limit': 6})
+        self.assertEqual([row['content'] for row in response.data['results']], [f'Message {i}' for i in range(3, 9)])
+        self.assertTrue(response.data['has_more'])
+
+        response = self.client.get('/api/chat/history/', {'before_id': response.data['oldest_id'], 'limit': 6})
+        self.assertEqual([row['content'] for row in response.data['results']], [f'Message {i}' for i in range(3)])
+        self.assertFalse(response.data['has_more'])
+
+    def test_chat_history_since_id_returns_only_new_messages(self):
+        latest_id = self.client.get('/api/chat/history/').data[-1]['id']
+        response = self.client.get('/api/chat/history/', {'since_id': latest_id})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['newest_id'], latest_id)
+
+        ChatMessage.objects.bulk_create([
+            ChatMessage(user=self.user, role='assistant', content=f'Reply {i}') for i in range(3)
+        ])
+        response = self.client.get('/api/chat/history/', {'since_id': latest_id, 'limit': 2})
+        self.assertEqual([row['content'] for row in response.data['results']], ['Reply 0', 'Reply 1'])
+        self.assertTrue(response.data['has_more'])
+        response = self.client.get('/api/chat/history/', {'since_id': response.data['newest_id']})
+        self.assertEqual([row['content'] for row in response.data['results']], ['Reply 2'])
+        self.assertFalse(response.data['has_more'])
+
+    def test_chat_history_rejects_non_integer_cursor(self):
+        response = self.client.get('/api/chat/history/', {'since_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+def create_weekly_subscribers(count, verified=True):
+    """Create `count` users subscribed to today's weekly report, each with one expense last week"""
+    day_of_week = timezone.now().date().weekday()
+    users = []
+    for i in range(count):
+        user = User.objects.create_user(
+            email=f'subscriber{i}@example.com',
+            password='testpassword',
+            first_name='Weekly',
+            last_name=f'Subscriber{i}',
+            is_email_verified=verified
+        )
+        Expense.objects.create(
+            user=user,
+            expense_note=f'Groceries {i}',
+            expense_amount=Decimal('20.00'),
+            transaction_datetime=timezone.now() - datetime.timedelta(days=2)
+        )
+        WeeklyReportSubscription.objects.create(user=user, day_of_week=day_of_week)
+        users.append(user)
+    return users
+
+class DroppingEmailBackend(locmem.EmailBackend):
+    """Drops the connection after `limit` messages, like an SMTP server's per-connection limit"""
+    def __init__(self, limit, **kwargs):
+        super().__init__(**kwargs)
+        self.limit = limit
+        self.opened = 0
+        self.connected = False
+        self.sent_on_connection = 0
+    
+    def open(self):
+        if self.connected:
+            return False
+        self.connected = True
+        self.opened += 1
+        self.sent_on_connection = 0
+        return True
+    
+    def close(self):
+        self.connected = False
+    
+    def send_messages(self, messages):
+        if not self.connected or self.sent_on_connection >= self.limit:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        self.sent_on_connection += len(messages)
+        return super().send_messages(messages)
+
+class WeeklyReportDeliveryTestCase(TestCase):
+    def test_reports_are_batched_over_one_connection(self):
+        create_weekly_subscribers(5)
+        unverified = User.objects.create_user(
+            email='unverified@example.com', password='testpassword', first_name='No', last_name='Verify'
+        )
+        WeeklyReportSubscription.objects.create(user=unverified, day_of_week=timezone.now().date().weekday())
+        
+        mail_connection = get_connection()
+        with mock.patch.object(mail_connection, 'open', wraps=mail_connection.open) as opened:
+            stats = send_weekly_expense_reports(workers=1, batch_size=2, mail_connection=mail_connection)
+        
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(stats['sent'], 5)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertIn('Groceries 0', mail.outbox[0].alternatives[0][0])
+        self.assertEqual(
+            WeeklyReportSubscription.objects.filter(last_sent_at__isnull=False).count(), 5
+        )
+    
+    def test_dropped_connections_are_reopened(self):
+        create_weekly_subscribers(5)
+        mail_connection = DroppingEmailBackend(limit=2)
+        stats = send_weekly_expense_reports(workers=1, batch_size=2, mail_connection=mail_connection)
+        
+        self.assertEqual((stats['sent'], stats['failed']), (5, 0))
+        self.assertEqual(mail_connection.opened, 3)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(WeeklyReportDelivery.objects.count(), 5)
+    
+    def test_command_reports_throughput(self):
+        create_weekly_subscribers(2)
+        out = StringIO()
+        call_command('send_weekly_reports', '--workers', '1', stdout=out)
+        self.assertIn('Successfully sent 2 weekly reports', out.getvalue())
+        self.assertIn('reports/s', out.getvalue())
+
+class ConcurrentWeeklyReportDeliveryTestCase(TransactionTestCase):
+    """Worker threads use their own database connections, so the data must be committed"""
+    def test_worker_pool_builds_reports_in_parallel(self):
+        create_weekly_subscribers(6)
+        stats = send_weekly_expense_reports(workers=3, batch_size=2)
+        
+        self.assertEqual(stats['sent'], 6)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(len(mail.outbox), 6)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            sorted(f'subscriber{i}@example.com' for i in range(6))
+        )
+
+class WeeklyReportRunLedgerTestCase(TestCase):
+    def test_rerun_skips_users_already_served_this_week(self):
+        create_weekly_subscribers(3)
+        first = send_weekly_expense_reports(workers=1)
+        second = send_weekly_expense_reports(workers=1)
+        
+        self.assertEqual(first['sent'], 3)
+        self.assertEqual(second['sent'], 0)
+        self.assertEqual(second['already_sent'], 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(WeeklyReportDelivery.objects.count(), 3)
+    
+    def test_interrupted_run_resumes_where_it_stopped(self):
+        create_weekly_subscribers(4)
+        mail_connection = get_connection()
+        real_send = mail_connection.send_messages
+        calls = []
+        
+        def crash_after_first_batch(messages):
+            calls.append(messages)
+            if len(calls) > 2:
+                raise KeyboardInterrupt("host went away")
+            return real_send(messages)
+        
+        with mock.patch.object(mail_connection, 'send_messages', side_effect=crash_after_first_batch):
+            with self.assertRaises(KeyboardInterrupt):
+                send_weekly_expense_reports(workers=1, batch_size=2, mail_connection=mail_connection)
+        self.assertEqual(WeeklyReportDelivery.objects.count(), 2)
+        
+        stats = send_weekly_expense_reports(workers=1, batch_size=2)
+        self.assertEqual(stats['sent'], 2)
+        self.assertEqual(stats['already_sent'], 2)
+        self.assertEqual(len({message.to[0] for message in mail.outbox}), 4)
+    
+    def test_shards_partition_subscribers(self):
+        users = create_weekly_subscribers(7)
+        sent = [send_weekly_expense_reports(workers=1, shard=(index, 3))['sent'] for index in range(3)]
+        
+        self.assertEqual(sum(sent), 7)
+        self.assertEqual(sent, [len([u for u in users if u.id % 3 == index]) for index in range(3)])
+        self.assertEqual(len(mail.outbox), 7)
+    
+    def test_dry_run_estimates_without_sending(self):
+        create_weekly_subscribers(3)
+        out = StringIO()
+        call_command('send_weekly_reports', '--dry-run', '--sample-size', '2', stdout=out)
+        
+        self.assertIn('Dry run: 3 reports would be sent', out.getvalue())
+        self.assertIn('sampled=2', out.getvalue())
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertFalse(WeeklyReportDelivery.objects.exists())
+    
+    def test_parse_shard_rejects_bad_specs(self):
+        self.assertEqual(parse_shard('1/4'), (1, 4))
+        for spec in ('4/4', '-1/2', 'a/b', '3', '0/0'):
+            with self.assertRaises(ValueError):
+                parse_shard(spec)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible /chat/completions endpoint"""
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append((self.client_address, body))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        reply = self.server.replies.pop(0) if self.server.replies else self.server.reply
+        if reply is None:
+            self.send_error(500)
+            return
+        
+        if not body.get('stream'):
+            payload = json.dumps({
+                'id': 'chatcmpl-test', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for token in re.findall(r'\S+\s*', reply):
+            chunk = {
+                'id': 'chatcmpl-test', 'object': 'chat.completion.chunk', 'created': 0, 'model': body['model'],
+                'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients that gave up on a delayed reply have closed their socket
+        pass
+
+
+class FakeOpenAITestMixin:
+    """Points the OpenAI clients at a local fake server for the duration of each test"""
+    reply = "Hello! How can I help with your expenses?"
+    
+    def setUp(self):
+        super().setUp()
+        self.openai_server = FakeOpenAIServer(('127.0.0.1', 0), FakeOpenAIHandler)
+        self.openai_server.requests = []
+        self.openai_server.reply = self.reply
+        self.openai_server.replies = []  # one-off replies served first; None answers with a 500
+        self.openai_server.delay = 0  # seconds to stall before answering
+        threading.Thread(target=self.openai_server.serve_forever, daemon=True).start()
+        
+        env = mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'})
+        env.start()
+        self.addCleanup(env.stop)
+        base_url = override_settings(
+            OPENAI_BASE_URL=f"http://127.0.0.1:{self.openai_server.server_port}/v1",
+            OPENAI_MAX_RETRIES=0
+        )
+        base_url.enable()
+        self.addCleanup(base_url.disable)
+        self.addCleanup(self.openai_server.server_close)
+        self.addCleanup(self.openai_server.shutdown)
+        self.addCleanup(reset_openai_clients)
+        get_completion_cache().clear()
+        reset_llm_guard()
+
+
+class ChatStreamingTestCase(FakeOpenAITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='chat@example.com', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.auth_header = f"Bearer {RefreshToken.for_user(self.user).access_token}"
+    
+    def parse_events(self, raw):
+        events = []
+        for block in raw.decode().strip().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in block.split('\n'))
+            events.append((fields.get('event', 'message'), json.loads(fields['data'])))
+        return events
+    
+    def test_simple_reuses_one_pooled_connection(self):
+        for _ in range(3):
+            response = self.client.post('/api/chat/simple/', {'message': 'hello'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['message'], self.reply)
+        
+        self.assertIs(get_openai_client(), get_openai_client())
+        self.assertEqual(len(self.openai_server.requests), 3)
+        self.assertEqual(len({address for address, _ in self.openai_server.requests}), 1)
+    
+    async def test_stream_sends_tokens_then_final_reply(self):
+        self.openai_server.reply = "I've recorded your food expense of $12.50."
+        response = await self.async_client.post(
+            '/api/chat/stream/', {'message': 'Grabbed lunch with Sam, it came to 12.50'},
+            content_type='application/json', headers={'Authorization': self.auth_header}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = self.parse_events(b''.join([chunk async for chunk in response.streaming_content]))
+        
+        deltas = [data['delta'] for event, data in events if event == 'message']
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual(''.join(deltas), self.openai_server.reply)
+        self.assertEqual(events[-1][0], 'done')
+        self.assertTrue(events[-1][1]['success'])
+        self.assertTrue(self.openai_server.requests[0][1]['stream'])
+        
+        expense = await Expense.objects.select_related('category').aget(user=self.user)
+        self.assertEqual(expense.expense_amount, Decimal('12.50'))
+        self.assertEqual(expense.category.name, 'food')
+    
+    async def test_stream_requires_a_valid_token(self):
+        for headers in ({}, {'Authorization': 'Bearer not-a-token'}):
+            response = await self.async_client.post(
+                '/api/chat/stream/', {'message': 'hi'}, content_type='application/json', headers=headers
+            )
+            self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.openai_server.requests, [])
+
+
+class BackgroundExpenseNoteTestCase(FakeOpenAITestMixin, TestCase):
+    reply = "I've recorded your food expense of $8.40."
+    
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='notes@example.com', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+    
+    def test_expense_is_saved_before_the_note_completion(self):
+        response = self.client.post('/api/chat/simple/', {'message': 'Burrito at Chipotle for 8.40'})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.openai_server.requests), 1)
+        expense = Expense.objects.get(user=self.user)
+        self.assertEqual(expense.expense_amount, Decimal('8.40'))
+        self.assertEqual(expense.expense_note, 'Expense for food: Burrito at Chipotle for 8.40')
+    
+    @override_settings(BACKGROUND_JOBS_EAGER=True)
+    def test_note_job_retries_then_replaces_provisional_note(self):
+        self.openai_server.replies = [self.reply, None, '2024-05-01 - Burrito at Chipotle - Food']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/chat/simple/', {'message': 'Burrito at Chipotle for 8.40'})
+        
+        self.assertEqual(len(self.openai_server.requests), 3)
+        self.assertEqual(Expense.objects.get(user=self.user).expense_note, '2024-05-01 - Burrito at Chipotle - Food')
+    
+    @override_settings(BACKGROUND_JOBS_EAGER=True)
+    def test_note_job_keeps_user_edits(self):
+        self.openai_server.replies = [self.reply]
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post('/api/chat/simple/', {'message': 'Burrito at Chipotle for 8.40'})
+        Expense.objects.filter(user=self.user).update(expense_note='Team lunch')
+        for callback in callbacks:
+            callback()
+        
+        self.assertEqual(Expense.objects.get(user=self.user).expense_note, 'Team lunch')
+
+
+class JobQueueTestCase(TestCase):
+    def test_retries_failed_jobs_with_backoff(self):
+        queue = JobQueue('test', max_workers=1, max_retries=2, retry_delay=0.01)
+        attempts = []
+        
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise RuntimeError("temporary failure")
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            queue.submit(flaky)
+        self.assertTrue(queue.wait(timeout=5))
+        self.assertEqual(len(attempts), 3)
+    
+    def test_limits_concurrent_jobs(self):
+        queue = JobQueue('test', max_workers=2)
+        lock = threading.Lock()
+        running = []
+        peak = []
+        
+        def job():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            threading.Event().wait(0.05)
+            with lock:
+                running.pop()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(6):
+                queue.submit(job)
+        self.assertTrue(queue.wait(timeout=5))
+        self.assertEqual(len(peak), 6)
+        self.assertEqual(max(peak), 2)
+
+
+class ChatIntentParserTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='intents@example.com', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+    
+    def test_parses_record_and_query_intents(self):
+        record = parse_chat_intent('I paid $1,200 for rent')
+        self.assertEqual((record['intent'], record['category'], record['amount']), ('record_expense', 'housing', Decimal('1200')))
+        self.assertEqual(record['reply'], "I've recorded your housing expense of $1200.00.")
+        
+        query = parse_chat_intent('How much did I spend on coffee last week?')
+        self.assertEqual((query['intent'], query['category'], query['time_period']), ('query_expenses', 'food', 'last week'))
+        self.assertEqual(parse_chat_intent('how much did I spend today')['category'], None)
+    
+    def test_unsure_messages_fall_back(self):
+        for message in (
+            'I spent 20 on a gift for mom',
+            "I didn't spend 20 on lunch",
+            'How much did I spend on my dog last week?',
+            'How much did I spend on food?',
+            'spent 20 and 15 on lunch',
+            'Hello!',
+        ):
+            with self.subTest(message=message):
+                self.assertIsNone(parse_chat_intent(message))
+    
+    @mock.patch('api.views.get_openai_client')
+    def test_simple_handles_common_phrases_without_the_model(self, openai_client):
+        category = Category.objects.create(user=self.user, name='food')
+        Expense.objects.create(
+            user=self.user, category=category, expense_amount=Decimal('9.50'),
+            transaction_datetime=timezone.now(), expense_note='coffee'
+        )
+        
+        recorded = self.client.post('/api/chat/simple/', {'message': 'spent 20 on lunch'})
+        queried = self.client.post('/api/chat/simple/', {'message': 'how much did I spend on food today?'})
+        
+        openai_client.assert_not_called()
+        self.assertEqual(recorded.data['message'], "I've recorded your food expense of $20.00.")
+        self.assertIn('$29.50 on food today', queried.data['message'])
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+    
+    def test_benchmark_corpus_is_parsed_exactly(self):
+        out = StringIO()
+        call_command('benchmark_intents', '--repeat', '1', stdout=out)
+        self.assertIn('false_positives=0 missed=0', out.getvalue())
+
+
+@override_settings(CHAT_CONTEXT_TOKEN_BUDGET=600, CHAT_MESSAGE_TOKEN_LIMIT=50, CHAT_HISTORY_MESSAGES=4)
+class ChatContextTestCase(FakeOpenAITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(email='context@example.com', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+    
+    def add_turns(self, count, content='message {}'):
+        for index in range(count):
+            ChatMessage.objects.create(user=self.user, role='user' if index % 2 == 0 else 'assistant',
+                                       content=content.format(index))
+    
+    def test_token_helpers(self):
+        self.assertEqual(count_tokens('I spent $20 on lunch.'), 7)
+        self.assertGreater(count_tokens('supercalifragilistic'), 1)
+        text = ' '.join(['word'] * 100)
+        self.assertTrue(truncate_to_tokens(text, 10).endswith(TRUNCATION_MARKER))
+        self.assertEqual(truncate_to_tokens('short text', 10), 'short text')
+    
+    def test_long_messages_are_truncated_and_budget_holds(self):
+        self.add_turns(3, content='pasted {} ' + 'lorem ipsum ' * 400)
+        ChatMessage.objects.create(user=self.user, role='user', content='hello ' * 500)
+        
+        messages, prompt_tokens = build_chat_context(self.user, 'hello ' * 500)
+        
+        self.assertLessEqual(prompt_tokens, 600)
+        for message in messages[1:]:
+            self.assertLessEqual(count_tokens(message['content']), 50 + count_tokens(TRUNCATION_MARKER))
+        self.assertTrue(messages[-1]['content'].endswith(TRUNCATION_MARKER))
+    
+    def test_older_turns_are_summarized_and_cached(self):
+        self.add_turns(10)
+        ChatMessage.objects.create(user=self.user, role='user', content='latest')
+        
+        messages, _ = build_chat_context(self.user, 'latest')
+        self.assertEqual([m['content'] for m in messages[2:-1]], ['message 6', 'message 7', 'message 8', 'message 9'])
+        self.assertIn('user: message 0', messages[1]['content'])
+        self.assertIn('assistant: message 5', messages[1]['content'])
+        
+        with self.assertNumQueries(1):
+            cached, _ = build_chat_context(self.user, 'latest')
+        self.assertEqual(cached, messages)
+    
+    def test_prompt_tokens_are_recorded_on_the_reply(self):
+        self.add_turns(2)
+        response = self.client.post('/api/chat/simple/', {'message': 'Any tips for saving money?'})
+        
+        self.assertEqual(response.status_code, 200)
+        sent = self.openai_server.requests[0][1]['messages']
+        reply = ChatMessage.objects.filter(user=self.user, role='assistant').latest('id')
+        self.assertEqual(len(sent), 4)
+        self.assertEqual(reply.prompt_tokens, REPLY_PRIMING_TOKENS + sum(message_tokens(m) for m in sent))
+        self.assertLessEqual(reply.prompt_tokens, 600)
+
+
+class CompletionCacheTestCase(FakeOpenAITestMixin, TestCase):
+    reply = "I've recorded your food expense of $4.00."
+    
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='cache@example.com', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+    
+    def test_repeated_template_replies_skip_the_model(self):
+        for message in ('Coffee 4', '  coffee   4 '):
+            response = self.client.post('/api/chat/simple/', {'message': message})
+            self.assertEqual(response.data['message'], self.reply)
+        
+        self.assertEqual(len(self.openai_server.requests), 1)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(ChatMessage.objects.filter(user=self.user, role='assistant').latest('id').prompt_tokens, 0)
+        stats = get_completion_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+    
+    def test_conversational_replies_are_not_cached(self):
+        self.openai_server.reply = 'Sure, what would you like to know?'
+        for _ in range(2):
+            self.client.post('/api/chat/simple/', {'message': 'can you help me'})
+        self.assertEqual(len(self.openai_server.requests), 2)
+    
+    def test_replies_built_from_the_conversation_are_not_shared(self):
+        # The model took the category and amount from the first user's history
+        self.openai_server.replies = [self.reply, "I've recorded your travel expense of $120.00."]
+        other = User.objects.create_user(email='cache-other@example.com', password='testpassword')
+        other_client = APIClient()
+        other_client.force_authenticate(user=other)
+        
+        self.client.post('/api/chat/simple/', {'message': 'same again'})
+        response = other_client.post('/api/chat/simple/', {'message': 'same again'})
+        
+        self.assertEqual(response.data['message'], "I've recorded your travel expense of $120.00.")
+        self.assertEqual(len(self.openai_server.requests), 2)
+        self.assertEqual(Expense.objects.get(user=other).expense_amount, Decimal('120.00'))
+        self.assertEqual(get_completion_cache().stats()['hits'], 0)
+    
+    @override_settings(BACKGROUND_JOBS_EAGER=True)
+    def test_expense_notes_are_cached_per_day(self):
+        self.openai_server.replies = [self.reply, '2024-05-01 - Coffee - Food', self.reply]
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/chat/simple/', {'message': 'Coffee 4'})
+        
+        self.assertEqual(len(self.openai_server.requests), 2)
+        self.assertEqual(
+            list(Expense.objects.filter(user=self.user).values_list('expense_note', flat=True)),
+            ['2024-05-01 - Coffee - Food'] * 2
+        )
+    
+    @override_settings(LLM_CACHE_BACKEND='django')
+    def test_django_cache_backend(self):
+        cache.clear()
+        self.client.post('/api/chat/simple/', {'message': 'Coffee 4'})
+        self.client.post('/api/chat/simple/', {'message': 'coffee 4'})
+        self.assertEqual(len(self.openai_server.requests), 1)
+        self.assertEqual(get_completion_cache().stats()['backend'], 'DjangoCacheBackend')
+    
+    def test_local_backend_evicts_least_recently_used_and_expired(self):
+        completions = CompletionCache(LocalLRUBackend(max_entries=2), ttl=60)
+        completions.set('a', 1)
+        completions.set('b', 2)
+        completions.get('a')
+        completions.set('c', 3)
+        self.assertEqual((completions.get('a'), completions.get('b'), completions.get('c')), (1, None, 3))
+        
+        with mock.patch('api.llm_cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(completions.get('a'))
+        self.assertEqual(completions.stats()['hits'], 3)
+
+
+class ChatSpendingQueryTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='spending@example.com', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.travel = Category.objects.create(user=self.user, name='Travel')
+        now = timezone.now()
+        for days_ago, category, amount in (
+            (1, self.food, '30.00'), (2, self.food, '10.00'), (3, self.travel, '60.00'),
+            (10, self.food, '25.00'), (12, self.travel, '100.00'), (20, self.food, '999.00'),
+        ):
+            Expense.objects.create(
+                user=self.user, category=category, expense_amount=Decimal(amount),
+                transaction_datetime=now - datetime.timedelta(days=days_ago), expense_note='x'
+            )
+    
+    def ask(self, message):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/chat/simple/', {'message': message})
+        self.assertEqual(response.status_code, 200)
+        rollup_queries = [q['sql'] for q in queries.captured_queries if 'api_expensedailyrollup' in q['sql']]
+        self.assertEqual(len(rollup_queries), 1, rollup_queries)
+        self.assertEqual(len(queries.captured_queries), 3)
+        return response.data['message']
+    
+    def test_category_query_compares_with_previous_period(self):
+        message = self.ask('how much did I spend on food last week?')
+        
+        self.assertIn('you spent $40.00 on food last week', message)
+        self.assertIn('2 transactions with an average of $20.00', message)
+        self.assertIn("That's 60% more than the week before ($25.00).", message)
+    
+    def test_total_query_breaks_down_by_category(self):
+        message = self.ask('how much did I spend last week?')
+        
+        self.assertIn('you spent $100.00 last week', message)
+        self.assertIn('- Travel: $60.00\n- Food: $40.00', message)
+        self.assertIn("That's 20% less than the week before ($125.00).", message)
+    
+    def test_unknown_category_reports_nothing_spent(self):
+        message = self.ask('how much did I spend on healthcare last week?')
+        self.assertIn('you spent $0.00 on healthcare last week', message)
+        self.assertNotIn('transaction', message)
+    
+    def test_period_bounds(self):
+        from .views import chat_query_period
+        self.assertEqual(
+            chat_query_period('last month', datetime.date(2024, 1, 15)),
+            (datetime.date(2023, 12, 1), datetime.date(2024, 1, 1), datetime.date(2023, 11, 1), 'the month before')
+        )
+        self.assertEqual(
+            chat_query_period('this year', datetime.date(2024, 3, 5))[2:],
+            (datetime.date(2023, 1, 1), 'last year')
+        )
+
+
+@override_settings(LLM_CALL_TIMEOUT=0.3, LLM_BREAKER_FAILURE_THRESHOLD=2, LLM_BREAKER_RECOVERY_SECONDS=60)
+class LLMGuardTestCase(FakeOpenAITestMixin, TestCase):
+    message = {'message': 'can you help me plan a budget'}
+    
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='guard@example.com', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+    
+    def timed_post(self):
+        started = time.monotonic()
+        response = self.client.post('/api/chat/simple/', self.message)
+        return response, time.monotonic() - started
+    
+    def test_slow_provider_opens_the_circuit_then_fails_fast(self):
+        self.openai_server.delay = 2
+        for _ in range(2):
+            response, elapsed = self.timed_post()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response.data['degraded'], response.data['reason']), (True, 'timeout'))
+            self.assertLess(elapsed, 1.5)
+        
+        response, elapsed = self.timed_post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['degraded'], response.data['reason']), (True, 'circuit_open'))
+        self.assertLess(elapsed, 0.25)
+        self.assertEqual(len(self.openai_server.requests), 2)
+        self.assertEqual(ChatMessage.objects.filter(user=self.user, role='assistant').count(), 3)
+        
+        metrics = self.client.get('/api/chat/llm_status/').data['llm']
+        self.assertEqual(metrics['circuit'], 'open')
+        self.assertEqual((metrics['failed'], metrics['times_opened']), (2, 1))
+        self.assertEqual(metrics['rejected'], {'circuit_open': 1})
+    
+    @override_settings(OPENAI_MAX_RETRIES=2)
+    def test_hung_call_returns_within_the_budget_despite_client_retries(self):
+        self.openai_server.delay = 2
+        response, elapsed = self.timed_post()
+        
+        self.assertEqual(response.data['reason'], 'timeout')
+        # One attempt of LLM_CALL_TIMEOUT, not three plus the SDK's backoff
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(len(self.openai_server.requests), 1)
+        self.assertEqual(get_llm_guard().metrics()['failed'], 1)
+    
+    @override_settings(LLM_BREAKER_FAILURE_THRESHOLD=1, LLM_BREAKER_RECOVERY_SECONDS=0.2)
+    def test_circuit_closes_after_a_successful_trial_call(self):
+        self.openai_server.delay = 2
+        self.timed_post()
+        self.assertEqual(get_llm_guard().metrics()['circuit'], 'open')
+        
+        time.sleep(0.25)
+        self.openai_server.delay = 0
+        response, _ = self.timed_post()
+        self.assertEqual(response.data['message'], self.reply)
+        self.assertEqual(get_llm_guard().metrics()['circuit'], 'closed')
+    
+    @override_settings(LLM_MAX_CONCURRENT_CALLS=1, LLM_QUEUE_TIMEOUT=0.05)
+    def test_global_cap_falls_back_when_no_slot_frees_up(self):
+        guard = get_llm_guard()
+        guard.acquire()
+        try:
+            response, _ = self.timed_post()
+        finally:
+            guard.release()
+        
+        self.assertEqual(response.data['reason'], 'busy')
+        self.assertEqual(self.openai_server.requests, [])
+        self.assertEqual(self.timed_post()[0].data['message'], self.reply)
+    
+    @override_settings(LLM_MAX_CONCURRENT_CALLS_PER_USER=1)
+    def test_per_user_cap(self):
+        guard = get_llm_guard()
+        guard.acquire(self.user.id)
+        try:
+            response, _ = self.timed_post()
+            other_call = guard.acquire(user_id=self.user.id + 1)
+            guard.release(user_id=self.user.id + 1)
+        finally:
+            guard.release(self.user.id)
+        
+        self.assertEqual(response.data['reason'], 'user_limit')
+        self.assertGreater(other_call, 0)
+    
+    @override_settings(LLM_MAX_CONCURRENT_CALLS=1, LLM_QUEUE_TIMEOUT=5)
+    def test_queue_depth_is_reported(self):
+        guard = get_llm_guard()
+        guard.acquire()
+        waiter = threading.Thread(target=lambda: guard.release() if guard.acquire() else None)
+        waiter.start()
+        deadline = time.monotonic() + 2
+        while guard.metrics()['queue_depth'] != 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        self.assertEqual(guard.metrics()['queue_depth'], 1)
+        self.assertEqual(guard.metrics()['in_flight'], 1)
+        guard.release()
+        waiter.join(timeout=2)
+        self.assertEqual((guard.metrics()['queue_depth'], guard.metrics()['in_flight']), (0, 0))
+
+
+@override_settings(PURGE_BATCH_SIZE=3, PURGE_BATCH_PAUSE=0, BACKGROUND_JOBS_EAGER=True)
+class PurgeTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='purge@example.com', password='testpassword')
+        self.other = User.objects.create_user(email='keep@example.com', password='testpassword')
+        for owner in (self.user, self.other):
+            category = Category.objects.create(user=owner, name='Food')
+            subcategory = SubCategory.objects.create(user=owner, category=category, name='Lunch')
+            Expense.objects.bulk_create([
+                Expense(
+                    user=owner,
+                    expense_note=f'Expense {i}',
+                    expense_amount=Decimal('3.00'),
+                    transaction_datetime=timezone.now() - datetime.timedelta(days=i),
+                    category=category,
+                    subcategory=subcategory
+                )
+                for i in range(7)
+            ])
+            Income.objects.create(user=owner, everymonth_payment_date=1, amount=Decimal('10.00'))
+            subscription = WeeklyReportSubscription.objects.create(user=owner)
+            WeeklyReportDelivery.objects.create(user=owner, subscription=subscription, period_start=datetime.date(2024, 1, 1))
+            ChatMessage.objects.bulk_create([
+                ChatMessage(user=owner, role='user', content=f'Message {i}') for i in range(10)
+            ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def test_account_purge_deletes_user_data_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.delete(f'/api/users/{self.user.id}/')
+        
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        job = PurgeJob.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, PurgeJob.STATUS_DONE)
+        self.assertIsNone(job.user_id)
+        self.assertEqual(Expense.objects.count(), 7)
+        self.assertEqual(ChatMessage.objects.count(), 10)
+        self.assertEqual(find_rollup_mismatches(self.other.id), [])
+        # 10 messages + 7 expenses + rollups + income + subscription + delivery + subcategory + category
+        # + their 10 change log entries + user
+        self.assertEqual(job.deleted_rows, 10 + 7 + 7 + 6 + 10)
+        expense_deletes = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('DELETE FROM "api_expense"')]
+        self.assertEqual(len(expense_deletes), 3)
+    
+    def test_account_purge_logs_expenses_of_others_losing_their_receiver(self):
+        received = list(Expense.objects.filter(user=self.other)[:2])
+        Expense.objects.filter(pk__in=[expense.pk for expense in received]).update(receiver=self.user)
+        since = ChangeLogEntry.objects.filter(user=self.other).order_by('-id').values_list('id', flat=True).first()
+        job = PurgeJob.objects.create(user=self.user, kind=PurgeJob.KIND_ACCOUNT)
+        with mock.patch.object(UserDataCache, 'bump', autospec=True) as bump:
+            run_purge(job.id)
+        
+        self.assertFalse(Expense.objects.filter(user=self.other, receiver__isnull=False).exists())
+        self.assertEqual(
+            set(ChangeLogEntry.objects.filter(user=self.other, id__gt=since).values_list('kind', 'object_id', 'action')),
+            {(ChangeLogEntry.KIND_EXPENSE, expense.pk, ChangeLogEntry.ACTION_UPSERT) for expense in received}
+        )
+        self.assertIn(self.other.id, [call.args[1] for call in bump.call_args_list])
+    
+    def test_account_is_deactivated_before_the_purge_runs(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        with self.captureOnCommitCallbacks(execute=False):
+            self.client.delete(f'/api/users/{self.user.id}/')
+        
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(client.get('/api/users/me/').status_code, 401)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 7)
+    
+    def test_short_history_is_cleared_inline(self):
+        with self.settings(PURGE_BATCH_SIZE=50):
+            response = self.client.post('/api/chat/clear_history/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ChatMessage.objects.filter(user=self.user).exists())
+        self.assertFalse(PurgeJob.objects.exists())
+    
+    def test_long_history_is_hidden_then_purged_in_background(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/chat/clear_history/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get('/api/chat/history/').data, [])
+        
+        # Messages sent while the purge is pending survive it
+        ChatMessage.objects.create(user=self.user, role='user', content='After clear')
+        for callback in callbacks:
+            callback()
+        
+        self.assertEqual(
+            list(ChatMessage.objects.filter(user=self.user).values_list('content', flat=True)), ['After clear']
+        )
+        progress = self.client.get(f"/api/purges/{response.data['purge']['id']}/").data
+        self.assertEqual((progress['status'], progress['deleted_rows']), ('done', 10))
+        self.assertEqual([row['content'] for row in self.client.get('/api/chat/history/').data], ['After clear'])
+    
+    def test_cleared_history_stays_hidden_in_other_processes(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self.client.post('/api/chat/clear_history/')
+        # Another worker, or this one after a restart: nothing cached, the user loaded afresh
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=self.user.pk))
+        self.assertEqual(client.get('/api/chat/history/').data, [])
+        self.assertEqual(ChatMessage.objects.filter(user=self.user).count(), 10)
+    
+    def test_interrupted_purge_resumes_where_it_stopped(self):
+        job = PurgeJob.objects.create(user=self.user, kind=PurgeJob.KIND_ACCOUNT)
+        with mock.patch('api.purge.time.sleep', side_effect=RuntimeError('worker killed')):
+            with self.assertRaises(RuntimeError):
+                run_purge(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.step, job.deleted_rows), ('failed', 'chat_messages', 3))
+        self.assertEqual(ChatMessage.objects.filter(user=self.user).count(), 7)
+        
+        out = StringIO()
+        call_command('resume_purges', stdout=out)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PurgeJob.STATUS_DONE)
+        self.assertEqual(job.deleted_rows, 10 + 7 + 7 + 6 + 10)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertIn('Resumed 1 purges, 0 failed', out.getvalue())
+
+
+class BulkExpenseTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='bulk@example.com', password='testpassword')
+        self.other = User.objects.create_user(email='other@example.com', password='testpassword')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.travel = Category.objects.create(user=self.user, name='Travel')
+        self.lunch = SubCategory.objects.create(user=self.user, category=self.food, name='Lunch')
+        self.foreign = Category.objects.create(user=self.other, name='Not mine')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def items(self, count, **overrides):
+        return [
+            {
+                'expense_note': f'Bulk {i}',
+                'expense_amount': '2.50',
+                'transaction_datetime': (timezone.now() - datetime.timedelta(days=i % 3)).isoformat(),
+                'category': self.food.id,
+                'subcategory': self.lunch.id,
+                **overrides
+            }
+            for i in range(count)
+        ]
+    
+    def test_bulk_create_validates_with_a_fixed_number_of_queries(self):
+        query_counts = []
+        for count in (2, 40):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/expenses/bulk_create/', self.items(count), format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(len(response.data), count)
+            query_counts.append(len(queries.captured_queries))
+        
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 42)
+        self.assertEqual(response.data[0]['category_name'], 'Food')
+        self.assertEqual(find_rollup_mismatches(self.user.id), [])
+    
+    def test_bulk_create_reports_errors_per_item_and_writes_nothing(self):
+        items = self.items(4)
+        items[1]['category'] = self.foreign.id
+        items[2]['expense_amount'] = 'lots'
+        items[3]['category'] = self.travel.id  # Lunch is not a Travel subcategory
+        response = self.client.post('/api/expenses/bulk_create/', {'expenses': items}, format='json')
+        
+        self.assertEqual(response.status_code, 400)
+        errors = {error['index']: error['errors'] for error in response.data['errors']}
+        self.assertEqual(sorted(errors), [1, 2, 3])
+        self.assertIn('category', errors[1])
+        self.assertIn('expense_amount', errors[2])
+        self.assertIn('subcategory', errors[3])
+        self.assertFalse(Expense.objects.exists())
+    
+    @override_settings(EXPENSE_BULK_MAX_ITEMS=5)
+    def test_bulk_requests_are_capped(self):
+        response = self.client.post('/api/expenses/bulk_create/', self.items(6), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At most 5', response.data['error'])
+    
+    def test_bulk_update_and_delete(self):
+        created = self.client.post('/api/expenses/bulk_create/', self.items(5), format='json').data
+        other_expense = Expense.objects.create(
+            user=self.other, expense_note='Theirs', expense_amount=Decimal('1.00'), transaction_datetime=timezone.now()
+        )
+        
+        changes = [
+            {'id': row['id'], 'expense_amount': '9.00', 'category': self.travel.id, 'subcategory': None}
+            for row in created[:3]
+        ]
+        response = self.client.patch('/api/expenses/bulk_update/', changes + [{'id': other_expense.id}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.data['errors']], [3])
+        
+        response = self.client.patch('/api/expenses/bulk_update/', changes, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            Expense.objects.filter(user=self.user, category=self.travel, expense_amount=Decimal('9.00')).count(), 3
+        )
+        self.assertEqual(find_rollup_mismatches(self.user.id), [])
+        
+        ids = [row['id'] for row in created[:2]]
+        response = self.client.post('/api/expenses/bulk_delete/', {'ids': ids + [other_expense.id]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 5)
+        
+        response = self.client.post('/api/expenses/bulk_delete/', {'ids': ids}, format='json')
+        self.assertEqual(response.data, {'deleted': 2})
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 3)
+        self.assertTrue(Expense.objects.filter(pk=other_expense.pk).exists())
+        self.assertEqual(find_rollup_mismatches(self.user.id), [])
+
+
+STATEMENT = """Date,Description,Amount,Category
+01/05/2024,Coffee Shop,-4.50,Food
+01/05/2024,Coffee Shop,-4.50,Food
+01/06/2024,Train ticket,"(12.00)",travel
+01/07/2024,Bookstore,"-1,020.00",Books
+not a date,Broken row,-3.00,Food
+01/08/2024,Bad amount,abc,Food
+"""
+
+
+@override_settings(BACKGROUND_JOBS_EAGER=True)
+class ExpenseImportTestCase(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        
+        self.user = User.objects.create_user(email='import@example.com', password='testpassword')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.travel = Category.objects.create(user=self.user, name='Travel')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def upload(self, content, **fields):
+        upload = SimpleUploadedFile('statement.csv', content.encode(), content_type='text/csv')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/expenses/import_csv/', {'file': upload, **fields}, format='multipart')
+        self.assertEqual(response.status_code, 202, response.data)
+        return self.client.get(f"/api/expense-imports/{response.data['id']}/").data
+    
+    def test_parse_amount(self):
+        self.assertEqual(parse_amount('$1,234.5'), Decimal('1234.50'))
+        self.assertEqual(parse_amount('(8.00)'), Decimal('-8.00'))
+        self.assertEqual(parse_amount('-8'), Decimal('-8.00'))
+        for value in ('', '0', 'abc', '100000000', '-100000000'):
+            with self.assertRaises(ValueError):
+                parse_amount(value)
+    
+    def test_import_skips_duplicates_on_reimport(self):
+        result = self.upload(STATEMENT, amount_sign='negative')
+        self.assertEqual(result['status'], 'done')
+        self.assertEqual(
+            (result['rows_read'], result['imported'], result['duplicates'], result['failed_rows']), (6, 4, 0, 2)
+        )
+        self.assertEqual([error['line'] for error in result['errors']], [6, 7])
+        # Identical rows in one statement are separate purchases
+        self.assertEqual(Expense.objects.filter(user=self.user, expense_note='Coffee Shop').count(), 2)
+        self.assertEqual(Expense.objects.get(expense_note='Train ticket').category, self.travel)
+        self.assertEqual(Expense.objects.get(expense_note='Bookstore').expense_amount, Decimal('1020.00'))
+        self.assertEqual(result['categories_created'], 1)
+        self.assertTrue(Category.objects.filter(user=self.user, name='Books').exists())
+        self.assertEqual(find_rollup_mismatches(self.user.id), [])
+        
+        # The later statement overlaps the first one and adds one more coffee
+        result = self.upload(STATEMENT + "01/05/2024,coffee  shop,-4.50,Food\n", amount_sign='negative')
+        self.assertEqual((result['imported'], result['duplicates'], result['categories_created']), (1, 4, 0))
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(find_rollup_mismatches(self.user.id), [])
+        self.assertEqual(os.listdir(os.path.join(self.media.name, 'imports')), [])
+    
+    def test_explicit_columns_and_date_format(self):
+        result = self.upload(
+            "Booked,Payee,Out\n05.01.2024,Bakery,2.10\n",
+            datetime_column='Booked', note_column='Payee', amount_column='Out', date_format='%d.%m.%Y'
+        )
+        self.assertEqual(result['imported'], 1, result['errors'])
+        expense = Expense.objects.get(user=self.user)
+        self.assertEqual(timezone.localtime(expense.transaction_datetime).date(), datetime.date(2024, 1, 5))
+        self.assertIsNone(expense.category)
+    
+    def test_credits_are_skipped(self):
+        result = self.upload(STATEMENT)
+        self.assertEqual(result['status'], 'done')
+        self.assertEqual(result['amount_sign'], 'positive')
+        self.assertEqual((result['imported'], result['credits'], result['failed_rows']), (0, 4, 2))
+        self.assertFalse(Expense.objects.exists())
+        
+        # In a signed ledger the refund is the positive row
+        result = self.upload(
+            "Date,Description,Amount,Type\n"
+            "2024-01-05,Bakery,-2.10,Debit\n"
+            "2024-01-06,Bakery refund,2.10,Credit\n",
+            amount_sign='negative'
+        )
+        self.assertEqual((result['imported'], result['credits']), (1, 1))
+        expense = Expense.objects.get(user=self.user)
+        self.assertEqual((expense.expense_note, expense.expense_amount), ('Bakery', Decimal('2.10')))
+        # Type is the debit/credit marker, not a category
+        self.assertIsNone(expense.category)
+        self.assertFalse(Category.objects.filter(user=self.user, name='Debit').exists())
+    
+    def test_malformed_file_fails_with_the_line(self):
+        oversized = 'x' * (csv.field_size_limit() + 1)
+        result = self.upload(f"date,note,amount\n2024-01-05,Bakery,2.10\n2024-01-06,{oversized},1.00\n")
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(len(result['errors']), 1)
+        self.assertIn('Malformed CSV at line 3', result['errors'][0]['error'])
+    
+    def test_missing_columns_fail_the_import(self):
+        result = self.upload("When,What\n2024-01-05,Bakery\n")
+        self.assertEqual(result['status'], 'failed')
+        self.assertIn('amount', result['errors'][0]['error'])
+        self.assertFalse(Expense.objects.exists())
+    
+    def test_importer_writes_in_batches(self):
+        rows = ''.join(f"2024-02-{i % 28 + 1:02d},Item {i},{i + 1}.00,Food\n" for i in range(25))
+        progress = []
+        importer = ExpenseCSVImporter(
+            self.user, batch_size=10, on_progress=lambda stats: progress.append(stats['imported'])
+        )
+        with CaptureQueriesContext(connection) as queries:
+            stats = importer.run(StringIO("date,note,amount,category\n" + rows))
+        
+        self.assertEqual(progress, [10, 20, 25])
+        self.assertEqual(stats['imported'], 25)
+        inserts = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "api_expense"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(find_rollup_mismatches(self.user.id), [])
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='export@example.com', password='testpassword')
+        other = User.objects.create_user(email='other@example.com', password='testpassword')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        start = timezone.now() - datetime.timedelta(days=30)
+        Expense.objects.bulk_create([
+            Expense(
+                user=self.user,
+                expense_note=f'Expense {i}, "quoted"',
+                expense_amount=Decimal('1.25') * (i + 1),
+                transaction_datetime=start + datetime.timedelta(days=i),
+                category=self.food if i % 2 else None
+            )
+            for i in range(12)
+        ] + [Expense(user=other, expense_note='Not mine', expense_amount=Decimal('1.00'), transaction_datetime=start)])
+        Income.objects.create(user=self.user, everymonth_payment_date=25, amount=Decimal('2500.00'), description='Salary')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def download(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+    
+    @override_settings(EXPORT_CHUNK_SIZE=5, EXPORT_BLOCK_SIZE=256)
+    def test_csv_export_streams_from_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response, content = self.download('/api/expenses/export/')
+        
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('filename="expenses.csv"', response['Content-Disposition'])
+        rows = list(csv.DictReader(StringIO(content.decode())))
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[0]['note'], 'Expense 0, "quoted"')
+        self.assertEqual((rows[0]['amount'], rows[0]['category']), ('1.25', ''))
+        self.assertEqual(rows[1]['category'], 'Food')
+        self.assertEqual(len(queries.captured_queries), 1)
+    
+    def test_gzipped_ndjson_export(self):
+        response, content = self.download('/api/expenses/export/?export_format=ndjson&gzip=true')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('filename="expenses.ndjson.gz"', response['Content-Disposition'])
+        
+        rows = [json.loads(line) for line in gzip.decompress(content).decode().splitlines()]
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[-1]['amount'], '15.00')
+        self.assertEqual(datetime.datetime.fromisoformat(rows[-1]['transaction_datetime']).tzinfo is not None, True)
+    
+    def test_income_export_and_bad_format(self):
+        _, content = self.download('/api/incomes/export/')
+        self.assertEqual(content.decode().splitlines()[1].split(',')[1:4], ['25', '2500.00', 'Salary'])
+        self.assertEqual(self.client.get('/api/expenses/export/?export_format=xml').status_code, 400)
+    
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export_user_data', 'export@example.com', '--format', 'ndjson', '--chunk-size', '4', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 12)
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'incomes.csv.gz')
+            call_command('export_user_data', 'export@example.com', '--kind', 'incomes', '--gzip', '--output', path, stdout=StringIO())
+            with gzip.open(path, 'rt') as exported:
+                self.assertEqual(len(exported.read().splitlines()), 2)
+
+
+class UserDataCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='cached@example.com', password='testpassword')
+        self.other = User.objects.create_user(email='uncached@example.com', password='testpassword')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        Expense.objects.create(
+            user=self.user, expense_note='Lunch', expense_amount=Decimal('8.00'),
+            transaction_datetime=timezone.now(), category=self.food
+        )
+        Income.objects.create(user=self.user, everymonth_payment_date=1, amount=Decimal('100.00'), description='Pay')
+        get_data_cache().reset_stats()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def assertCached(self, url, namespace):
+        first = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertEqual(get_data_cache().stats()['namespaces'][namespace]['hits'], 1)
+        return second.data
+    
+    def test_reads_are_served_from_cache_until_a_write(self):
+        self.assertCached('/api/expenses/summary/', 'expense-summary')
+        self.assertCached('/api/incomes/total/', 'income-total')
+        self.assertCached('/api/categories/', 'category-list')
+        self.assertCached('/api/subcategories/', 'subcategory-list')
+        
+        self.client.post('/api/expenses/', {
+            'expense_note': 'Dinner', 'expense_amount': '12.00',
+            'transaction_datetime': timezone.now().isoformat(), 'category': self.food.id
+        }, format='json')
+        self.assertEqual(self.client.get('/api/expenses/summary/').data['total_amount'], Decimal('20.00'))
+        
+        Income.objects.filter(user=self.user).first().delete()
+        self.assertEqual(self.client.get('/api/incomes/total/').data['total_income'], 0)
+        
+        self.client.patch(f'/api/categories/{self.food.id}/', {'name': 'Groceries'}, format='json')
+        self.assertEqual(self.client.get('/api/categories/').data['results'][0]['name'], 'Groceries')
+    
+    def test_bulk_writes_and_other_users_writes(self):
+        self.assertCached('/api/expenses/summary/?period=year', 'expense-summary')
+        
+        Category.objects.create(user=self.other, name='Theirs')
+        Expense.objects.create(
+            user=self.other, expense_note='Theirs', expense_amount=Decimal('1.00'), transaction_datetime=timezone.now()
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/expenses/summary/?period=year')
+        self.assertEqual(len(queries.captured_queries), 0)
+        
+        Expense.objects.filter(user=self.user).update(expense_amount=Decimal('5.00'))
+        self.assertEqual(self.client.get('/api/expenses/summary/?period=year').data['total_amount'], Decimal('5.00'))
+        
+        Expense.objects.bulk_create([Expense(
+            user=self.user, expense_note='Bulk', expense_amount=Decimal('2.00'), transaction_datetime=timezone.now()
+        )])
+        self.assertEqual(self.client.get('/api/expenses/summary/?period=year').data['total_amount'], Decimal('7.00'))
+    
+    def test_writes_from_another_process_invalidate(self):
+        self.assertCached('/api/expenses/summary/', 'expense-summary')
+        # A management command or another worker has its own cache connection
+        other_process = UserDataCache(settings.DATA_CACHE_ALIAS, settings.DATA_CACHE_TTL)
+        with mock.patch.object(UserDataCache, 'cache', CacheHandler().create_connection(settings.DATA_CACHE_ALIAS)):
+            other_process.bump(self.user.id)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/expenses/summary/')
+        self.assertGreater(len(queries.captured_queries), 0)
+    
+    def test_rollup_rebuilds_invalidate(self):
+        ExpenseDailyRollup.objects.filter(user=self.user).update(total_amount=Decimal('99.00'))
+        self.assertEqual(self.client.get('/api/expenses/summary/').data['total_amount'], Decimal('99.00'))
+        rebuild_user_rollups(self.user.id)
+        self.assertEqual(self.client.get('/api/expenses/summary/').data['total_amount'], Decimal('8.00'))
+    
+    def test_cascades_and_bulk_deletes_bump_once(self):
+        Expense.objects.bulk_create([
+            Expense(user=self.user, expense_note=f'Bulk {i}', expense_amount=Decimal('1.00'),
+                    transaction_datetime=timezone.now(), category=self.food)
+            for i in range(5)
+        ])
+        SubCategory.objects.create(user=self.user, category=self.food, name='Lunch')
+        with mock.patch.object(UserDataCache, 'bump', autospec=True) as bump:
+            # Cascades to the subcategory and nulls the category of six expenses
+            self.food.delete()
+            Expense.objects.filter(user=self.user).delete()
+        self.assertEqual([call.args[1] for call in bump.call_args_list], [self.user.id, self.user.id])
+        self.assertEqual(self.client.get('/api/expenses/summary/').data['total_amount'], 0)
+    
+    def test_me_is_invalidated_by_profile_updates(self):
+        self.assertCached('/api/users/me/', 'user-me')
+        self.client.patch('/api/users/profile/', {'first_name': 'Renamed'}, format='json')
+        self.assertEqual(self.client.get('/api/users/me/').data['first_name'], 'Renamed')
+    
+    def test_cache_status_reports_hit_ratio_to_staff(self):
+        self.assertCached('/api/categories/', 'category-list')
+        self.assertEqual(self.client.get('/api/users/cache_status/').status_code, 403)
+        
+        self.user.is_staff = True
+        self.user.save()
+        stats = self.client.get('/api/users/cache_status/').data
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (1, 1, 0.5))
+        self.assertGreaterEqual(stats['invalidations'], 1)
+    
+    def test_tests_use_their_own_cache_directory(self):
+        self.assertCached('/api/categories/', 'category-list')
+        self.assertNotEqual(settings.DATA_CACHE_DIR, os.path.join(settings.BASE_DIR, 'cache', 'data'))
+        self.assertTrue(os.listdir(settings.DATA_CACHE_DIR))
+    
+    @override_settings(DATA_CACHE_BACKEND='memcached')
+    def test_unknown_backends_disable_the_cache(self):
+        self.assertIsNone(get_data_cache())
+        response = self.client.get('/api/expenses/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+    
+    @override_settings(DATA_CACHE_BACKEND='')
+    def test_cache_can_be_disabled(self):
+        self.client.get('/api/categories/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/categories/')
+        self.assertGreater(len(queries.captured_queries), 0)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='etag@example.com', password='testpassword')
+        self.other = User.objects.create_user(email='noetag@example.com', password='testpassword')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.expense = Expense.objects.create(
+            user=self.user, expense_note='Lunch', expense_amount=Decimal('8.00'),
+            transaction_datetime=timezone.now(), category=self.food
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def test_unchanged_resources_get_304_without_queries(self):
+        for url in ('/api/expenses/', f'/api/expenses/{self.expense.id}/', '/api/expenses/summary/',
+                    '/api/categories/', '/api/subcategories/', '/api/incomes/total/', '/api/users/me/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('no-cache', response['Cache-Control'])
+                with CaptureQueriesContext(connection) as queries:
+                    cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(cached.status_code, 304)
+                self.assertEqual(cached.content, b'')
+                self.assertEqual(cached['ETag'], response['ETag'])
+                self.assertEqual(len(queries.captured_queries), 0)
+    
+    def test_writes_change_the_etag(self):
+        etag = self.client.get('/api/expenses/')['ETag']
+        self.assertNotEqual(self.client.get('/api/expenses/?page_size=5')['ETag'], etag)
+        
+        self.client.patch(f'/api/expenses/{self.expense.id}/', {'expense_note': 'Brunch'}, format='json')
+        response = self.client.get('/api/expenses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['expense_note'], 'Brunch')
+        etag = response['ETag']
+        
+        # Expense rows show the category name, so a rename changes the ETag too
+        self.client.patch(f'/api/categories/{self.food.id}/', {'name': 'Meals'}, format='json')
+        response = self.client.get('/api/expenses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data['results'][0]['category_name'], 'Meals')
+        etag = response['ETag']
+        # Deletes are detected, which max(created_at) alone could not do
+        self.client.delete(f'/api/expenses/{self.expense.id}/')
+        response = self.client.get('/api/expenses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data['count']), (200, 0))
+        
+        # Another user's writes do not affect this user's validators
+        etag = response['ETag']
+        Expense.objects.create(
+            user=self.other, expense_note='Theirs', expense_amount=Decimal('1.00'), transaction_datetime=timezone.now()
+        )
+        self.assertEqual(self.client.get('/api/expenses/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+    
+    def test_writes_through_another_worker_change_the_etag(self):
+        response = self.client.get('/api/expenses/')
+        # Another worker bumps the version through its own cache connection
+        worker = UserDataCache(settings.DATA_CACHE_ALIAS, settings.DATA_CACHE_TTL)
+        with mock.patch.object(UserDataCache, 'cache', CacheHandler().create_connection(settings.DATA_CACHE_ALIAS)):
+            worker.bump(self.user.id)
+        response = self.client.get('/api/expenses/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        
+        # A per-process version cannot see such writes, so none is offered as a validator
+        with self.settings(DATA_CACHE_BACKEND='locmem'):
+            response = self.client.get('/api/expenses/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+    
+    def test_if_modified_since(self):
+        with mock.patch('api.data_cache.time.time', return_value=time.time() - 30):
+            get_data_cache().bump(self.user.id)
+        response = self.client.get('/api/categories/')
+        last_modified = response['Last-Modified']
+        self.assertEqual(self.client.get('/api/categories/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        
+        Category.objects.create(user=self.user, name='Travel')
+        response = self.client.get('/api/categories/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual((response.status_code, response.data['count']), (200, 2))
+        # The new version is not a second old yet, so only the ETag is sent
+        self.assertFalse(response.has_header('Last-Modified'))
+    
+    def test_only_owned_versioned_reads_get_validators(self):
+        theirs = Expense.objects.create(
+            user=self.other, expense_note='Theirs', expense_amount=Decimal('1.00'), transaction_datetime=timezone.now()
+        )
+        self.assertFalse(self.client.get(f'/api/expenses/{theirs.id}/').has_header('ETag'))
+        self.assertFalse(self.client.get('/api/weekly-reports/').has_header('ETag'))
+        self.user.is_staff = True
+        self.user.save()
+        self.assertFalse(self.client.get('/api/users/').has_header('ETag'))
+
+
+class SyncTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='sync@example.com', password='testpassword')
+        self.other = User.objects.create_user(email='other@example.com', password='testpassword')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.groceries = SubCategory.objects.create(user=self.user, category=self.food, name='Groceries')
+        self.expense = Expense.objects.create(
+            user=self.user, expense_note='Lunch', expense_amount=Decimal('12.50'),
+            transaction_datetime=timezone.now(), category=self.food, subcategory=self.groceries
+        )
+        self.income = Income.objects.create(user=self.user, everymonth_payment_date=25, amount=Decimal('2500.00'))
+        Category.objects.create(user=self.other, name='Theirs')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def sync(self, since=0, **params):
+        response = self.client.get('/api/sync/changes/', {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def upserted_ids(self, data, key):
+        return [row['id'] for row in data['upserts'][key]]
+    
+    def test_full_sync_returns_the_ledger(self):
+        data = self.sync()
+        self.assertFalse(data['has_more'])
+        self.assertEqual(self.upserted_ids(data, 'categories'), [self.food.id])
+        self.assertEqual(self.upserted_ids(data, 'subcategories'), [self.groceries.id])
+        self.assertEqual(self.upserted_ids(data, 'incomes'), [self.income.id])
+        self.assertEqual(data['upserts']['expenses'][0]['expense_note'], 'Lunch')
+        self.assertEqual(data['deletes'], {'categories': [], 'subcategories': [], 'expenses': [], 'incomes': []})
+        self.assertEqual(data['cursor'], ChangeLogEntry.objects.filter(user=self.user).latest('id').id)
+    
+    def test_incremental_sync_sends_each_changed_object_once(self):
+        cursor = self.sync()['cursor']
+        self.assertEqual(self.sync(cursor)['cursor'], cursor)
+        
+        for note in ('Brunch', 'Dinner'):
+            self.expense.expense_note = note
+            self.expense.save()
+        income_id = self.income.id
+        self.income.delete()
+        data = self.sync(cursor)
+        self.assertEqual([row['expense_note'] for row in data['upserts']['expenses']], ['Dinner'])
+        self.assertEqual(data['upserts']['categories'], [])
+        self.assertEqual(data['deletes']['incomes'], [income_id])
+    
+    def test_deleting_a_category_logs_cascades_and_detached_expenses(self):
+        cursor = self.sync()['cursor']
+        food_id, groceries_id = self.food.id, self.groceries.id
+        with CaptureQueriesContext(connection) as queries:
+            self.food.delete()
+        # The entries of the whole cascade are inserted together
+        inserts = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "api_changelogentry"')]
+        self.assertEqual(len(inserts), 1)
+        
+        data = self.sync(cursor)
+        self.assertEqual(data['deletes']['categories'], [food_id])
+        self.assertEqual(data['deletes']['subcategories'], [groceries_id])
+        self.assertEqual(data['upserts']['expenses'][0]['category'], None)
+    
+    def test_bulk_writes_are_logged(self):
+        cursor = self.sync()['cursor']
+        created = Expense.objects.bulk_create([
+            Expense(user=self.user, expense_note=f'Bulk {i}', expense_amount=Decimal('1.00'),
+                    transaction_datetime=timezone.now())
+            for i in range(3)
+        ])
+        Expense.objects.filter(pk=created[0].pk).update(expense_note='Updated')
+        Expense.objects.filter(pk=created[1].pk).delete()
+        
+        data = self.sync(cursor)
+        self.assertEqual([row['expense_note'] for row in data['upserts']['expenses']], ['Updated', 'Bulk 2'])
+        self.assertEqual(data['deletes']['expenses'], [created[1].pk])
+    
+    def test_failed_write_leaves_no_entry(self):
+        count = ChangeLogEntry.objects.count()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Category.objects.create(user=self.user, name='Rolled back')
+                raise RuntimeError()
+        self.assertEqual(ChangeLogEntry.objects.count(), count)
+    
+    def test_paging_with_has_more(self):
+        for i in range(4):
+            Category.objects.create(user=self.user, name=f'Category {i}')
+        
+        seen, cursor, pages = [], 0, 0
+        while True:
+            data = self.sync(cursor, limit=3)
+            seen += self.upserted_ids(data, 'categories')
+            cursor, pages = data['cursor'], pages + 1
+            if not data['has_more']:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(sorted(seen), list(Category.objects.filter(user=self.user).values_list('id', flat=True).order_by('id')))
+    
+    def test_compaction_keeps_the_latest_entry_per_object(self):
+        cursor = self.sync()['cursor']
+        for note in ('One', 'Two', 'Three'):
+            self.expense.expense_note = note
+            self.expense.save()
+        before = self.sync(cursor)
+        
+        out = StringIO()
+        call_command('compact_change_log', stdout=out)
+        self.assertIn('Deleted 3 superseded change log entries', out.getvalue())
+        self.assertEqual(compact_change_log(), 0)
+        self.assertEqual(self.sync(cursor), before)
+        self.assertEqual(len(self.sync()['upserts']['expenses']), 1)
+    
+    def test_invalid_params(self):
+        for params in ({'since': 'abc'}, {'since': -1}, {'limit': 0}):
+            response = self.client.get('/api/sync/changes/', params)
+            self.assertEqual(response.status_code, 400)
+
+
+class SyncBatchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='batch@example.com', password='testpassword')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.expense = Expense.objects.create(
+            user=self.user, expense_note='Lunch', expense_amount=Decimal('12.50'),
+            transaction_datetime=timezone.now(), category=self.food
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.cursor = self.client.get('/api/sync/changes/').data['cursor']
+    
+    def batch(self, operations, since=None, client='phone'):
+        response = self.client.post('/api/sync/batch/', {
+            'client': client, 'since': self.cursor if since is None else since, 'operations': operations
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def create(self, key, note='Coffee'):
+        return {'key': key, 'op': 'create', 'data': {
+            'expense_note': note, 'expense_amount': '4.00',
+            'transaction_datetime': '2025-01-01T08:00:00Z', 'category': self.food.id
+        }}
+    
+    def test_operations_apply_in_order(self):
+        data = self.batch([
+            self.create('c1'),
+            {'key': 'u1', 'op': 'update', 'ref': 'c1', 'data': {'expense_note': 'Flat white'}},
+            {'key': 'u2', 'op': 'update', 'id': self.expense.id, 'data': {'expense_amount': '15.00'}},
+            self.create('c2', 'Tea'),
+            {'key': 'd1', 'op': 'delete', 'ref': 'c2'},
+        ])
+        
+        self.assertEqual((data['applied'], data['conflicts'], data['failed']), (5, 0, 0))
+        self.assertEqual(data['results'][1]['expense']['expense_note'], 'Flat white')
+        self.assertEqual(
+            sorted(Expense.objects.filter(user=self.user).values_list('expense_note', 'expense_amount')),
+            [('Flat white', Decimal('4.00')), ('Lunch', Decimal('15.00'))]
+        )
+        self.assertEqual(find_rollup_mismatches(self.user.id), [])
+        changes = self.client.get('/api/sync/changes/', {'since': self.cursor}).data
+        self.assertEqual(len(changes['upserts']['expenses']), 2)
+        self.assertEqual(changes['deletes']['expenses'], [data['results'][3]['id']])
+    
+    def test_replayed_keys_are_not_applied_twice(self):
+        operations = [self.create('c1'), {'key': 'u1', 'op': 'update', 'ref': 'c1', 'data': {'expense_amount': '5.00'}}]
+        first = self.batch(operations)
+        again = self.batch(operations + [{'key': 'd1', 'op': 'delete', 'ref': 'c1'}])
+        
+        self.assertEqual([result['replayed'] for result in again['results'][:2]], [True, True])
+        self.assertEqual(again['results'][0]['id'], first['results'][0]['id'])
+        self.assertEqual(again['results'][2]['status'], 'applied')
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 1)
+    
+    def test_changes_after_the_cursor_conflict(self):
+        self.expense.expense_note = 'Edited on another device'
+        self.expense.save()
+        
+        data = self.batch([{'key': 'u1', 'op': 'update', 'id': self.expense.id, 'data': {'expense_note': 'Mine'}}])
+        result = data['results'][0]
+        self.assertEqual((result['status'], result['current']['expense_note']), ('conflict', 'Edited on another device'))
+        self.expense.refresh_from_db()
+        self.assertEqual(self.expense.expense_note, 'Edited on another device')
+        
+        # Conflicts are not recorded, so the client can resolve with the same key
+        data = self.batch([{'key': 'u1', 'op': 'update', 'id': self.expense.id, 'data': {'expense_note': 'Mine'},
+                            'force': True}])
+        self.assertEqual(data['results'][0]['status'], 'applied')
+        self.expense.refresh_from_db()
+        self.assertEqual(self.expense.expense_note, 'Mine')
+    
+    def test_batches_of_another_client_conflict(self):
+        update = {'op': 'update', 'id': self.expense.id}
+        laptop = self.batch([{**update, 'key': 'l1', 'data': {'expense_note': 'From the laptop'}}], client='laptop')
+        self.assertEqual(laptop['results'][0]['status'], 'applied')
+        
+        # The phone has not synced since: the laptop's edit must not be overwritten
+        phone = self.batch([{**update, 'key': 'p1', 'data': {'expense_note': 'From the phone'}}], client='phone')
+        result = phone['results'][0]
+        self.assertEqual((result['status'], result['current']['expense_note']), ('conflict', 'From the laptop'))
+        self.expense.refresh_from_db()
+        self.assertEqual(self.expense.expense_note, 'From the laptop')
+        
+        # The laptop's own earlier batch does not conflict with its next one
+        laptop = self.batch([{**update, 'key': 'l2', 'data': {'expense_amount': '13.00'}}], client='laptop')
+        self.assertEqual(laptop['results'][0]['status'], 'applied')
+    
+    def test_deleting_an_expense_deleted_elsewhere_succeeds(self):
+        expense_id = self.expense.id
+        self.expense.delete()
+        data = self.batch([
+            {'key': 'd1', 'op': 'delete', 'id': expense_id},
+            {'key': 'u1', 'op': 'update', 'id': expense_id, 'data': {'expense_note': 'Gone'}},
+        ])
+        self.assertEqual([result['status'] for result in data['results']], ['applied', 'conflict'])
+        self.assertIsNone(data['results'][1]['current'])
+    
+    def test_invalid_operations_are_reported_and_skipped(self):
+        theirs = Category.objects.create(
+            user=User.objects.create_user(email='other@example.com', password='testpassword'), name='Theirs'
+        )
+        bad_category = self.create('c2')
+        bad_category['data']['category'] = theirs.id
+        data = self.batch([
+            self.create('c1'),
+            bad_category,
+            {'key': 'c1', 'op': 'delete', 'id': self.expense.id},
+            {'key': 'x1', 'op': 'rename'},
+            {'key': 'u1', 'op': 'update', 'ref': 'missing', 'data': {}},
+            {'key': 'u2', 'op': 'update', 'id': 999999, 'data': {}},
+        ])
+        
+        self.assertEqual([result['status'] for result in data['results']],
+                         ['applied', 'error', 'error', 'error', 'error', 'error'])
+        self.assertIn('category', data['results'][1]['errors'])
+        self.assertEqual(data['results'][2]['errors'], {'key': ['Key repeated in this batch']})
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+    
+    def test_failed_batch_applies_nothing(self):
+        with mock.patch('api.models.SyncOperation.objects.bulk_create', side_effect=IntegrityError('duplicate key')):
+            response = self.client.post('/api/sync/batch/', {
+                'client': 'phone', 'since': self.cursor, 'operations': [self.create('c1')]
+            }, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(find_rollup_mismatches(self.user.id), [])
+    
+    def test_invalid_requests(self):
+        for body in ({'client': 'phone', 'operations': [self.create('c1')]},
+                     {'client': 'phone', 'since': -1, 'operations': [self.create('c1')]},
+                     {'client': 'phone', 'since': 0, 'operations': []},
+                     {'since': 0, 'operations': [self.create('c1')]},
+                     {'client': '', 'since': 0, 'operations': [self.create('c1')]},
+                     [self.create('c1')]):
+            response = self.client.post('/api/sync/batch/', body, format='json')
+            self.assertEqual(response.status_code, 400)
+        with self.settings(SYNC_BATCH_MAX_OPERATIONS=1):
+            response = self.client.post(
+                '/api/sync/batch/', {'client': 'phone', 'since': 0, 'operations': [self.create('c1'), self.create('c2')]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 400)
+    
+    def test_old_keys_expire(self):
+        self.batch([self.create('c1')])
+        SyncOperation.objects.update(created_at=timezone.now() - datetime.timedelta(days=31))
+        call_command('compact_change_log', stdout=StringIO())
+        self.assertFalse(SyncOperation.objects.exists())
+
+
+class DashboardTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='dashboard@example.com', password='testpassword')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        Category.objects.create(user=self.user, name='Bills')
+        self.add_expenses(3)
+        Income.objects.create(user=self.user, everymonth_payment_date=1, amount=Decimal('100.00'), description='Pay')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def add_expenses(self, count):
+        now = timezone.now()
+        Expense.objects.bulk_create([
+            Expense(user=self.user, expense_note=f'Expense {i}', expense_amount=Decimal('2.50'),
+                    transaction_datetime=now - datetime.timedelta(hours=i), category=self.food)
+            for i in range(count)
+        ])
+    
+    def test_sections_match_the_separate_endpoints(self):
+        data = self.client.get('/api/dashboard/?period=year').data
+        
+        self.assertEqual(data['me'], self.client.get('/api/users/me/').data)
+        self.assertEqual([category['name'] for category in data['categories']], ['Bills', 'Food'])
+        self.assertEqual(data['expense_summary'], self.client.get('/api/expenses/summary/?period=year').data)
+        self.assertEqual(data['income_total'], self.client.get('/api/incomes/total/').data)
+        self.assertEqual(
+            [expense['expense_note'] for expense in data['recent_expenses']], ['Expense 0', 'Expense 1', 'Expense 2']
+        )
+    
+    def test_chosen_sections_only(self):
+        data = self.client.get('/api/dashboard/?sections=income_total,recent_expenses&recent_limit=1').data
+        self.assertEqual(sorted(data), ['income_total', 'recent_expenses'])
+        self.assertEqual(len(data['recent_expenses']), 1)
+        
+        response = self.client.get('/api/dashboard/?sections=me,budgets')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('budgets', response.data['error'])
+    
+    @override_settings(DATA_CACHE_BACKEND='')
+    def test_query_count_does_not_grow_with_data(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/api/dashboard/')
+        self.add_expenses(50)
+        Category.objects.create(user=self.user, name='Travel')
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get('/api/dashboard/')
+        self.assertEqual(len(response.data['recent_expenses']), 10)
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+    
+    def test_served_from_cache_and_revalidated(self):
+        first = self.client.get('/api/dashboard/')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/dashboard/').data, first.data)
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertEqual(self.client.get('/api/dashboard/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        
+        self.add_expenses(1)
+        response = self.client.get('/api/dashboard/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['recent_expenses']), 4)
+
+
+@override_settings(DATA_CACHE_BACKEND='')
+class ExpenseTimeseriesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='series@example.com', password='testpassword')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.travel = Category.objects.create(user=self.user, name='Travel')
+        utc = datetime.timezone.utc
+        for when, amount, category in (
+            (datetime.datetime(2025, 3, 3, 12, 0, tzinfo=utc), '10.00', self.food),
+            (datetime.datetime(2025, 3, 3, 18, 0, tzinfo=utc), '5.00', self.travel),
+            (datetime.datetime(2025, 3, 12, 9, 0, tzinfo=utc), '7.50', self.food),
+            # Still March 31 in UTC, already April 1 in Tokyo
+            (datetime.datetime(2025, 3, 31, 20, 0, tzinfo=utc), '2.00', self.food),
+        ):
+            Expense.objects.create(user=self.user, expense_note='Expense', expense_amount=Decimal(amount),
+                                   transaction_datetime=when, category=category)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def series(self, **params):
+        response = self.client.get('/api/expenses/timeseries/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def totals(self, buckets):
+        return {bucket['start'].isoformat(): bucket['total_amount'] for bucket in buckets if bucket['count']}
+    
+    def test_daily_series_is_zero_filled_from_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.series(start='2025-03-01', end='2025-03-31')
+        self.assertEqual(len(queries.captured_queries), 1)
+        
+        self.assertEqual(len(data['buckets']), 31)
+        self.assertEqual(data['buckets'][0], {'start': datetime.date(2025, 3, 1), 'total_amount': 0, 'count': 0})
+        self.assertEqual(self.totals(data['buckets']), {
+            '2025-03-03': Decimal('15.00'), '2025-03-12': Decimal('7.50'), '2025-03-31': Decimal('2.00')
+        })
+        self.assertEqual((data['total_amount'], data['count']), (Decimal('24.50'), 4))
+    
+    def test_weekly_and_monthly_buckets(self):
+        data = self.series(start='2025-03-01', end='2025-03-31', granularity='week')
+        # Weeks start on Monday, so the first bucket is labelled with February 24
+        self.assertEqual(data['buckets'][0]['start'], datetime.date(2025, 2, 24))
+        self.assertEqual(len(data['buckets']), 6)
+        self.assertEqual(self.totals(data['buckets']), {
+            '2025-03-03': Decimal('15.00'), '2025-03-10': Decimal('7.50'), '2025-03-31': Decimal('2.00')
+        })
+        
+        data = self.series(start='2025-01-01', end='2025-12-31', granularity='month')
+        self.assertEqual(len(data['buckets']), 12)
+        self.assertEqual(self.totals(data['buckets']), {'2025-03-01': Decimal('24.50')})
+    
+    def test_split_by_category(self):
+        data = self.series(start='2025-03-01', end='2025-03-31', granularity='month', by_category='true')
+        self.assertEqual(
+            [(category['category_name'], category['total_amount']) for category in data['categories']],
+            [('Food', Decimal('19.50')), ('Travel', Decimal('5.00'))]
+        )
+        self.assertEqual(len(data['categories'][1]['buckets']), 1)
+    
+    def test_days_are_counted_in_the_requested_timezone(self):
+        data = self.series(start='2025-03-01', end='2025-04-30', granularity='month', tz='Asia/Tokyo')
+        self.assertEqual(data['timezone'], 'Asia/Tokyo')
+        self.assertEqual(self.totals(data['buckets']), {'2025-03-01': Decimal('22.50'), '2025-04-01': Decimal('2.00')})
+        
+        # Grouping the expenses in a zone equal to UTC matches the rollups
+        utc = self.series(start='2025-03-01', end='2025-03-31', tz='Etc/UTC')
+        self.assertEqual(utc['buckets'], self.series(start='2025-03-01', end='2025-03-31')['buckets'])
+    
+    def test_invalid_parameters(self):
+        for params in (
+            {},
+            {'start': '2025-03-01', 'granularity': 'hour'},
+            {'start': '2025-03-01', 'tz': 'Mars/Olympus'},
+            {'start': '2025-03-31', 'end': '2025-03-01'},
+            {'start': '1900-01-01', 'end': '2025-01-01'},
+        ):
+            response = self.client.get('/api/expenses/timeseries/', params)
+            self.assertEqual(response.status_code, 400, params)
+    
+    def test_summary_periods_are_zero_filled(self):
+        today = timezone.localdate()
+        Expense.objects.create(user=self.user, expense_note='Today', expense_amount=Decimal('3.00'),
+                               transaction_datetime=timezone.now(), category=self.food)
+        
+        month = self.client.get('/api/expenses/summary/?period=month').data['monthly_expenses']
+        self.assertEqual(month[0]['name'], '1')
+        self.assertEqual(month[today.day - 1], {'name': str(today.day), 'total_amount': Decimal('3.00')})
+        week = self.client.get('/api/expenses/summary/?period=week').data['monthly_expenses']
+        self.assertEqual([day['name'] for day in week], ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
+        self.assertEqual(week[today.weekday()]['total_amount'], Decimal('3.00'))
+        year = self.client.get('/api/expenses/summary/?period=year').data['monthly_expenses']
+        self.assertEqual(year[0]['name'], 'Jan')
+        self.assertEqual(len(year), 12)
+        self.assertEqual(self.client.get('/api/expenses/summary/?tz=Nowhere').status_code, 400)
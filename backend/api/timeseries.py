@@ -0,0 +1,179 @@
+import zoneinfo
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+
+GRANULARITIES = ('day', 'week', 'month', 'year')
+
+
+def parse_timezone(name):
+    """
+    Return the zone for an IANA timezone name such as 'Europe/Berlin', or the
+    current timezone when `name` is empty.
+
+    Raises:
+        ValueError: For an unknown name
+    """
+    if not name:
+        return timezone.get_current_timezone()
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone {name!r}")
+
+
+def request_timezone(request):
+    """The zone named by the request's `tz` parameter, falling back to the current timezone"""
+    try:
+        return parse_timezone(request.query_params.get('tz'))
+    except ValueError:
+        return timezone.get_current_timezone()
+
+
+def bucket_start(day, granularity):
+    """Return the first day of the bucket `day` falls in; weeks start on Monday"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(day, granularity):
+    """Return the first day of the bucket after the one starting on `day`"""
+    if granularity == 'week':
+        return day + timedelta(days=7)
+    if granularity == 'month':
+        return day.replace(year=day.year + day.month // 12, month=day.month % 12 + 1)
+    if granularity == 'year':
+        return day.replace(year=day.year + 1)
+    return day + timedelta(days=1)
+
+
+def bucket_starts(start, end, granularity):
+    """First days of every bucket overlapping start..end (inclusive), in order"""
+    starts = []
+    day = bucket_start(start, granularity)
+    while day <= end:
+        starts.append(day)
+        day = next_bucket(day, granularity)
+    return starts
+
+
+def _grouped_rows(user, start, end, granularity, zone, group_fields):
+    """
+    Run the single grouped query behind a series: (bucket, *group_fields,
+    total, count) rows for the user's expenses between start and end.
+
+    Days in the server timezone are read from ExpenseDailyRollup, so the cost
+    scales with days rather than expenses; any other timezone shifts day
+    boundaries, so those series group the expenses themselves, converted to
+    the zone in SQL.
+    """
+    from .models import Expense, ExpenseDailyRollup
+
+    if str(zone) == settings.TIME_ZONE:
+        rows = ExpenseDailyRollup.objects.filter(user=user, date__gte=start, date__lte=end)
+        bucket = F('date') if granularity == 'day' else Trunc('date', granularity, output_field=DateField())
+        total, count = Sum('total_amount'), Sum('expense_count')
+    else:
+        rows = Expense.objects.filter(
+            user=user,
+            transaction_datetime__gte=datetime.combine(start, time.min, tzinfo=zone),
+            transaction_datetime__lt=datetime.combine(end + timedelta(days=1), time.min, tzinfo=zone)
+        )
+        if granularity == 'day':
+            bucket = TruncDate('transaction_datetime', tzinfo=zone)
+        else:
+            bucket = Trunc('transaction_datetime', granularity, output_field=DateField(), tzinfo=zone)
+        total, count = Sum('expense_amount'), Count('id')
+    return rows.annotate(bucket=bucket).values('bucket', *group_fields).annotate(
+        total=total, count=count
+    ).order_by().values_list('bucket', *group_fields, 'total', 'count')
+
+
+def expense_timeseries(user, start, end, granularity='day', by_category=False, zone=None):
+    """
+    Total a user's expenses per day, week, month or year, zero-filled.
+
+    Every bucket overlapping start..end is returned, with 0 where nothing was
+    spent, so clients can chart the series as is. Buckets hold the expenses
+    of their days within start..end only; a week bucket is labelled with its
+    Monday even when `start` falls later in that week.
+
+    Args:
+        user: Owner of the expenses
+        start: First day of the range (a date in `zone`)
+        end: Last day of the range, inclusive
+        granularity: 'day', 'week', 'month' or 'year'
+        by_category: Also return one series per category
+        zone: Timezone the days are counted in (default: the current timezone)
+
+    Returns:
+        dict: total_amount, count and buckets ({start, total_amount, count}),
+            plus categories (category, category_name, total_amount, count,
+            buckets) when by_category is set, largest total first
+
+    Raises:
+        ValueError: For an unknown granularity, an end before the start, or
+            more than TIMESERIES_MAX_BUCKETS buckets
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if end < start:
+        raise ValueError("end must not be before start")
+    zone = zone or timezone.get_current_timezone()
+    starts = bucket_starts(start, end, granularity)
+    if len(starts) > settings.TIMESERIES_MAX_BUCKETS:
+        raise ValueError(
+            f"At most {settings.TIMESERIES_MAX_BUCKETS} buckets per series, this range has {len(starts)}"
+        )
+
+    def empty_buckets():
+        return {day: [Decimal('0'), 0] for day in starts}
+
+    def series(buckets):
+        return [
+            {'start': day, 'total_amount': total, 'count': count}
+            for day, (total, count) in buckets.items()
+        ]
+
+    overall = empty_buckets()
+    categories = {}
+    group_fields = ('category', 'category__name') if by_category else ()
+    for row in _grouped_rows(user, start, end, granularity, zone, group_fields):
+        day, total, count = row[0], row[-2], row[-1]
+        overall[day][0] += total
+        overall[day][1] += count
+        if by_category:
+            category = categories.setdefault(row[1], {'name': row[2], 'buckets': empty_buckets()})
+            category['buckets'][day][0] += total
+            category['buckets'][day][1] += count
+
+    result = {
+        'start': start,
+        'end': end,
+        'granularity': granularity,
+        'timezone': str(zone),
+        'total_amount': sum(total for total, _ in overall.values()),
+        'count': sum(count for _, count in overall.values()),
+        'buckets': series(overall),
+    }
+    if by_category:
+        result['categories'] = sorted((
+            {
+                'category': category_id,
+                'category_name': category['name'],
+                'total_amount': sum(total for total, _ in category['buckets'].values()),
+                'count': sum(count for _, count in category['buckets'].values()),
+                'buckets': series(category['buckets']),
+            }
+            for category_id, category in categories.items()
+        ), key=lambda category: -category['total_amount'])
+    return result
@@ -4,7 +4,8 @@ from .views import (
     UserViewSet, CategoryViewSet, SubCategoryViewSet, 
     ExpenseViewSet, IncomeViewSet, ChatViewSet,
     request_otp, verify_otp_code, reset_password,
-    WeeklyReportSubscriptionViewSet
+    WeeklyReportSubscriptionViewSet, PurgeJobViewSet, ExpenseImportViewSet, SyncViewSet, DashboardViewSet,
+    chat_stream
 )
 
 router = DefaultRouter()
@@ -15,8 +16,14 @@ router.register(r'expenses', ExpenseViewSet, basename='expense')
 router.register(r'incomes', IncomeViewSet, basename='income')
 router.register(r'chat', ChatViewSet, basename='chat')
 router.register(r'weekly-reports', WeeklyReportSubscriptionViewSet, basename='weekly-report')
+router.register(r'purges', PurgeJobViewSet, basename='purge')
+router.register(r'expense-imports', ExpenseImportViewSet, basename='expense-import')
+router.register(r'sync', SyncViewSet, basename='sync')
+router.register(r'dashboard', DashboardViewSet, basename='dashboard')
 
 urlpatterns = [
+    # Streaming chat (SSE); serve through backend.asgi for non-blocking streams
+    path('chat/stream/', chat_stream, name='chat-stream'),
     path('', include(router.urls)),
     
     # OTP and authentication URLs
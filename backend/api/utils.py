@@ -1,5 +1,7 @@
 import logging
+import smtplib
 from django.core.mail import EmailMultiAlternatives
+from django.db import connections as db_connections
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
@@ -10,6 +12,9 @@ from decimal import Decimal
 
 logger = logging.getLogger('api')
 
+# Rows fetched per database round-trip when streaming expenses into a report
+REPORT_ROW_CHUNK_SIZE = 500
+
 def send_otp_email(user, verification_type='registration'):
     """
     Send OTP verification email to user
@@ -101,74 +106,89 @@ def verify_otp(email, otp_code, verification_type='registration'):
         logger.error(f"Error verifying OTP for {email}: {str(e)}")
         return False, f"Error verifying OTP: {str(e)}"
 
-def generate_expense_report_data(user, start_date, end_date):
+def generate_expense_report_data(user, start_date, end_date, max_rows=None):
     """
     Generate expense report data for a specific date range.
     
+    Totals, counts and the category breakdown come from one grouped query over
+    the daily rollup. Expense rows are not fetched here: 'expenses' is a lazy
+    iterator that streams them from the database when the template renders it.
+    
     Args:
         user (User): The user to generate the report for
         start_date (date): Start date for the report
         end_date (date): End date for the report
+        max_rows (int): Maximum number of expense rows to render, defaults to
+            settings.EXPENSE_REPORT_MAX_ROWS (None renders every row)
         
     Returns:
         dict: Report data including expenses, summaries, and statistics
     """
-    from .models import Expense
-    from django.db.models import Sum, Count
-    from django.db.models.functions import TruncDate
+    from .models import Expense, ExpenseDailyRollup
+    from django.db.models import Sum
     import datetime
     
+    if max_rows is None:
+        max_rows = getattr(settings, 'EXPENSE_REPORT_MAX_ROWS', None)
+    
     # Convert string dates to datetime if needed
     if isinstance(start_date, str):
         start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d').date()
     if isinstance(end_date, str):
         end_date = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()
     
-    # Add time components to make the date range inclusive
-    start_datetime = datetime.datetime.combine(start_date, datetime.time.min)
-    end_datetime = datetime.datetime.combine(end_date, datetime.time.max)
-    
-    # Get all expenses in the date range
-    expenses = Expense.objects.filter(
-        user=user,
-        transaction_datetime__gte=start_datetime,
-        transaction_datetime__lte=end_datetime
-    ).select_related('category', 'subcategory').order_by('-transaction_datetime')
-    
-    # Calculate summary statistics
-    total_amount = expenses.aggregate(total=Sum('expense_amount'))['total'] or 0
-    transaction_count = expenses.count()
+    # Whole days in the current timezone, end date inclusive
+    start_datetime = timezone.make_aware(datetime.datetime.combine(start_date, datetime.time.min))
+    end_datetime = timezone.make_aware(datetime.datetime.combine(end_date + timedelta(days=1), datetime.time.min))
     
-    # Get category breakdown
-    category_data = {}
-    for expense in expenses:
-        category_name = expense.category.name if expense.category else "Uncategorized"
-        if category_name not in category_data:
-            category_data[category_name] = Decimal('0')
-        category_data[category_name] += expense.expense_amount
+    # Single grouped pass: per-category amounts and counts, largest first
+    category_rows = list(
+        ExpenseDailyRollup.objects.filter(
+            user=user,
+            date__gte=start_date,
+            date__lte=end_date
+        ).values('category__name').annotate(
+            amount=Sum('total_amount'),
+            count=Sum('expense_count')
+        ).order_by('-amount')
+    )
+    total_amount = sum((row['amount'] for row in category_rows), Decimal('0'))
+    transaction_count = sum(row['count'] for row in category_rows)
     
     # Format category breakdown for template
     category_breakdown = []
-    for name, amount in category_data.items():
-        percentage = (amount / total_amount * 100) if total_amount > 0 else Decimal('0')
+    for row in category_rows:
+        percentage = (row['amount'] / total_amount * 100) if total_amount > 0 else Decimal('0')
         category_breakdown.append({
-            'name': name,
-            'amount': f"{amount:.2f}",
+            'name': row['category__name'] or "Uncategorized",
+            'amount': f"{row['amount']:.2f}",
             'percentage': f"{percentage:.1f}"
         })
     
-    # Sort by amount descending
-    category_breakdown.sort(key=lambda x: float(x['amount']), reverse=True)
-    
     # Get top spending category
     top_category = category_breakdown[0]['name'] if category_breakdown else None
     top_category_percentage = category_breakdown[0]['percentage'] if category_breakdown else None
     
+    # Expense rows stream lazily, newest first, only with the columns the template shows
+    expenses = Expense.objects.filter(
+        user=user,
+        transaction_datetime__gte=start_datetime,
+        transaction_datetime__lt=end_datetime
+    ).select_related('category').only(
+        'transaction_datetime', 'expense_note', 'expense_amount', 'category__name'
+    ).order_by('-transaction_datetime')
+    expenses_shown = transaction_count
+    if max_rows is not None and transaction_count > max_rows:
+        expenses = expenses[:max_rows]
+        expenses_shown = max_rows
+    
     return {
         'user': user,
         'start_date': start_date.strftime('%B %d, %Y'),
         'end_date': end_date.strftime('%B %d, %Y'),
-        'expenses': expenses,
+        'expenses': expenses.iterator(chunk_size=REPORT_ROW_CHUNK_SIZE),
+        'expenses_shown': expenses_shown,
+        'expenses_truncated': expenses_shown < transaction_count,
         'total_amount': f"{total_amount:.2f}",
         'transaction_count': transaction_count,
         'category_breakdown': category_breakdown,
@@ -176,6 +196,35 @@ def generate_expense_report_data(user, start_date, end_date):
         'top_category_percentage': top_category_percentage
     }
 
+def build_expense_report_email(user, start_date, end_date):
+    """
+    Generate an expense report and render it into an email, without sending it.
+    
+    Args:
+        user (User): The user the report is for
+        start_date (date): Start date for the report
+        end_date (date): End date for the report
+        
+    Returns:
+        EmailMultiAlternatives: The rendered report email
+    """
+    # Generate report data
+    report_data = generate_expense_report_data(user, start_date, end_date)
+    
+    # Check if there are any expenses in the report
+    if report_data['transaction_count'] == 0:
+        logger.info(f"No expenses found for {user.email} in the requested date range")
+        # We'll still send the report, just with a message indicating no expenses
+    
+    # Render email HTML content
+    html_content = render_to_string('email/expense_report.html', report_data)
+    text_content = strip_tags(html_content)  # Plain text version for email clients that don't support HTML
+    
+    subject = f"Spendora Expense Report: {report_data['start_date']} - {report_data['end_date']}"
+    email = EmailMultiAlternatives(subject, text_content, settings.DEFAULT_FROM_EMAIL, [user.email])
+    email.attach_alternative(html_content, "text/html")
+    return email
+
 def send_expense_report_email(user, start_date, end_date):
     """
     Generate and send an expense report email for a specific date range.
@@ -188,37 +237,11 @@ def send_expense_report_email(user, start_date, end_date):
     Returns:
         bool: True if email was sent successfully, False otherwise
     """
-    from django.core.mail import EmailMultiAlternatives
-    from django.template.loader import render_to_string
-    from django.utils.html import strip_tags
-    from django.conf import settings
-    
-    logger = logging.getLogger('api')
     logger.info(f"Generating expense report for {user.email} from {start_date} to {end_date}")
     
     try:
-        # Generate report data
-        report_data = generate_expense_report_data(user, start_date, end_date)
-        
-        # Check if there are any expenses in the report
-        if report_data['transaction_count'] == 0:
-            logger.info(f"No expenses found for {user.email} in the requested date range")
-            # We'll still send the report, just with a message indicating no expenses
-        
-        # Render email HTML content
-        html_content = render_to_string('email/expense_report.html', report_data)
-        text_content = strip_tags(html_content)  # Plain text version for email clients that don't support HTML
-        
-        # Prepare email
-        subject = f"Spendora Expense Report: {report_data['start_date']} - {report_data['end_date']}"
-        from_email = settings.DEFAULT_FROM_EMAIL
-        recipient = user.email
-        
-        logger.info(f"Sending expense report email to {recipient}")
-        
-        # Create and send email
-        email = EmailMultiAlternatives(subject, text_content, from_email, [recipient])
-        email.attach_alternative(html_content, "text/html")
+        email = build_expense_report_email(user, start_date, end_date)
+        logger.info(f"Sending expense report email to {user.email}")
         email.send()
         
         logger.info(f"Successfully sent expense report to {user.email}")
@@ -227,58 +250,237 @@ def send_expense_report_email(user, start_date, end_date):
         logger.exception(f"Error sending expense report email to {user.email}: {str(e)}")
         return False
 
-def send_weekly_expense_reports():
+def _build_report_batch(subscriptions, start_date, end_date, close_connections):
+    """
+    Build report emails for a batch of subscriptions.
+    
+    Returns:
+        tuple: (list of (subscription, email) that were built, number of failures)
+    """
+    built = []
+    failed = 0
+    try:
+        for subscription in subscriptions:
+            try:
+                built.append((subscription, build_expense_report_email(subscription.user, start_date, end_date)))
+            except Exception as e:
+                failed += 1
+                logger.exception(f"Error building report for subscription ID {subscription.id}: {str(e)}")
+    finally:
+        # Worker threads open their own database connections; don't leak them
+        if close_connections:
+            db_connections.close_all()
+    return built, failed
+
+def _send_report_batch(built, mail_connection):
+    """
+    Send a batch of built report emails over one open mail connection.
+    
+    If the server has dropped the connection (idle timeout, per-connection
+    message limit), it is reopened and the message retried once.
+    
+    Returns:
+        tuple: (subscriptions whose report was sent, number of failures)
+    """
+    sent = []
+    failed = 0
+    for subscription, email in built:
+        try:
+            try:
+                delivered = mail_connection.send_messages([email])
+            except smtplib.SMTPServerDisconnected as e:
+                logger.warning(f"Mail connection dropped ({e}), reconnecting")
+                mail_connection.close()
+                mail_connection.open()
+                delivered = mail_connection.send_messages([email])
+            if delivered:
+                sent.append(subscription)
+            else:
+                failed += 1
+        except Exception as e:
+            failed += 1
+            logger.exception(f"Error sending report to {subscription.user.email}: {str(e)}")
+    return sent, failed
+
+def _record_report_deliveries(sent, period_start):
+    """Write the run ledger and last_sent_at for a delivered batch in one transaction"""
+    from .models import WeeklyReportSubscription, WeeklyReportDelivery
+    from django.db import transaction
+    
+    with transaction.atomic():
+        WeeklyReportDelivery.objects.bulk_create([
+            WeeklyReportDelivery(user_id=subscription.user_id, subscription=subscription, period_start=period_start)
+            for subscription in sent
+        ], ignore_conflicts=True)
+        WeeklyReportSubscription.objects.filter(
+            id__in=[subscription.id for subscription in sent]
+        ).update(last_sent_at=timezone.now())
+
+def parse_shard(value):
+    """
+    Parse an "i/n" shard spec into (index, count), with 0 <= index < count.
+    
+    Raises:
+        ValueError: If the spec is malformed or out of range
+    """
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid shard '{value}', expected the form i/n (e.g. 0/4)")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{value}', index must be between 0 and {count - 1}")
+    return index, count
+
+def send_weekly_expense_reports(workers=None, batch_size=None, mail_connection=None,
+                                shard=None, dry_run=False, sample_size=5):
     """
     Send weekly expense reports to all subscribed users.
     This should be called by a periodic task scheduler.
+    
+    Reports are built by a pool of worker threads, one batch of subscriptions
+    per task. Each batch is sent as soon as it is built, over a single mail
+    connection that stays open for the whole run and is reopened if the
+    server drops it.
+    
+    Runs are idempotent: every delivered batch is written to the
+    WeeklyReportDelivery ledger together with last_sent_at, and users already
+    in the ledger for this week are skipped, so a crashed run can simply be
+    rerun. `shard` splits subscribers by user id so several hosts can share
+    a run.
+    
+    Args:
+        workers (int): Report-building threads, defaults to settings.WEEKLY_REPORT_WORKERS
+        batch_size (int): Subscriptions per batch, defaults to settings.WEEKLY_REPORT_BATCH_SIZE
+        mail_connection: Email backend instance to reuse, defaults to get_connection()
+        shard (tuple): (index, count) to only serve users whose id % count == index
+        dry_run (bool): Only count pending reports and time building a sample of them
+        sample_size (int): Reports built (not sent) to estimate the run time in a dry run
+        
+    Returns:
+        dict: Delivery statistics (counts, timings and throughput)
     """
-    from .models import WeeklyReportSubscription, User
-    from django.utils import timezone
+    from .models import WeeklyReportSubscription, WeeklyReportDelivery
+    from django.core.mail import get_connection
+    from django.db.models import Value
+    from django.db.models.functions import Mod
     import datetime
+    import time
+    from concurrent.futures import ThreadPoolExecutor, as_completed
     
-    logger = logging.getLogger('api')
+    workers = workers or getattr(settings, 'WEEKLY_REPORT_WORKERS', 4)
+    batch_size = batch_size or getattr(settings, 'WEEKLY_REPORT_BATCH_SIZE', 50)
+    
+    started = time.monotonic()
     today = timezone.now().date()
     day_of_week = today.weekday()  # 0=Monday, 6=Sunday
     
-    logger.info(f"Starting weekly report delivery for day of week: {day_of_week}")
+    # Calculate the date range for the past week
+    end_date = today - datetime.timedelta(days=1)  # Yesterday
+    start_date = end_date - datetime.timedelta(days=6)  # 7 days ago
+    
+    logger.info(f"Starting weekly report delivery for day of week: {day_of_week}, shard: {shard or 'all'}")
     
     # Find all active subscriptions for today's day of week
     subscriptions = WeeklyReportSubscription.objects.filter(
         is_active=True,
         day_of_week=day_of_week
-    ).select_related('user')
+    ).select_related('user').order_by('id')
+    if shard:
+        index, count = shard
+        subscriptions = subscriptions.annotate(shard=Mod('user_id', Value(count))).filter(shard=index)
+    subscriptions = list(subscriptions)
     
-    logger.info(f"Found {subscriptions.count()} active subscriptions for today")
+    served = set(
+        WeeklyReportDelivery.objects.filter(period_start=start_date).values_list('user_id', flat=True)
+    )
     
-    # Calculate the date range for the past week
-    end_date = today - datetime.timedelta(days=1)  # Yesterday
-    start_date = end_date - datetime.timedelta(days=6)  # 7 days ago
-    
-    # Send reports to all subscribed users
-    success_count = 0
-    error_count = 0
+    # Skip users without email verification, users already served this week,
+    # and extra subscriptions of the same user
+    pending = []
+    skipped = 0
     for subscription in subscriptions:
-        try:
-            user = subscription.user
-            logger.info(f"Processing report for user: {user.email}")
-            
-            # Skip users without email verification
-            if not user.is_email_verified:
-                logger.warning(f"Skipping unverified user: {user.email}")
-                continue
-                
-            if send_expense_report_email(user, start_date, end_date):
-                success_count += 1
-                # Update last sent timestamp
-                subscription.last_sent_at = timezone.now()
-                subscription.save()
-                logger.info(f"Successfully sent report to {user.email}")
-            else:
-                error_count += 1
-                logger.error(f"Failed to send report to {user.email}")
-        except Exception as e:
-            error_count += 1
-            logger.exception(f"Error processing report for subscription ID {subscription.id}: {str(e)}")
+        if not subscription.user.is_email_verified:
+            skipped += 1
+        elif subscription.user_id not in served:
+            pending.append(subscription)
+            served.add(subscription.user_id)
+    already_sent = len(subscriptions) - skipped - len(pending)
+    logger.info(
+        f"Found {len(subscriptions)} active subscriptions for today: {len(pending)} pending, "
+        f"{already_sent} already sent, {skipped} unverified"
+    )
+    
+    stats = {
+        'subscriptions': len(subscriptions),
+        'pending': len(pending),
+        'already_sent': already_sent,
+        'skipped': skipped,
+        'workers': workers,
+        'dry_run': dry_run,
+    }
+    
+    if dry_run:
+        sample = pending[:sample_size]
+        sample_started = time.monotonic()
+        built, failed = _build_report_batch(sample, start_date, end_date, close_connections=False)
+        per_report = (time.monotonic() - sample_started) / len(sample) if sample else 0.0
+        stats.update({
+            'sampled': len(built),
+            'failed': failed,
+            'seconds_per_report': round(per_report, 4),
+            'estimated_seconds': round(per_report * len(pending) / workers, 2),
+        })
+        logger.info(f"Dry run: {len(pending)} reports pending, estimated {stats['estimated_seconds']}s")
+        return stats
+    
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    sent_count = 0
+    build_failures = 0
+    send_failures = 0
+    send_seconds = 0.0
+    
+    mail_connection = mail_connection or get_connection()
+    mail_connection.open()
+    try:
+        def deliver(built):
+            nonlocal sent_count, send_failures, send_seconds
+            send_started = time.monotonic()
+            sent, failed = _send_report_batch(built, mail_connection)
+            if sent:
+                _record_report_deliveries(sent, start_date)
+            send_seconds += time.monotonic() - send_started
+            sent_count += len(sent)
+            send_failures += failed
+        
+        if workers <= 1:
+            for batch in batches:
+                built, failed = _build_report_batch(batch, start_date, end_date, close_connections=False)
+                build_failures += failed
+                deliver(built)
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='weekly-report') as executor:
+                futures = [
+                    executor.submit(_build_report_batch, batch, start_date, end_date, True)
+                    for batch in batches
+                ]
+                for future in as_completed(futures):
+                    built, failed = future.result()
+                    build_failures += failed
+                    deliver(built)
+    finally:
+        mail_connection.close()
     
-    logger.info(f"Weekly report sending complete: {success_count} succeeded, {error_count} failed")
-    return success_count 
\ No newline at end of file
+    elapsed = time.monotonic() - started
+    stats.update({
+        'sent': sent_count,
+        'failed': build_failures + send_failures,
+        'batches': len(batches),
+        'elapsed_seconds': round(elapsed, 3),
+        'send_seconds': round(send_seconds, 3),
+        'reports_per_second': round(sent_count / elapsed, 2) if elapsed > 0 else 0.0,
+    })
+    logger.info(
+        f"Weekly report sending complete: {stats['sent']} succeeded, {stats['failed']} failed "
+        f"in {stats['elapsed_seconds']}s ({stats['reports_per_second']} reports/s)"
+    )
+    return stats
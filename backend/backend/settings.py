@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -92,7 +93,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': ('rest_framework_simplejwt.authentication.JWTAuthentication',),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.StandardPageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend', 'rest_framework.filters.SearchFilter', 'rest_framework.filters.OrderingFilter'],
 }
@@ -148,3 +149,85 @@ EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', 'Dhp@4604')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'Spendora <no-reply@spendora.space>')
 
 OTP_EXPIRY_TIME = 10  # minutes
+
+EXPENSE_REPORT_MAX_ROWS = 500  # expense rows rendered per report email; None for all
+WEEKLY_REPORT_WORKERS = int(os.environ.get('WEEKLY_REPORT_WORKERS', 4))  # threads building weekly reports
+WEEKLY_REPORT_BATCH_SIZE = int(os.environ.get('WEEKLY_REPORT_BATCH_SIZE', 50))  # reports per build/send batch
+EXPENSE_BULK_MAX_ITEMS = int(os.environ.get('EXPENSE_BULK_MAX_ITEMS', 500))  # items per bulk create/update/delete request
+EXPENSE_IMPORT_BATCH_SIZE = int(os.environ.get('EXPENSE_IMPORT_BATCH_SIZE', 1000))  # rows per bulk_create when importing a CSV
+EXPENSE_IMPORT_MAX_BYTES = 50 * 1024 * 1024  # largest statement CSV accepted for import
+EXPENSE_IMPORT_WORKERS = 1  # concurrent background imports per process
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))  # rows fetched per round trip when exporting
+EXPORT_BLOCK_SIZE = 64 * 1024  # bytes of CSV/NDJSON written to the response at a time
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 500))  # change log entries per /api/sync/changes/ call
+SYNC_BATCH_MAX_OPERATIONS = int(os.environ.get('SYNC_BATCH_MAX_OPERATIONS', 200))  # operations per /api/sync/batch/ request
+SYNC_OPERATION_RETENTION_DAYS = int(os.environ.get('SYNC_OPERATION_RETENTION_DAYS', 30))  # days a batch operation key is replayable
+TIMESERIES_MAX_BUCKETS = int(os.environ.get('TIMESERIES_MAX_BUCKETS', 1000))  # buckets per /api/expenses/timeseries/ series
+
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or None  # OpenAI-compatible endpoint; None for api.openai.com
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 30))  # seconds per completion request
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 2))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 20))  # pooled keep-alive connections per process
+OPENAI_KEEPALIVE_SECONDS = float(os.environ.get('OPENAI_KEEPALIVE_SECONDS', 60))
+
+BACKGROUND_JOBS_EAGER = False  # run api.jobs queues inline (tests)
+EXPENSE_NOTE_WORKERS = int(os.environ.get('EXPENSE_NOTE_WORKERS', 2))  # concurrent background note completions
+EXPENSE_NOTE_MAX_RETRIES = int(os.environ.get('EXPENSE_NOTE_MAX_RETRIES', 3))
+EXPENSE_NOTE_RETRY_DELAY = float(os.environ.get('EXPENSE_NOTE_RETRY_DELAY', 2))  # seconds, doubled per retry
+
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 1200))  # estimated prompt tokens per completion
+CHAT_MESSAGE_TOKEN_LIMIT = 300  # longer messages are truncated in the prompt (not in the database)
+CHAT_HISTORY_MESSAGES = 8  # recent messages considered for the prompt
+CHAT_HISTORY_PAGE_SIZE = 50  # messages per chat history window (clients may ask for up to 100)
+CHAT_SUMMARY_TOKEN_LIMIT = 150  # size of the rolling summary of older messages
+CHAT_SUMMARY_SOURCE_MESSAGES = 50  # older messages read when folding into the summary
+CHAT_SUMMARY_CACHE_SECONDS = 60 * 60 * 24
+
+LLM_CACHE_BACKEND = os.environ.get('LLM_CACHE_BACKEND', 'local')  # 'local' (per-process LRU), 'django' (CACHES alias) or '' to disable
+LLM_CACHE_ALIAS = 'default'  # Django cache used by the 'django' backend
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 60 * 60))  # seconds
+LLM_CACHE_MAX_ENTRIES = 1000  # LRU capacity of the 'local' backend
+
+LLM_MAX_CONCURRENT_CALLS = int(os.environ.get('LLM_MAX_CONCURRENT_CALLS', 8))  # model calls in flight per process
+LLM_MAX_CONCURRENT_CALLS_PER_USER = 2
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 2))  # seconds to wait for a free slot before falling back
+LLM_CALL_TIMEOUT = float(os.environ.get('LLM_CALL_TIMEOUT', 20))  # total seconds per call, queue wait included
+LLM_BREAKER_FAILURE_THRESHOLD = 5  # consecutive failures that open the circuit
+LLM_BREAKER_RECOVERY_SECONDS = 30  # how long the circuit stays open before a trial call
+
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 500))  # rows deleted per transaction by background purges
+PURGE_BATCH_PAUSE = float(os.environ.get('PURGE_BATCH_PAUSE', 0.05))  # seconds between batches, so other writers get the lock
+PURGE_WORKERS = 1  # concurrent purge jobs per process
+PURGE_MAX_RETRIES = 3
+PURGE_RETRY_DELAY = 5  # seconds, doubled per retry
+
+# Read-endpoint payload cache, invalidated per user by a data version (api.data_cache).
+# 'file' is shared by every process on the host (workers and management commands alike);
+# 'locmem' is per process, so only correct for a single process such as runserver;
+# '' disables the cache.
+DATA_CACHE_BACKEND = os.environ.get('DATA_CACHE_BACKEND', 'file')
+if DATA_CACHE_BACKEND not in ('file', 'locmem', ''):
+    raise ImproperlyConfigured(f"DATA_CACHE_BACKEND must be 'file', 'locmem' or empty, not {DATA_CACHE_BACKEND!r}")
+DATA_CACHE_ALIAS = 'data'
+DATA_CACHE_TTL = int(os.environ.get('DATA_CACHE_TTL', 60 * 60))  # seconds
+DATA_CACHE_MAX_ENTRIES = int(os.environ.get('DATA_CACHE_MAX_ENTRIES', 5000))  # entries kept before culling
+DATA_CACHE_DIR = os.environ.get('DATA_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'data'))  # 'file' backend only
+
+# The test runner moves the 'file' backend to a temporary directory (api.test_runner)
+TEST_RUNNER = 'api.test_runner.TestRunner'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    DATA_CACHE_ALIAS: {
+        'BACKEND': {
+            'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+            'file': 'django.core.cache.backends.filebased.FileBasedCache',
+        }.get(DATA_CACHE_BACKEND, 'django.core.cache.backends.dummy.DummyCache'),
+        'LOCATION': DATA_CACHE_DIR if DATA_CACHE_BACKEND == 'file' else 'spendora-data',
+        'TIMEOUT': DATA_CACHE_TTL,
+        # A quarter of the entries is culled when the cache is full
+        'OPTIONS': {'MAX_ENTRIES': DATA_CACHE_MAX_ENTRIES, 'CULL_FREQUENCY': 4},
+    },
+}
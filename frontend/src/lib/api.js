@@ -74,6 +74,8 @@ export const expenseAPI = {
   update: (id, data) => apiCall(axios.put, `/expenses/${id}/`, data),
   delete: (id) => apiCall(axios.delete, `/expenses/${id}/`),
   getSummary: (params) => apiCall(axios.get, '/expenses/summary/', { params }),
+  // params: start, end (YYYY-MM-DD), granularity (day, week, month, year), by_category, tz
+  getTimeseries: (params) => apiCall(axios.get, '/expenses/timeseries/', { params }),
   emailReport: (data) => apiCall(axios.post, '/expenses/email_report/', data),
 };
 
@@ -87,6 +89,12 @@ export const incomeAPI = {
   getTotal: () => apiCall(axios.get, '/incomes/total/'),
 };
 
+// API functions for the Dashboard
+export const dashboardAPI = {
+  // sections: comma separated subset of me, categories, expense_summary, income_total, recent_expenses
+  get: (params) => apiCall(axios.get, '/dashboard/', { params }),
+};
+
 // API functions for Weekly Report Subscriptions
 export const weeklyReportAPI = {
   getAll: () => apiCall(axios.get, '/weekly-reports/'),
@@ -7,6 +7,9 @@ import { useAuth } from '../context/AuthContext';
 import axios from '../lib/axiosConfig';
 import toast from 'react-hot-toast';
 
+// Matches CHAT_HISTORY_PAGE_SIZE on the backend
+const HISTORY_PAGE_SIZE = 50;
+
 const Chat = () => {
   const { token } = useAuth();
   const [messages, setMessages] = useState([
@@ -20,6 +23,8 @@ const Chat = () => {
   const [loading, setLoading] = useState(false);
   const [testMode, setTestMode] = useState(false);
   const [initialLoading, setInitialLoading] = useState(true);
+  const [hasOlder, setHasOlder] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const messagesEndRef = useRef(null);
 
   // Fetch chat history when component mounts
@@ -55,6 +60,8 @@ const Chat = () => {
           
           console.log('Formatted messages:', formattedMessages);
           setMessages(formattedMessages);
+          // The first response is the newest window; a full window may have older messages behind it
+          setHasOlder(response.data.length >= HISTORY_PAGE_SIZE);
         } else {
           console.log('No chat history found or empty response');
           // Set default welcome message if no history
@@ -96,6 +103,28 @@ const Chat = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [messages]);
 
+  const loadOlderMessages = async () => {
+    if (!messages.length) return;
+    setLoadingOlder(true);
+    try {
+      const response = await axios.get('/chat/history/', {
+        params: { before_id: messages[0].id, limit: HISTORY_PAGE_SIZE }
+      });
+      const older = response.data.results.map(msg => ({
+        id: msg.id,
+        text: msg.content,
+        sender: msg.role
+      }));
+      setMessages(prev => [...older, ...prev]);
+      setHasOlder(response.data.has_more);
+    } catch (error) {
+      console.error('Failed to load earlier messages:', error);
+      toast.error('Failed to load earlier messages');
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const handleDebug = async () => {
     try {
       const response = await axios.get('/chat/debug/');
@@ -131,6 +160,7 @@ const Chat = () => {
           text: "Hello! I'm your expense assistant. You can ask me to record expenses like 'I spent $20 on lunch today' or ask questions like 'How much did I spend on food last week?'", 
           sender: 'assistant' 
         }]);
+        setHasOlder(false);
         
         toast.success('Chat history cleared successfully');
       } catch (error) {
@@ -274,6 +304,13 @@ const Chat = () => {
           </Box>
         ) : (
           <>
+            {hasOlder && (
+              <Box sx={{ display: 'flex', justifyContent: 'center', mb: 2 }}>
+                <Button size="small" onClick={loadOlderMessages} disabled={loadingOlder}>
+                  {loadingOlder ? 'Loading...' : 'Load earlier messages'}
+                </Button>
+              </Box>
+            )}
             {messages.map((message) => (
               <Box 
                 key={message.id}
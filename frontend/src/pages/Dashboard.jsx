@@ -46,7 +46,7 @@ import {
   CurrencyRupee as CurrencyRupeeIcon,
   Category as CategoryIcon
 } from '@mui/icons-material';
-import { expenseAPI, incomeAPI, categoryAPI } from '../lib/api';
+import { dashboardAPI } from '../lib/api';
 import { useAuth } from '../context/AuthContext';
 import './Dashboard.css';
 
@@ -75,13 +75,15 @@ const Dashboard = () => {
     const fetchDashboardData = async () => {
       setLoading(true);
       try {
-        // Fetch expense summary
-        const summaryRes = await expenseAPI.getSummary({ period: timeFilter });
-        setExpenseSummary(summaryRes.data);
-        
-        // Fetch income summary
-        const incomeRes = await incomeAPI.getTotal();
-        setIncomeSummary(incomeRes.data);
+        // Fetch the expense and income summaries in one request
+        const dashboardRes = await dashboardAPI.get({
+          sections: 'expense_summary,income_total',
+          period: timeFilter,
+          // Count days in the browser's timezone rather than the server's
+          tz: Intl.DateTimeFormat().resolvedOptions().timeZone
+        });
+        setExpenseSummary(dashboardRes.data.expense_summary);
+        setIncomeSummary(dashboardRes.data.income_total);
       } catch (error) {
         console.error('Error fetching dashboard data:', error);
       } finally {